@@ -44,37 +44,118 @@ try:
 except NameError:
     pass
 
-# Imports QuarchPy library, providing the functions needed to use Quarch modules
-from quarchpy.device import *
-from QuarchpyQCS.hostInformation import HostInformation
-from quarchpy.user_interface import *
-from quarchpy.user_interface.user_interface import displayTable
+# QuarchPy and QuarchQCS provide the functions needed to use Quarch modules and find drives.  They are imported
+# on first use (see "Deferred QuarchPy / QCS access" below) so start up doesn't wait on them.
 
 # Import other libraries used in the examples
 import os
 import time
+import argparse
 import datetime
 import logging
+import threading
+import traceback
+
+from presence_watcher import PresenceWatcher
+from sysfs_probe import SysfsDriveProbe
+from multi_slot import HotplugSlot, PullCoordinator, SlotScheduler, SlotAborted
+from log_pipeline import LogPipeline
+from results_store import CycleRecord, ResultsStore, NOT_REMOVED, NOT_RETURNED, LINK_MISMATCH, MODULE_ERROR
+from module_state import ModuleState, delay_limit
+from hotplug_sequence import HotplugSequence, validate_sequences, load_sequences, random_sequences
+from run_supervisor import SupervisedDevice, ModuleCommandError, FATAL, TRANSIENT, classify_reply
+from threshold_search import ThresholdSearch
+from test_plan import TestPlan, Checkpoint
+from simulation import SimulatedRig
+from link_sampler import LinkTrainingSampler
+from kmsg_reader import KernelLogReader, kernel_detection_time, REMOVAL_PATTERN, ENUMERATION_PATTERN
+from io_workload import IoWorkload
+from power_capture import PowerCapture, StreamFileSource, SyntheticPowerSource, numpy_available
+from metrics_exporter import MetricsExporter
+from discovery_cache import DiscoveryCache
+from drive_inventory import DriveInventory, stable_drive_key, drive_keys
 
 
 # Creating a path for the log file to be written to.
 logFilePath = os.path.join(os.getcwd(), "LogFile" + str(datetime.datetime.now()).replace(':', '_') + ".txt")
 
-# Reference to hostInformation class for drive detection functionality.
-myHostInfo = HostInformation()
+# Background writer for the log file and console, so logging never waits on file I/O mid-cycle.
+logPipeline = LogPipeline(logFilePath)
+
+# Per-cycle results are streamed to a JSON Lines file alongside the log file.
+resultsFilePath = os.path.splitext(logFilePath)[0].replace("LogFile", "Results", 1) + ".jsonl"
+resultsStore = None
+
+# Reference to hostInformation class for drive detection functionality, created on first use (get_host_info).
+myHostInfo = None
+
+# Simulated modules and host, when running with --simulate or "SIM:" module strings.
+simulatedRig = None
 
 # List of failures encountered - if any.
 summary_list = []
 
+# Kernel event driven drive presence detection, started on first use.
+presenceWatcher = None
+
+# Index of the drives on the host, kept current from hotplug events rather than rescanning the whole host.
+driveInventory = None
+
+# Native sysfs probe (Linux only), used in place of lspci / smartctl where it can resolve the drive.
+driveProbe = None
+
+# Background /dev/kmsg reader (Linux, needs root), started on first use.
+kernelLog = None
+
+# Background I/O load kept running against the drive across cycles, when a workload target is configured.
+ioWorkload = None
+
+# Streaming power capture, summarising inrush / discharge for each cycle when a power source is configured.
+powerCapture = None
+
+# Prometheus endpoint serving live cycle counts and latencies, when a metrics port is configured.
+metricsExporter = None
 
-def main():
+# Slots running concurrently share the watcher and probe, which are created lazily under this lock.
+setupLock = threading.RLock()
+
+# HostInformation is not thread safe, so concurrent slots share it through this lock.
+hostInfoLock = threading.Lock()
+
+# Per-thread log prefix, set for each slot when running several slots concurrently.
+logContext = threading.local()
+
+# Cached timing configuration of each module in use, keyed by the module wrapper object.
+moduleStates = {}
+
+# Module power state queries, checked before a power command is sent again after a lost reply.
+POWERED_OFF = ("run:power?", "OFF")
+POWERED_ON = ("run:power?", "ON")
+
+
+def main(argv=None):
     """
     Main function for running test.
+
+    :param argv: List<String> (optional) - Command line arguments, defaults to sys.argv
     """
-    logging.basicConfig(filename='output.log',
-     level=logging.DEBUG,
-     format= '[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s',
-     datefmt='%H:%M:%S')
+    parser = argparse.ArgumentParser(description="AN-003 Plugfest hotswap test")
+    parser.add_argument("--plan", help="Run non-interactively from a JSON test plan, resuming from its checkpoint")
+    parser.add_argument("--simulate", type=int, nargs="?", const=1, metavar="SLOTS",
+                        help="Run against simulated modules and drives instead of real hardware")
+    parser.add_argument("--fault-rate", type=float, default=0.0, metavar="RATE",
+                        help="With --simulate, chance of each module command failing, to exercise recovery")
+    args = parser.parse_args(argv)
+    plan = checkpoint = None
+    if args.plan:
+        plan = TestPlan.load(args.plan)
+        checkpoint = setup_plan_files(plan)
+    if args.simulate:
+        useSimulation(SimulatedRig(slots=args.simulate, fault_rate=args.fault_rate))
+    if plan:
+        return runTestPlan(plan, checkpoint)
+
+    setupLogging()
 
     # Setting parameters that control the test
     onTimeout = 10  # Timeout (s) to poll for drive insertion
@@ -85,35 +166,94 @@ def main():
     linkSpeed = "ERROR"
     linkWidth = "ERROR"
 
+    # To test several bays at once, list a (module connection string, drive identifier) pair for each slot.
+    # Selection is skipped and all slots run concurrently.  e.g. [("USB:QTL1743-03-001", "0000:5e:00.0"), ...]
+    multiSlots = []
+    pullMode = "staggered"  # "independent", "staggered" or "overlap" (simultaneous surprise removal)
+    pullStagger = 1.0  # Minimum time (s) between pulls of different slots in staggered mode
+
+    # Threshold search mode: instead of the plugSpeeds grid, bisect a delay range to find where the drive fails
+    searchMode = False
+    searchRange = (1, 1270)  # Delay range (mS) to search, clamped to the module's limits
+    searchRepeats = 1  # Cycles at each probed delay
+    searchBoundaryRepeats = 5  # Cycles the passing side of the boundary must pass to be confirmed
+    searchSource = None  # Search the delay of a single source (1-6) instead of the whole ramp
+
+    # Timing sequences (per source delays and pin-bounce patterns, see hotplug_sequence.py) to run instead of plugSpeeds
+    sequenceFile = None  # JSON file listing the sequences
+    randomSequences = 0  # Or this many random sequences within the module's limits, to fuzz the drive
+    randomSeed = None  # Seed for the random sequences, to repeat a sweep
+
+    # I/O workload kept running against the drive through every cycle, e.g. "/dev/nvme0n1" or a test file
+    workloadPath = None
+    workloadBlockSize = 4096  # Bytes per I/O
+    workloadQueueDepth = 8  # I/Os in flight
+    workloadReadRatio = 1.0  # Fraction of reads.  Anything below 1.0 overwrites data on the target!
+
+    # Power capture (needs NumPy): file a Quarch power module is streaming to, or "synthetic" for a generated signal
+    powerStream = None
+    powerSampleRate = 50000  # Samples per second of the stream
+    powerRawWindows = None  # Also save raw samples around each command: None, "failures" or "all"
+
+    metricsPort = None  # Serve live Prometheus metrics on this local port, e.g. 9464
+
+    # Reconnect straight to the module and drive used last time, only scanning and asking if they are not found
+    useDiscoveryCache = True
+
     # Check admin permissions (exits on failure)
     if not is_user_admin():
         logWrite("Application note must be run with administrative privileges.")
 
     # Print header intro text
-    logWrite("Quarch Technology Ltd")
-    logWrite("HotPlug Test Suite V3.0")
-    logWrite("(c) Quarch Technology Ltd 2015-2023")
-    logWrite("")
+    printHeader()
 
-    # Scan for quarch devices over all connection types (USB, Serial and LAN)
-    logWrite("Scanning for devices...\n")
-    deviceList = scanDevices('all', favouriteOnly=False)
+    if metricsPort:
+        start_metrics_exporter(metricsPort)
 
-    # You can work with the deviceList dictionary yourself, or use the inbuilt 'selector' functions to help
-    # Here we use the user selection function to display the list on screen and return the module connection string
-    # for the selected device
-    moduleStr = userSelectDevice(deviceList, additionalOptions=["Rescan", "All Conn Types", "Quit"], nice=True)
-    if moduleStr == "quit":
+    if multiSlots:
+        slots = [HotplugSlot("Slot " + str(i + 1), moduleStr, driveId)
+                 for i, (moduleStr, driveId) in enumerate(multiSlots)]
+        runMultiSlot(slots, cycleIterations, mappingMode, offTimeout, onTimeout, plugSpeeds,
+                     PullCoordinator(pullMode, pullStagger))
+        stop_shared_resources()
         return 0
 
+    discovery = DiscoveryCache.load() if useDiscoveryCache and not simulatedRig else None
+    myDevice, moduleStr = reconnect_cached_module(discovery)
+    useCachedDrive = True
+    if myDevice is not None and not confirm_cached_rig(discovery):
+        # Rescan for both, the cache is updated with whatever is picked
+        myDevice.closeConnection()
+        myDevice, moduleStr = None, None
+        useCachedDrive = False
+
+    if simulatedRig:
+        moduleStr = simulatedRig.module_strings()[0]
+    elif myDevice is None:
+        # Scan for quarch devices over all connection types (USB, Serial and LAN)
+        logWrite("Scanning for devices...\n")
+        deviceList = scanDevices('all', favouriteOnly=False)
+
+        # You can work with the deviceList dictionary yourself, or use the inbuilt 'selector' functions to help
+        # Here we use the user selection function to display the list on screen and return the module connection
+        # string for the selected device
+        logPipeline.flush()
+        moduleStr = userSelectDevice(deviceList, additionalOptions=["Rescan", "All Conn Types", "Quit"], nice=True)
+        if moduleStr == "quit":
+            return 0
+
     # If you know the name of the module you would like to talk to then you can skip
     # module selection and hardcode the string.
     # moduleStr = "USB:QTL2266-01-001"
 
     # Create a device using the module connection string
-    logWrite("\n\nConnecting to the selected device")
-    myDevice = getQuarchDevice(moduleStr)
-    logWrite("\nConnected to module: " + myDevice.sendCommand("hello?"))
+    if myDevice is None:
+        logWrite("\n\nConnecting to the selected device")
+        myDevice = connectToModule(moduleStr)
+    moduleName = myDevice.sendCommand("hello?")
+    logWrite("\nConnected to module: " + moduleName)
+    if discovery:
+        discovery.remember(module=moduleStr, module_name=moduleName)
 
     # Sets the module to default state
     setDefaultState(myDevice)
@@ -125,30 +265,50 @@ def main():
     # Alternatively, consider enquiring about potential modules with newer functionality.
     is_legacy_module = check_legacy_timings(myDevice)
 
-    logWrite("Running power up..." + myDevice.sendCommand("run pow up"))
-
-    # Retrieve a list of drives located on system and format into a list
-    listOfDrives = retrieve_list_of_found_drives()
+    # Every sequence is checked against the module's limits before the first cycle
+    if sequenceFile or randomSequences:
+        plugSpeeds = load_sequences(sequenceFile) if sequenceFile else \
+            random_sequences(randomSequences, delay_limit(is_legacy_module), randomSeed)
+        check_sequences(myDevice, plugSpeeds, is_legacy_module)
 
-    # Asking user to select their drive from the list of drives found.
-    selectedDrive = None
-    while selectedDrive is None or selectedDrive in "Rescan":
-        selectedDrive = listSelection(selectionList=listOfDrives, nice=True, additionalOptions=["Rescan", "Quit"],
-                                      tableHeaders=["Drive"], align="c")
+    logWrite("Running power up..." + myDevice.sendCommand("run pow up"))
 
+    myDrive = find_cached_drive(discovery) if useCachedDrive else None
+    if myDrive is None:
+        # Retrieve a list of drives located on system and format into a list
         listOfDrives = retrieve_list_of_found_drives()
 
-    if selectedDrive in "Quit":
-        printText("User quit program")
-        exitScript(myDevice)
-        exit(1)
-
-    # Deconstructing the drive chosen to get the drive wrapper object for use in test.
-    selectedDrive = selectedDrive.split(":-")
-    myDrive = myHostInfo.get_wrapped_drive_from_choice(selectedDrive[0])
+        # Asking user to select their drive from the list of drives found.  The list is only brought up to date
+        # when asked to rescan, and then only costs a host scan if a drive the inventory doesn't know has appeared.
+        selectedDrive = None
+        while selectedDrive is None or selectedDrive in "Rescan":
+            if selectedDrive is not None:
+                listOfDrives = retrieve_list_of_found_drives()
+            logPipeline.flush()
+            selectedDrive = listSelection(selectionList=listOfDrives, nice=True, additionalOptions=["Rescan", "Quit"],
+                                          tableHeaders=["Drive"], align="c")
+
+        if selectedDrive in "Quit":
+            printText("User quit program")
+            exitScript(myDevice)
+            exit(1)
+
+        # Map the menu entry chosen back to the drive wrapper object for use in test.
+        myDrive = find_drive(selectedDrive)
+        if discovery and myDrive is not None and stable_drive_key(myDrive):
+            discovery.remember(drive_key=stable_drive_key(myDrive), drive_label=myDrive.identifier_str)
+    logWrite("Drive under test: " + myDrive.identifier_str + " :- " + myDrive.description)
+
+    if workloadPath:
+        start_io_workload(workloadPath, workloadBlockSize, workloadQueueDepth, workloadReadRatio)
+    if powerStream:
+        start_power_capture(powerStream, powerSampleRate, powerRawWindows)
 
     # If the drive is PCIE, do link verification on drive too
-    if myDrive.drive_type == "pcie":
+    if searchMode:
+        searchPlugThreshold(myDevice, myDrive, searchRange, offTimeout, onTimeout, is_legacy_module,
+                            searchRepeats, searchBoundaryRepeats, searchSource)
+    elif myDrive.drive_type == "pcie":
         pcieHotplug(cycleIterations, mappingMode, myDevice, offTimeout, onTimeout, myDrive, plugSpeeds,
                     is_legacy_module)
     else:
@@ -158,9 +318,11 @@ def main():
     logWrite("")
 
     logWrite("Test Complete")
+    displayResultsSummary()
 
     # Adding a table of results if there were any failures.
     if summary_list:
+        logPipeline.flush()
         displayTable(summary_list, align="l", tableHeaders=["Delay (mS)", "Test iteration", "Failure description"])
     else:
         logWrite("All tests Passed!")
@@ -169,14 +331,728 @@ def main():
 
     # Close the module before exiting the script
     myDevice.closeConnection()
+    stop_shared_resources()
+
+
+def setupLogging():
+    """
+    Route debug logging into the same log file as the test output.
+    """
+    logging.basicConfig(level=logging.DEBUG,
+     handlers=[logPipeline.handler(fmt='[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s',
+                                   datefmt='%H:%M:%S')])
+
+
+def printHeader():
+    logWrite("Quarch Technology Ltd")
+    logWrite("HotPlug Test Suite V3.0")
+    logWrite("(c) Quarch Technology Ltd 2015-2023")
+    logWrite("")
+
+
+def setup_plan_files(plan):
+    """
+    Load the checkpoint of a test plan and point the log and results at the plan's files.  A resumed run carries
+    on writing to the files of the original run.  Must be called before anything is logged, the log file is opened
+    with the first line.
+
+    :param plan: TestPlan obj - Plan to run
+    :return: Checkpoint obj - Progress of the plan
+    """
+    global logFilePath, resultsFilePath
+    checkpoint = Checkpoint.load_or_create(plan)
+    if checkpoint.resumed:
+        logFilePath = checkpoint.log_file or logFilePath
+        resultsFilePath = checkpoint.results_file or resultsFilePath
+    checkpoint.log_file, checkpoint.results_file = logFilePath, resultsFilePath
+    logPipeline.path = logFilePath
+    return checkpoint
+
+
+def runTestPlan(plan, checkpoint=None):
+    """
+    Run a test plan without any user interaction, checkpointing progress so that a crashed or interrupted run
+    carries on from the last completed cycle when started again with the same plan.
+
+    :param plan: TestPlan obj - Module, drive and test parameters
+    :param checkpoint: Checkpoint obj (optional) - From setup_plan_files(), if it had to be called earlier
+    :return: int - 0 if all cycles passed, 1 otherwise
+    """
+    if checkpoint is None:
+        checkpoint = setup_plan_files(plan)
+    setupLogging()
+    printHeader()
+
+    if checkpoint.resumed:
+        logWrite("Resuming test plan " + str(plan.path) + " after cycle " + str(checkpoint.completed) + "/" +
+                 str(plan.total_cycles))
+        # Cycles completed after the last checkpoint save run again, drop the records they left
+        get_results_store().reload(keep=checkpoint.completed)
+    else:
+        logWrite("Running test plan " + str(plan.path) + " (" + str(plan.total_cycles) + " cycles)")
+
+    if plan.metrics_port:
+        start_metrics_exporter(plan.metrics_port)
+
+    logWrite("\nConnecting to " + plan.module)
+    myDevice = connectToModule(plan.module)
+    logWrite("Connected to module: " + myDevice.sendCommand("hello?"))
+    setDefaultState(myDevice)
+    is_legacy_module = check_legacy_timings(myDevice)
+    if plan.sequences:
+        check_sequences(myDevice, plan.sequences, is_legacy_module)
+    logWrite("Running power up..." + myDevice.sendCommand("run pow up"))
+
+    myDrive = find_drive(plan.drive)
+    if myDrive is None:
+        exitScript(myDevice, "Drive " + plan.drive + " from the test plan was not found")
+    logWrite("Drive under test: " + myDrive.identifier_str + " :- " + myDrive.description)
+    linkStart = get_start_link(myDrive) if myDrive.drive_type == "pcie" else None
+    if plan.workload:
+        start_io_workload(**plan.workload)
+    if plan.power:
+        start_power_capture(**plan.power)
+
+    for index, testDelay, currentIteration in plan.cycles(checkpoint.completed):
+        hotplugCycle(myDevice, myDrive, testDelay, currentIteration, plan.cycle_iterations, plan.off_timeout,
+                     plan.on_timeout, is_legacy_module, checkpoint.failures, linkStart=linkStart)
+        checkpoint.cycle_done(index, plan.checkpoint_every)
+    checkpoint.finish()
+
+    logWrite("")
+    logWrite("Test Complete")
+    displayResultsSummary()
+    if checkpoint.failures:
+        logPipeline.flush()
+        displayTable(checkpoint.failures, align="l", tableHeaders=["Delay (mS)", "Test iteration", "Failure description"])
+    else:
+        logWrite("All tests Passed!")
+    logWrite("")
+
+    myDevice.closeConnection()
+    stop_shared_resources()
+    return 1 if checkpoint.failures else 0
+
+
+def runMultiSlot(slots, cycleIterations, mappingMode, offTimeout, onTimeout, plugSpeeds, coordinator):
+    """
+    Run the hotplug test on several (module, drive) pairs concurrently, one thread per slot.
+
+    :param slots: List<HotplugSlot> - Slots to test
+    :param cycleIterations: int - Number of times to perform hotplug at each speed
+    :param mappingMode:
+    :param offTimeout: int - Max time (Seconds) to poll for drive removal on system
+    :param onTimeout: int - Max time (Seconds) to poll for drive insertion on system
+    :param plugSpeeds: List<int> - List of hotplug delay speeds
+    :param coordinator: PullCoordinator obj - Controls how pulls on different slots line up
+    """
+
+    def run_slot(slot, coordinator):
+        logContext.prefix = "[" + slot.name + "] "
+        logContext.slot = slot.name
+        slot.device = connectToModule(slot.module_str)
+        try:
+            logWrite("Connected to module: " + slot.device.sendCommand("hello?"))
+            setDefaultState(slot.device)
+            slot.is_legacy = check_legacy_timings(slot.device)
+            logWrite("Running power up..." + slot.device.sendCommand("run pow up"))
+            slot.drive = find_drive(slot.drive_id)
+            if slot.drive is None:
+                raise LookupError("Drive " + slot.drive_id + " not found")
+
+            hotplug = pcieHotplug if slot.drive.drive_type == "pcie" else basicHotplug
+            hotplug(cycleIterations, mappingMode, slot.device, offTimeout, onTimeout, slot.drive, plugSpeeds,
+                    slot.is_legacy, summary=slot.summary, pull_gate=coordinator.before_pull)
+        except SlotAborted:
+            # exitScript() has already reset this slot's module
+            raise
+        except Exception:
+            # Don't leave the drive powered down while the other slots carry on
+            try:
+                setDefaultState(slot.device)
+            except Exception as resetErr:
+                logging.warning("Module could not be reset: " + str(resetErr))
+            raise
+        finally:
+            slot.device.closeConnection()
+
+    logWrite("Running " + str(len(slots)) + " slots concurrently, " + coordinator.mode + " pulls")
+    SlotScheduler(slots, run_slot, coordinator).run()
+
+    logWrite("")
+    logWrite("Test Complete")
+    displayResultsSummary()
+    results = []
+    for slot in slots:
+        if slot.error is not None:
+            results.append([slot.name, "-", "-", "Slot stopped: " + (str(slot.error) or type(slot.error).__name__)])
+        for failure in slot.summary:
+            results.append([slot.name] + failure)
+    if results:
+        logPipeline.flush()
+        displayTable(results, align="l", tableHeaders=["Slot", "Delay (mS)", "Test iteration", "Failure description"])
+    else:
+        logWrite("All tests Passed!")
+    logWrite("")
+
+
+def useSimulation(rig):
+    """
+    Swap the host backend for a simulated one.  "SIM:" module strings then connect to the rig's simulated modules.
+
+    :param rig: SimulatedRig obj - Simulated host, modules and drives
+    """
+    global myHostInfo, simulatedRig, driveProbe
+    simulatedRig = rig
+    myHostInfo = rig.host
+    # The sysfs probe would be looking at the real host
+    driveProbe = False
+    logWrite("Using simulated modules: " + ", ".join(rig.module_strings()))
+
+
+def connectToModule(moduleStr, retries=4):
+    """
+    Create a device for the module connection string, using the simulated backend for "SIM:" strings.
+    Commands that fail to get through are retried, reconnecting to the module if needed (see run_supervisor.py).
+
+    :param moduleStr: String - Module connection string
+    :param retries: int - Retries per command before giving up on it
+    :return: SupervisedDevice obj - Module wrapper
+    """
+    def open_connection():
+        if SimulatedRig.is_simulated(moduleStr):
+            if simulatedRig is None:
+                useSimulation(SimulatedRig())
+            return simulatedRig.connect(moduleStr)
+        return getQuarchDevice(moduleStr)
+
+    return SupervisedDevice(open_connection, retries=retries, on_reconnect=restoreModuleState)
+
+
+def restoreModuleState(my_device):
+    """
+    Re-apply the cached timing configuration after reconnecting to a module.
+
+    :param my_device: SupervisedDevice obj - Module wrapper, already reconnected
+    """
+    logWrite("Reconnected to module, restoring its configuration")
+    failures = get_module_state(my_device).reapply()
+    if failures:
+        raise ModuleCommandError(failures[0][0], failures[0][1], TRANSIENT)
+
+
+# Deferred QuarchPy / QCS access.  The packages are only imported, and HostInformation only created, the first time
+# they are needed; Python caches the imports, so later calls cost a dictionary lookup.
+
+def get_host_info():
+    """
+    :return: HostInformation obj - Drive detection backend (or the simulated host), created on first use
+    """
+    global myHostInfo
+    if myHostInfo is None:
+        with setupLock:
+            if myHostInfo is None:
+                from QuarchpyQCS.hostInformation import HostInformation
+                myHostInfo = HostInformation()
+    return myHostInfo
+
+
+def scanDevices(*args, **kwargs):
+    from quarchpy.device import scanDevices as quarchScanDevices
+    return quarchScanDevices(*args, **kwargs)
+
+
+def getQuarchDevice(*args, **kwargs):
+    from quarchpy.device import getQuarchDevice as quarchGetDevice
+    return quarchGetDevice(*args, **kwargs)
+
+
+def userSelectDevice(*args, **kwargs):
+    from quarchpy.user_interface import userSelectDevice as quarchUserSelectDevice
+    return quarchUserSelectDevice(*args, **kwargs)
+
+
+def listSelection(*args, **kwargs):
+    try:
+        from quarchpy.user_interface import listSelection as quarchListSelection
+    except ImportError:
+        if simulatedRig is None:
+            raise
+        # Simulated runs don't need QuarchPy installed, a plain numbered menu does instead
+        return _plainListSelection(*args, **kwargs)
+    return quarchListSelection(*args, **kwargs)
+
+
+def printText(*args, **kwargs):
+    try:
+        from quarchpy.user_interface import printText as quarchPrintText
+    except ImportError:
+        if simulatedRig is None:
+            raise
+        return print(*args)
+    return quarchPrintText(*args, **kwargs)
+
+
+def displayTable(*args, **kwargs):
+    try:
+        from quarchpy.user_interface.user_interface import displayTable as quarchDisplayTable
+    except ImportError:
+        if simulatedRig is None:
+            raise
+        return _plainDisplayTable(*args, **kwargs)
+    return quarchDisplayTable(*args, **kwargs)
+
+
+def _plainListSelection(selectionList=None, additionalOptions=None, **kwargs):
+    """
+    Numbered console menu standing in for QuarchPy's listSelection.
+
+    :return: String - The entry or additional option chosen, "Quit" if the input ends
+    """
+    options = list(selectionList or []) + list(additionalOptions or [])
+    while True:
+        for number, option in enumerate(options, 1):
+            print(str(number) + " - " + str(option))
+        try:
+            choice = input("Please select an option: ").strip()
+        except EOFError:
+            return "Quit"
+        if choice.isdigit() and 1 <= int(choice) <= len(options):
+            return options[int(choice) - 1]
+
+
+def _plainDisplayTable(rows, align=None, tableHeaders=None):
+    """
+    Plain text table standing in for QuarchPy's displayTable.
+    """
+    table = ([tableHeaders] if tableHeaders else []) + [[str(cell) for cell in row] for row in rows]
+    if not table:
+        return
+    widths = [max(len(str(line[column])) for line in table if column < len(line))
+              for column in range(max(len(line) for line in table))]
+    for line in table:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(line, widths)).rstrip())
+
+
+def reconnect_cached_module(discovery):
+    """
+    Try the module used last time directly, skipping the device scan.
+
+    :param discovery: DiscoveryCache obj (optional) - Last used module and drive
+    :return: (QuarchDevice obj, String) - Connected module and its connection string, (None, None) if it is not
+             cached or did not answer
+    """
+    if not discovery or not discovery.module:
+        return None, None
+    logWrite("Reconnecting to last used module " + discovery.module + "...")
+    myDevice = None
+    try:
+        myDevice = connectToModule(discovery.module, retries=0)
+        response = myDevice.sendCommand("hello?")
+    except Exception as err:
+        logging.debug("Reconnect to " + discovery.module + " failed: " + str(err))
+        response = None
+    if response and "FAIL" in response.upper():
+        response = None
+    if response and discovery.module_name and response.strip() != discovery.module_name.strip():
+        # The connection string now leads to a different module, e.g. a re-used IP address or serial port
+        logWrite("Found " + response.strip() + " instead of " + discovery.module_name.strip())
+        response = None
+    if not response or not discovery.module_name:
+        logWrite("Last used module not found, scanning for devices")
+        if myDevice is not None:
+            try:
+                myDevice.closeConnection()
+            except Exception:
+                pass
+        discovery.forget()
+        return None, None
+    return myDevice, discovery.module
+
+
+def confirm_cached_rig(discovery):
+    """
+    Show the cached module and drive and let the user keep them or rescan with a single key.
+
+    :param discovery: DiscoveryCache obj - Last used module and drive
+    :return: Boolean - True to use the cached pair
+    """
+    logPipeline.flush()
+    print("\nLast used module: " + discovery.module + " (" + discovery.module_name.strip() + ")")
+    if discovery.drive_key:
+        print("Last tested drive: " + (discovery.drive_label or discovery.drive_key) + " (" + discovery.drive_key + ")")
+    try:
+        choice = input("Press Enter to use them again, or R to rescan: ").strip().lower()
+    except EOFError:
+        choice = ""
+    return not choice.startswith("r")
+
+
+def find_cached_drive(discovery):
+    """
+    Look for the drive tested last time by its serial number / WWN or PCI address, skipping the drive scan and
+    selection.
+
+    :param discovery: DiscoveryCache obj (optional) - Last used module and drive
+    :return: DriveWrapper obj or None if it is not cached or not present
+    """
+    if not discovery or not discovery.drive_key:
+        return None
+    try:
+        myDrive = find_drive(discovery.drive_key)
+    except Exception as err:
+        logging.debug("Cached drive lookup failed: " + str(err))
+        myDrive = None
+    if myDrive is not None and discovery.drive_key not in drive_keys(myDrive):
+        # Only a drive reporting the cached serial number / WWN (or sitting at the cached address) will do
+        myDrive = None
+    label = discovery.drive_label or discovery.drive_key
+    if myDrive is None or not is_drive_present(myDrive):
+        logWrite("Last tested drive " + label + " not found")
+        return None
+    logWrite("Using last tested drive " + myDrive.identifier_str + " (" + discovery.drive_key + ")")
+    return myDrive
 
 
 def retrieve_list_of_found_drives():
-    # Retrieving a list of drives located on the system
-    listOfDrives = myHostInfo.return_wrapped_drives()
-    # Formatting list into 'nice' layout for user
-    listOfDrives = _return_drives_as_list(listOfDrives)
-    return listOfDrives
+    """
+    :return: List<String> - Menu entries ("<identifier> :- <description>") of the drives currently on the host
+    """
+    inventory = get_drive_inventory()
+    inventory.refresh()
+    return inventory.choices()
+
+
+def get_drive_inventory():
+    """
+    Return the drive inventory, subscribing it to hotplug events on first use.
+
+    :return: DriveInventory obj
+    """
+    global driveInventory
+    with setupLock:
+        if driveInventory is None:
+            driveInventory = DriveInventory(scan_host_drives)
+            watcher = get_presence_watcher()
+            watcher.add_listener(driveInventory.on_event)
+            # Without an event source changes go unseen, so every refresh has to scan
+            driveInventory.tracking = watcher.source_name != "interval"
+    return driveInventory
+
+
+def scan_host_drives():
+    """
+    :return: List<DriveWrapper> - Every drive the host backend can see.  Slow, only the inventory should call it.
+    """
+    with hostInfoLock:
+        return get_host_info().return_wrapped_drives()
+
+
+def find_drive(identifier):
+    """
+    Find a drive by menu entry, serial number, WWN, PCI address or identifier.
+
+    :param identifier: String - Any of the drive's identifiers
+    :return: DriveWrapper obj or None if the drive is not on the host
+    """
+    inventory = get_drive_inventory()
+    # Already indexed, e.g. picked from the selection menu
+    myDrive = inventory.lookup(identifier)
+    if myDrive is None:
+        # Resolve the identifier directly, far cheaper than scanning every drive on the host
+        try:
+            with hostInfoLock:
+                myDrive = get_host_info().get_wrapped_drive_from_choice(identifier.split(":-")[0])
+        except Exception as err:
+            logging.debug("Direct drive lookup failed: " + str(err))
+    if myDrive is None:
+        # Serial numbers and WWNs are only known to the inventory, which has to scan the host to index them
+        inventory.refresh()
+        myDrive = inventory.lookup(identifier)
+    return myDrive
+
+
+def get_presence_watcher():
+    """
+    Return the shared presence watcher, starting it on first use.
+
+    :return: PresenceWatcher obj - Blocks on kernel hotplug events rather than polling for drive state
+    """
+    global presenceWatcher
+    with setupLock:
+        if presenceWatcher is None:
+            # Backends which can report drive changes themselves (e.g. the simulated host) supply the events
+            hostInfo = get_host_info()
+            source = hostInfo.event_source() if hasattr(hostInfo, "event_source") else None
+            presenceWatcher = PresenceWatcher(is_drive_present, source)
+            probe = get_drive_probe()
+            if probe:
+                presenceWatcher.add_listener(probe.on_event)
+            presenceWatcher.start()
+            logging.debug("Presence watcher using " + presenceWatcher.source_name + " events")
+    return presenceWatcher
+
+
+def get_kernel_log():
+    """
+    Return the kernel log reader, starting it on first use.
+
+    :return: KernelLogReader obj or None if /dev/kmsg can't be read (not Linux, not root, or simulated host)
+    """
+    global kernelLog
+    with setupLock:
+        if kernelLog is None:
+            kernelLog = False
+            if simulatedRig is None and KernelLogReader.available():
+                try:
+                    kernelLog = KernelLogReader().start()
+                except OSError as err:
+                    logging.debug("Kernel log not available: " + str(err))
+    return kernelLog or None
+
+
+def correlate_kernel_log(record, myDrive, cycleStart, pullTime, removedAt, plugTime, enumeratedAt):
+    """
+    Attach the kernel messages logged during a cycle to its record, and split the removal and enumeration times
+    into the kernel's part (command to last kernel message) and the userspace part (kernel message to detection).
+
+    :param record: CycleRecord obj - Cycle to update
+    :param myDrive: DriveWrapper obj - Drive under test, used to ignore messages about other PCI devices
+    :param cycleStart: float - Start of the cycle
+    :param pullTime: float - When RUN:POWer DOWN was sent
+    :param removedAt: float - When the removal was detected, None if it wasn't
+    :param plugTime: float - When RUN:POWer UP was sent
+    :param enumeratedAt: float - When the enumeration was detected, None if it wasn't
+    """
+    reader = get_kernel_log()
+    if reader is None:
+        return
+    addresses = None
+    probe = get_drive_probe(myDrive)
+    if probe:
+        location = probe.locate(myDrive)
+        addresses = [location.bdf, os.path.basename(location.bridge_path or "")]
+    events = reader.events_between(cycleStart, None, addresses)
+    if not events:
+        return
+    record.kernel_events = [[round(e.timestamp - cycleStart, 6), e.message] for e in events[:32]]
+
+    if removedAt is not None:
+        kernelTime = kernel_detection_time(events, pullTime, removedAt, REMOVAL_PATTERN)
+        if kernelTime is not None:
+            record.kernel_removal_time = kernelTime - pullTime
+            record.user_removal_time = removedAt - kernelTime
+            logWrite("Removal: kernel " + str(record.kernel_removal_time) + " sec, userspace " +
+                     str(record.user_removal_time) + " sec")
+    if enumeratedAt is not None:
+        kernelTime = kernel_detection_time(events, plugTime, enumeratedAt, ENUMERATION_PATTERN)
+        if kernelTime is not None:
+            record.kernel_enumeration_time = kernelTime - plugTime
+            record.user_enumeration_time = enumeratedAt - kernelTime
+            logWrite("Enumeration: kernel " + str(record.kernel_enumeration_time) + " sec, userspace " +
+                     str(record.user_enumeration_time) + " sec")
+    if not record.passed:
+        logWrite("Kernel log during cycle:")
+        for offset, message in record.kernel_events:
+            logWrite("    [+" + "{0:.6f}".format(offset) + "] " + message)
+
+
+def start_io_workload(path, block_size=4096, queue_depth=8, read_ratio=1.0):
+    """
+    Start the I/O workload that runs against the drive for the rest of the test, measuring its baseline throughput.
+
+    :param path: String - Device node or file to run I/O against
+    :param block_size: int - Bytes per I/O
+    :param queue_depth: int - I/Os in flight
+    :param read_ratio: float - Fraction of I/Os that are reads
+    :return: IoWorkload obj
+    """
+    global ioWorkload
+    logWrite("Starting I/O workload on " + path + " (" + str(block_size) + " byte blocks, queue depth " +
+             str(queue_depth) + ", " + str(int(read_ratio * 100)) + "% read)")
+    ioWorkload = IoWorkload(path, block_size, queue_depth, read_ratio).start()
+    logWrite("I/O baseline: " + str(round(ioWorkload.baseline)) + " IOPS" +
+             ("" if ioWorkload.direct else " (buffered, target does not support direct I/O)"))
+    return ioWorkload
+
+
+def measure_io_recovery(record, onTime):
+    """
+    Record how the I/O workload came through the cycle: in-flight I/Os failed by the pull, failed retries while the
+    drive was gone, time from enumeration to the first good I/O, and time until throughput was back to its baseline.
+
+    :param record: CycleRecord obj - Cycle to update
+    :param onTime: int - Max time (Seconds) to wait for throughput to recover
+    """
+    metrics = ioWorkload.cycle_metrics(onTime)
+    record.io_errors = metrics["errors"]
+    record.io_absent_errors = metrics["absent_errors"]
+    record.io_first_time = metrics["first_io_time"]
+    record.io_recovery_time = metrics["recovery_time"]
+    logWrite("I/O errors at pull: " + str(record.io_errors) + " in flight, " + str(record.io_absent_errors) +
+             " retries while the drive was gone")
+    if record.enumeration_time is not None:
+        logWrite("I/O resumed " + str(record.io_first_time) + " sec after enumeration, full throughput after " +
+                 str(record.io_recovery_time) + " sec")
+
+
+def start_power_capture(stream, sample_rate=50000, raw_windows=None):
+    """
+    Start capturing power, to summarise the inrush and discharge of every cycle.
+
+    :param stream: String - File a Quarch power module is streaming to, or "synthetic"
+    :param sample_rate: int - Samples per second of the stream
+    :param raw_windows: String (optional) - Save raw samples around each command: None, "failures" or "all"
+    :return: PowerCapture obj or None if NumPy is not installed
+    """
+    global powerCapture
+    if not numpy_available():
+        logWrite("Power capture needs NumPy (pip install numpy), continuing without it")
+        return None
+    if stream == "synthetic":
+        # Follows the power commands the script sends, so it works alongside real or simulated modules
+        source = SyntheticPowerSource(lambda: powerCapture.powered, sample_rate)
+    else:
+        source = StreamFileSource(stream, sample_rate)
+    logWrite("Capturing power from " + stream + " at " + str(sample_rate) + " samples/sec")
+    powerCapture = PowerCapture(source, raw_directory=os.path.splitext(resultsFilePath)[0] + "_power",
+                                raw_mode=raw_windows)
+    return powerCapture.start()
+
+
+def capture_power(record):
+    """
+    Add the power summaries of the cycle's power down and power up windows to its record.
+
+    :param record: CycleRecord obj - Cycle to update, with its verdict already set
+    """
+    if powerCapture.error:
+        logWrite("Power capture stopped: " + str(powerCapture.error))
+        return
+    summaries = powerCapture.cycle_summaries(record)
+    record.pull_power = summaries.get("down")
+    record.plug_power = summaries.get("up")
+    for name, summary in (("Discharge", record.pull_power), ("Inrush", record.plug_power)):
+        if summary:
+            logWrite(name + ": peak " + str(summary["peak_current"]) + " A at " + str(summary["peak_time"]) +
+                     " sec, " + str(summary["energy"]) + " J, settled in " + str(summary["settling_time"]) + " sec")
+
+
+def start_metrics_exporter(port):
+    """
+    Start serving live metrics in the Prometheus text format.
+
+    :param port: int - Local port to listen on
+    :return: MetricsExporter obj
+    """
+    global metricsExporter
+    metricsExporter = MetricsExporter(port).start()
+    logWrite("Serving live metrics on http://" + metricsExporter.address + ":" + str(metricsExporter.port) +
+             "/metrics")
+    return metricsExporter
+
+
+def get_results_store():
+    """
+    Return the results store for this run, creating it on first use.
+
+    :return: ResultsStore obj - Streams each CycleRecord to the results file
+    """
+    global resultsStore
+    with setupLock:
+        if resultsStore is None:
+            resultsStore = ResultsStore(resultsFilePath)
+    return resultsStore
+
+
+def displayResultsSummary():
+    """
+    Display per plug speed latency percentiles for the run.
+    """
+    if resultsStore is None or not resultsStore.summaries:
+        return
+    logPipeline.flush()
+    displayTable(resultsStore.summary_table(), align="l",
+                 tableHeaders=["Delay (mS)", "Cycles", "Failures", "Removal p50/p95/p99/max (mS)",
+                               "Enumeration p50/p95/p99/max (mS)"])
+    logWrite("Cycle results written to " + resultsFilePath)
+    resultsStore.close()
+
+
+def get_module_state(my_device):
+    """
+    Return the cached configuration state for a module, creating it on first use.
+
+    :param my_device: QuarchDevice obj - Module wrapper
+    :return: ModuleState obj - Tracks the source delays last applied to the module
+    """
+    with setupLock:
+        state = moduleStates.get(my_device)
+        if state is None:
+            state = moduleStates[my_device] = ModuleState(my_device)
+    return state
+
+
+def get_drive_probe(drive=None):
+    """
+    Return the sysfs fast-path probe, creating it on first use.
+
+    :param drive: DriveWrapper obj (optional) - If given, only return the probe if it can resolve this drive
+    :return: SysfsDriveProbe obj or None if not available
+    """
+    global driveProbe
+    with setupLock:
+        if driveProbe is None:
+            driveProbe = SysfsDriveProbe() if SysfsDriveProbe.available() else False
+    if not driveProbe or (drive is not None and not driveProbe.supports(drive)):
+        return None
+    return driveProbe
+
+
+def is_drive_present(drive):
+    """
+    Check if the drive is visible to the host, using the sysfs probe when possible.
+
+    :param drive: DriveWrapper obj - Drive to check
+    :return: Boolean - True if present
+    """
+    probe = get_drive_probe(drive)
+    if probe:
+        return probe.is_present(drive)
+    with hostInfoLock:
+        return get_host_info().is_wrapped_device_present(drive)
+
+
+def get_drive_link(drive):
+    """
+    :param drive: DriveWrapper obj - PCIe drive to check
+    :return: String - Current link speed of the drive
+    """
+    probe = get_drive_probe(drive)
+    if probe:
+        return probe.link_speed(drive)
+    with hostInfoLock:
+        return get_host_info().return_wrapped_drive_link(drive)
+
+
+def get_drive_width(drive):
+    """
+    :param drive: DriveWrapper obj - PCIe drive to check
+    :return: String - Current lane width of the drive
+    """
+    probe = get_drive_probe(drive)
+    if probe:
+        return probe.link_width(drive)
+    with hostInfoLock:
+        return get_host_info().return_wrapped_drive_width(drive)
+
+
+def read_drive_link(drive):
+    """
+    :param drive: DriveWrapper obj - PCIe drive to check
+    :return: (String, String) - Current link speed and lane width of the drive
+    """
+    return get_drive_link(drive), get_drive_width(drive)
 
 
 def logWrite(log_string):
@@ -185,9 +1061,10 @@ def logWrite(log_string):
 
     :param log_string: (String) - String to write to console & file.
     """
-    print(log_string)
-    with open(logFilePath, 'a') as logFile:
-        logFile.write(log_string + "\n")
+    prefix = getattr(logContext, "prefix", "")
+    if prefix:
+        log_string = prefix + log_string
+    logPipeline.write(log_string)
 
 
 def exitScript(my_device, err=None):
@@ -198,22 +1075,48 @@ def exitScript(my_device, err=None):
     :param my_device: quarchDevice obj - Module wrapper for selected module.
     :param err : String (optional) - Display an error to user before exiting the script.
     """
-    setDefaultState(my_device)
+    try:
+        setDefaultState(my_device)
+    except ModuleCommandError as resetErr:
+        logging.warning("Module could not be reset: " + str(resetErr))
     my_device.closeConnection()
     if err:
         logging.error(err)
+    if getattr(logContext, "slot", None):
+        # One of several concurrent slots: only this slot stops, the shared resources stay up for the others
+        raise SlotAborted(err or "Slot stopped")
+    stop_shared_resources()
     quit()
 
 
+def stop_shared_resources():
+    """
+    Stop the background services shared by every slot and close the log and results files.
+    """
+    if presenceWatcher:
+        presenceWatcher.stop()
+    if kernelLog:
+        kernelLog.stop()
+    if ioWorkload:
+        ioWorkload.stop()
+    if powerCapture:
+        powerCapture.stop()
+    if metricsExporter:
+        metricsExporter.stop()
+    if resultsStore:
+        resultsStore.close()
+    logPipeline.close()
+
+
 def setDefaultState(my_device):
     """
     Issue command to reset the Quarch module do it's default state
 
     :param my_device: (quarchDevice obj) - Module wrapper for selected module.
     """
-    my_device.sendCommand("conf:def:state")
-    # A small wait is added to allow complete module reset before exit.
-    time.sleep(3)
+    # Wait for the module to respond again, so the reset is complete before carrying on or exiting.
+    if not get_module_state(my_device).reset_default():
+        logging.warning("Module did not respond after reset to default state")
 
 
 def check_legacy_timings(my_device):
@@ -227,6 +1130,7 @@ def check_legacy_timings(my_device):
     logWrite("Checking for legacy module...")
     # If command below returns a fail, then the module is legacy.
     result = my_device.sendCommand("source:5:delay 1500")
+    get_module_state(my_device).forget(5)
 
     if "FAIL: 0x16 -Numeric value not in valid range" in result:
         logWrite("Module is legacy.")
@@ -264,13 +1168,13 @@ def QuarchSimpleIdentify(quarch_module):
     :param quarch_module: quarchDevice obj - Quarch module wrapper obj
     """
     # Print the module name
-    time.sleep(0.1)
+    get_module_state(quarch_module).wait_ready()
     logWrite("\nModule Name:")
     logWrite(quarch_module.sendCommand("hello?"))
-    time.sleep(0.1)
     # Print the module identify and version information
     logWrite("\nModule Status:")
     logWrite(quarch_module.sendCommand("*tst?"))
+    logPipeline.flush()
     print("")
 
 
@@ -296,19 +1200,63 @@ def setupSimpleHotplug(my_device, delay_time, step_count, is_legacy):
     if step_count < 2 or step_count > 6:
         exitScript(my_device, 'stepCount must be between 1 and 6')
 
-    # Run through all 6 timed sources on the module
-    for steps in (1, step_count):
-        # Calculate the next source delay. Additional sources are set to the last value used
-        nextDelay = (steps - 1) * delay_time
-        cmdResult = my_device.sendCommand("source:" + str(steps) + ":delay " + str(nextDelay))
-        if "OK" not in cmdResult:
-            logWrite("***FAIL: Config command failed to execute correctly***")
-            logWrite("***" + cmdResult)
-            exitScript(my_device)
-    time.sleep(0.1)
+    # Run through all 6 timed sources on the module.  Additional sources are set to the last value used
+    setupSequenceHotplug(my_device, HotplugSequence.ramp(delay_time, step_count), is_legacy)
+
+
+def setupSequenceHotplug(my_device, sequence, is_legacy):
+    """
+    Sets up the hotplug timing of a sequence: a delay and optional bounce pattern for every timed source.
+
+    :param my_device: QuarchDevice Obj - Quarch Moudle wrapper
+    :param sequence: HotplugSequence obj - Timing to apply
+    :param is_legacy: Boolean - True if the Quarch module has legacy timings
+    """
+    problems = sequence.problems(delay_limit(is_legacy))
+    if problems:
+        exitScript(my_device, "Sequence " + sequence.describe() + " can't be run: " + "; ".join(problems))
+
+    # Only the settings that differ from the last applied configuration are sent to the module
+    moduleState = get_module_state(my_device)
+    raiseConfigFailures(moduleState.apply(sequence.transition(moduleState.settings)))
+
+
+def raiseConfigFailures(failures):
+    """
+    Log any config commands the module did not accept and raise, so that hotplugCycle abandons the cycle.  A
+    setting the module rejected outright is fatal and ends the run; anything else (e.g. module busy) only costs
+    the cycle, and the next one tries again.
+
+    :param failures: List<(String, String)> - (command, response) of the failed commands, from ModuleState.apply()
+    """
+    for command, cmdResult in failures:
+        logWrite("***FAIL: Config command failed to execute correctly***")
+        logWrite("***" + cmdResult)
+    if failures:
+        fatal = any(classify_reply(cmdResult) == FATAL for command, cmdResult in failures)
+        raise ModuleCommandError(failures[0][0], failures[0][1], FATAL if fatal else TRANSIENT)
+
 
+def check_sequences(my_device, sequences, is_legacy):
+    """
+    Check all the timing sequences of a run against the module's limits, exiting before the first cycle if any
+    can't be run.
 
-def basicHotplug(cycleIterations, mappingMode, myDevice, offTime, onTime, myDrive, plugSpeeds, is_legacy_module):
+    :param my_device: QuarchDevice Obj - Quarch Moudle wrapper
+    :param sequences: List<HotplugSequence> - Sequences of the run
+    :param is_legacy: Boolean - True if the Quarch module has legacy timings
+    """
+    problems = validate_sequences(sequences, delay_limit(is_legacy))
+    for problem in problems:
+        logWrite("***FAIL: " + problem + "***")
+    if problems:
+        exitScript(my_device, str(len(problems)) + " problems found in the timing sequences")
+    logWrite(str(len(sequences)) + " timing sequences checked against the " + str(delay_limit(is_legacy)) +
+             "mS source delay limit")
+
+
+def basicHotplug(cycleIterations, mappingMode, myDevice, offTime, onTime, myDrive, plugSpeeds, is_legacy_module,
+                 summary=None, pull_gate=None):
     """
     Function to perform hotplug tests.
     Each "power down" searches for a time <offTime> to ensure the drive is not discovered by the System.
@@ -322,88 +1270,21 @@ def basicHotplug(cycleIterations, mappingMode, myDevice, offTime, onTime, myDriv
     :param offTime: int - Max time (Seconds) to poll for drive removal on system
     :param onTime: int - Max time (Seconds) to poll for drive insertion on system
     :param myDrive: DriveWrapper obj - Wrapper for DUT
-    :param plugSpeeds: List<int> - List of hotplug delay speeds
+    :param plugSpeeds: List<int or HotplugSequence> - List of hotplug delay speeds, or of timing sequences
     :param is_legacy_module: Boolean - True if the selected quarch module has legacy timings
+    :param summary: List (optional) - List to add failures to, defaults to the global summary_list
+    :param pull_gate: callable (optional) - Called before each pull, blocks until the drive may be pulled
     """
-
     # Loop through the list of plug speeds
     for testDelay in plugSpeeds:
-        all_testpoints_passed = True
-        testName = str(testDelay) + "mS HotPlug Test"
-
         # Loop through plug iterations
         for currentIteration in range(0, cycleIterations):
-            logWrite("")
-            logWrite("")
-            logWrite("===============================")
-            logWrite("Test -" + testName + " - " + str(currentIteration + 1) + "/" + str(cycleIterations))
-            logWrite("===============================")
-            logWrite("")
-
-            # Setup hotplug timing (QTL1743 uses 3 sources by default)
-            setupSimpleHotplug(myDevice, testDelay, 3, is_legacy_module)
+            hotplugCycle(myDevice, myDrive, testDelay, currentIteration, cycleIterations, offTime, onTime,
+                         is_legacy_module, summary, pull_gate)
 
-            # Pull the drive
-            logWrite("Beginning the test sequence:\n")
-            logWrite("  - Pulling the device...")
-
-            cmdResult = myDevice.sendCommand("RUN:POWer DOWN")
-            logWrite("    <" + cmdResult + ">")
-            if "OK" not in cmdResult:
-                logWrite("***FAIL: Power down command failed to execute correctly***")
-                logWrite("***" + cmdResult)
-                exitScript(myDevice)
-
-            # Wait for device to remove
-            logWrite("  - Waiting for device removal (" + str(offTime) + " Seconds Max)...")
-            startTime = time.time()
-
-            while True:
-                cmdResult = myHostInfo.is_wrapped_device_present(myDrive)
-                currentTime = time.time()
-                if cmdResult is False:
-                    logWrite("Device removed correctly in " + str(currentTime - startTime) + " sec")
-                    break
-                if currentTime - startTime > offTime:
-                    logWrite("***FAIL: " + testName + " - Drive was not removed after " + str(offTime) + " sec ***")
-                    all_testpoints_passed = False
-                    summary_list.append([str(testDelay), str(currentIteration + 1) + "/" + str(cycleIterations),
-                                         "Drive was not removed after " + str(offTime) + " sec"])
-                    break
-
-            # Power up the drive
-            logWrite("\n  - Plugging the device")
-
-            cmdResult = myDevice.sendCommand("RUN:POWer UP")
-            logWrite("    <" + cmdResult + ">")
-            if "OK" not in cmdResult:
-                logWrite("***FAIL: Power down command failed to execute correctly***")
-                logWrite("***" + cmdResult)
-                exitScript(myDevice)
-
-            # Wait for device to enumerate
-            logWrite("  - Waiting for device enumeration (" + str(onTime) + " Seconds Max)...")
-            startTime = time.time()
-
-            while True:
-                cmdResult = myHostInfo.is_wrapped_device_present(myDrive)
-                currentTime = time.time()
-                if cmdResult is True:
-                    logWrite("<Device enumerated correctly in " + str(currentTime - startTime) + " sec>")
-                    break
-                if currentTime - startTime > onTime:
-                    logWrite("***FAIL: " + testName + " - Drive did not return after " + str(onTime) + " sec ***")
-                    all_testpoints_passed = False
-                    summary_list.append([str(testDelay), str(currentIteration + 1) + "/" + str(cycleIterations),
-                                         "Drive did not return after " + str(onTime) + " sec"])
-                    break
-            if all_testpoints_passed:
-                logWrite("Test - " + testName + " - Passed")
-            else:
-                logWrite("Test - " + testName + " - Failed")
-
-
-def pcieHotplug(cycleIterations, mappingMode, myDevice, offTime, onTime, myDrive, plugSpeeds, is_legacy_module):
+
+def pcieHotplug(cycleIterations, mappingMode, myDevice, offTime, onTime, myDrive, plugSpeeds, is_legacy_module,
+                summary=None, pull_gate=None):
     """
     Function to perform hotplug tests.
     Each "power down" searches for a time <offTime> to ensure the drive is not discovered by the System.
@@ -411,7 +1292,7 @@ def pcieHotplug(cycleIterations, mappingMode, myDevice, offTime, onTime, myDrive
 
     All failures are added to a list for display at the end of the test.
 
-    PCIE hotplug will also check drive's Link Speed and Lane Width after power up.
+    PCIE hotplug will also check drive's Link Speed and Lane Width after power up, once the link has settled.
 
     :param cycleIterations: int - Number of times to perform hotplug
     :param mappingMode:
@@ -419,116 +1300,309 @@ def pcieHotplug(cycleIterations, mappingMode, myDevice, offTime, onTime, myDrive
     :param offTime: int - Max time (Seconds) to poll for drive removal on system
     :param onTime: int - Max time (Seconds) to poll for drive insertion on system
     :param myDrive: DriveWrapper obj - Wrapper for DUT
-    :param plugSpeeds: List<int> - List of hotplug delay speeds
+    :param plugSpeeds: List<int or HotplugSequence> - List of hotplug delay speeds, or of timing sequences
     :param is_legacy_module: Boolean - True if the selected quarch module has legacy timings
+    :param summary: List (optional) - List to add failures to, defaults to the global summary_list
+    :param pull_gate: callable (optional) - Called before each pull, blocks until the drive may be pulled
     """
-    # Get the current link status
-    linkStartSpeed = myDrive.link_speed
-    linkStartWidth = myDrive.lane_width
-    logWrite("Current PCIe device link speed: " + myDrive.link_speed)
-    logWrite("Current PCIe device link width: " + myDrive.lane_width)
+    linkStart = get_start_link(myDrive)
 
     # Loop through the list of plug speeds
     for testDelay in plugSpeeds:
-        all_testpoints_passed = True
-        testName = str(testDelay) + "mS HotPlug Test"
-
         # Loop through plug iterations
         for currentIteration in range(0, cycleIterations):
-            logWrite("")
-            logWrite("")
-            logWrite("===============================")
-            logWrite("Test -" + testName + " - " + str(currentIteration + 1) + "/" + str(cycleIterations))
-            logWrite("===============================")
-            logWrite("")
-
-            # Setup hotplug timing (QTL1743 uses 3 sources by default)
+            hotplugCycle(myDevice, myDrive, testDelay, currentIteration, cycleIterations, offTime, onTime,
+                         is_legacy_module, summary, pull_gate, linkStart)
+
+
+def searchPlugThreshold(myDevice, myDrive, delayRange, offTime, onTime, is_legacy_module, repeats=1,
+                        boundaryRepeats=5, source=None, maxCycles=200):
+    """
+    Find the plug speed at which the drive starts failing by bisecting a delay range.
+
+    :param myDevice: QuarchDevice obj - Wrapper for Quarch Module
+    :param myDrive: DriveWrapper obj - Wrapper for DUT
+    :param delayRange: (int, int) - Lowest and highest delay (mS) to search
+    :param offTime: int - Max time (Seconds) to wait for drive removal on system
+    :param onTime: int - Max time (Seconds) to wait for drive insertion on system
+    :param is_legacy_module: Boolean - True if the selected quarch module has legacy timings
+    :param repeats: int - Cycles run at each probed delay
+    :param boundaryRepeats: int - Cycles the passing side of the boundary must pass to be confirmed
+    :param source: int (optional) - Vary only this source (1-6), leaving the others at zero delay
+    :param maxCycles: int - Hard limit on the number of cycles for the search
+    :return: SearchResult obj - The failure boundary and the number of cycles it took
+    """
+    # The 3 source ramp used by setupSimpleHotplug reaches 2x the delay on its last source
+    limit = delay_limit(is_legacy_module)
+    if source is None:
+        limit //= 2
+    low, high = max(1, delayRange[0]), min(limit, delayRange[1])
+    linkStart = get_start_link(myDrive) if myDrive.drive_type == "pcie" else None
+
+    def setup_source(delay):
+        def setup(my_device):
+            delays = {s: 0 for s in range(1, 7)}
+            delays[source] = delay
+            raiseConfigFailures(get_module_state(my_device).set_source_delays(delays))
+        return setup
+
+    def run_cycle(delay):
+        record = hotplugCycle(myDevice, myDrive, delay, search.result.cycles - 1, maxCycles, offTime, onTime,
+                              is_legacy_module, linkStart=linkStart,
+                              setup=setup_source(delay) if source is not None else None)
+        # A cycle lost to a module error says nothing about the drive at this delay
+        return None if record.verdict == MODULE_ERROR else record.passed
+
+    logWrite("Searching for failure boundary between " + str(low) + "mS and " + str(high) + "mS" +
+             ("" if source is None else " on source " + str(source)))
+    search = ThresholdSearch(run_cycle, low, high, repeats=repeats, boundary_repeats=boundaryRepeats,
+                             max_cycles=maxCycles)
+    result = search.run()
+    logWrite("")
+    logWrite("Threshold search: " + result.describe())
+    return result
+
+
+def get_start_link(myDrive):
+    """
+    Read and log the link status of a PCIe drive before testing, as the baseline each cycle is checked against.
+
+    :param myDrive: DriveWrapper obj - PCIe drive under test
+    :return: (String, String) - Link speed and lane width
+    """
+    # The sysfs probe reports in its own format, so take the baseline from it too.
+    if get_drive_probe(myDrive):
+        linkStartSpeed = get_drive_link(myDrive)
+        linkStartWidth = get_drive_width(myDrive)
+    else:
+        linkStartSpeed = myDrive.link_speed
+        linkStartWidth = myDrive.lane_width
+    logWrite("Current PCIe device link speed: " + str(linkStartSpeed))
+    logWrite("Current PCIe device link width: " + str(linkStartWidth))
+    return linkStartSpeed, linkStartWidth
+
+
+def hotplugCycle(myDevice, myDrive, testDelay, currentIteration, cycleIterations, offTime, onTime, is_legacy_module,
+                 summary=None, pull_gate=None, linkStart=None, setup=None):
+    """
+    Perform a single pull / plug cycle at one plug speed and record the result.
+
+    :param myDevice: QuarchDevice obj - Wrapper for Quarch Module
+    :param myDrive: DriveWrapper obj - Wrapper for DUT
+    :param testDelay: int or HotplugSequence - Hotplug delay speed (mS) of a simple ramp, or a full timing sequence
+    :param currentIteration: int - Iteration at this speed, starting at 0
+    :param cycleIterations: int - Number of iterations at this speed
+    :param offTime: int - Max time (Seconds) to wait for drive removal on system
+    :param onTime: int - Max time (Seconds) to wait for drive insertion on system
+    :param is_legacy_module: Boolean - True if the selected quarch module has legacy timings
+    :param summary: List (optional) - List to add failures to, defaults to the global summary_list
+    :param pull_gate: callable (optional) - Called before the pull, blocks until the drive may be pulled
+    :param linkStart: (String, String) (optional) - PCIe link speed and width to verify after power up
+    :param setup: callable(QuarchDevice) (optional) - Applies the cycle's timing, defaults to setupSimpleHotplug
+    :return: CycleRecord obj - Result of the cycle
+    """
+    if summary is None:
+        summary = summary_list
+    sequence = None
+    if isinstance(testDelay, HotplugSequence):
+        sequence, testDelay = testDelay, testDelay.speed
+    testName = str(testDelay) + "mS HotPlug Test"
+    iterationStr = str(currentIteration + 1) + "/" + str(cycleIterations)
+    record = CycleRecord(testDelay, currentIteration + 1, getattr(logContext, "slot", ""))
+    cycleStart = time.time()
+    get_kernel_log()
+
+    logWrite("")
+    logWrite("")
+    logWrite("===============================")
+    logWrite("Test -" + testName + " - " + iterationStr)
+    logWrite("===============================")
+    logWrite("")
+
+    # Setup hotplug timing (QTL1743 uses 3 sources by default)
+    try:
+        if setup:
+            setup(myDevice)
+        elif sequence:
+            logWrite("Sequence " + sequence.describe())
+            setupSequenceHotplug(myDevice, sequence, is_legacy_module)
+        else:
             setupSimpleHotplug(myDevice, testDelay, 3, is_legacy_module)
+    except ModuleCommandError as err:
+        return abandonCycle(myDevice, myDrive, record, testName, iterationStr, summary, onTime, err)
+
+    # Pull the drive
+    logWrite("Beginning the test sequence:\n")
+    logWrite("  - Pulling the device...")
+
+    if pull_gate:
+        pull_gate()
+    pullTime = time.time()
+    if ioWorkload:
+        ioWorkload.mark_pull(pullTime)
+    if powerCapture:
+        powerCapture.mark("down", pullTime)
+    try:
+        cmdResult = myDevice.command("RUN:POWer DOWN", verify=POWERED_OFF)
+    except ModuleCommandError as err:
+        logWrite("***FAIL: Power down command failed to execute correctly***")
+        logWrite("***" + err.reason)
+        return abandonCycle(myDevice, myDrive, record, testName, iterationStr, summary, onTime, err)
+    record.pull_cmd_time = time.time() - pullTime
+    # After a retry the drive may have gone before the command returned, so the removal time would be meaningless
+    pullRetried = myDevice.last_attempts > 1
+    logWrite("    <" + cmdResult + ">")
+
+    # Wait for device to remove
+    logWrite("  - Waiting for device removal (" + str(offTime) + " Seconds Max)...")
+    startTime = time.time()
+
+    removed, removalTime = get_presence_watcher().wait_for_removal(myDrive, offTime, startTime)
+    removedAt = startTime + removalTime if removed else None
+    if removed and pullRetried:
+        logWrite("Device removed correctly (time not recorded, the power down command was retried)")
+    elif removed:
+        record.removal_time = removalTime
+        logWrite("Device removed correctly in " + str(removalTime) + " sec")
+    else:
+        logWrite("***FAIL: " + testName + " - Drive was not removed after " + str(offTime) + " sec ***")
+        record.fail(NOT_REMOVED)
+        summary.append([str(testDelay), iterationStr, "Drive was not removed after " + str(offTime) + " sec"])
+
+    # Power up the drive
+    logWrite("\n  - Plugging the device")
+
+    plugTime = time.time()
+    if powerCapture:
+        powerCapture.mark("up", plugTime)
+    try:
+        cmdResult = myDevice.command("RUN:POWer UP", verify=POWERED_ON)
+    except ModuleCommandError as err:
+        logWrite("***FAIL: Power up command failed to execute correctly***")
+        logWrite("***" + err.reason)
+        return abandonCycle(myDevice, myDrive, record, testName, iterationStr, summary, onTime, err)
+    record.plug_cmd_time = time.time() - plugTime
+    plugRetried = myDevice.last_attempts > 1
+    logWrite("    <" + cmdResult + ">")
+
+    # With the sysfs probe, sample the PCIe link from power up until it settles rather than reading it once after
+    # enumeration.  Without it every read shells out under hostInfoLock, competing with the enumeration wait.
+    linkSampler = None
+    probe = get_drive_probe(myDrive) if linkStart is not None else None
+    if probe:
+        linkSampler = LinkTrainingSampler(read_drive_link, probe.link_status, timeout=onTime + 1).start(myDrive,
+                                                                                                       plugTime)
+
+    # Wait for device to enumerate
+    logWrite("  - Waiting for device enumeration (" + str(onTime) + " Seconds Max)...")
+    startTime = time.time()
+
+    enumerated, enumerationTime = get_presence_watcher().wait_for_presence(myDrive, onTime, startTime)
+    enumeratedAt = startTime + enumerationTime if enumerated else None
+    if enumerated:
+        if ioWorkload:
+            ioWorkload.mark_enumerated(enumeratedAt)
+        if plugRetried:
+            logWrite("<Device enumerated correctly (time not recorded, the power up command was retried)>")
+        else:
+            record.enumeration_time = enumerationTime
+            logWrite("<Device enumerated correctly in " + str(enumerationTime) + " sec>")
+    else:
+        logWrite("***FAIL: " + testName + " - Drive did not return after " + str(onTime) + " sec ***")
+        record.fail(NOT_RETURNED)
+        summary.append([str(testDelay), iterationStr, "Drive did not return after " + str(onTime) + " sec"])
+
+    # Verify link width and speed (once the link has settled, where sampled).  Mismatches fail the cycle, the run
+    # carries on.
+    if linkSampler is not None and not enumerated:
+        linkSampler.stop()
+    elif linkStart is not None and enumerated:
+        linkStartSpeed, linkStartWidth = linkStart
+        if linkSampler is not None:
+            timeline = linkSampler.wait()
+            record.link_speed, record.link_width = linkEndSpeed, linkEndWidth = timeline.final
+            record.link_time = timeline.time_to_final
+            record.link_states = timeline.intermediate_states() or None
+            if record.link_time is not None:
+                logWrite("Link reached " + str(linkEndSpeed) + " " + str(linkEndWidth) + " in " +
+                         str(record.link_time) + " sec" + ("" if timeline.stable else " (not settled)"))
+            if record.link_states:
+                logWrite("Link trained through: " + ", ".join(record.link_states))
+        else:
+            record.link_speed, record.link_width = linkEndSpeed, linkEndWidth = read_drive_link(myDrive)
+        if linkStartSpeed != linkEndSpeed:
+            logWrite("***FAIL: " + testName + " - Speed Mismatch, " + str(linkStartSpeed) + " -> " + str(linkEndSpeed) + "***")
+            record.fail(LINK_MISMATCH)
+            summary.append([str(testDelay), iterationStr,
+                            "Speed Mismatch, " + str(linkStartSpeed) + " -> " + str(linkEndSpeed)])
+        if linkStartWidth != linkEndWidth:
+            logWrite("***FAIL: " + testName + " - Width Mismatch, " + str(linkStartWidth) + " -> " + str(linkEndWidth) + "***")
+            record.fail(LINK_MISMATCH)
+            summary.append([str(testDelay), iterationStr,
+                            "Width Mismatch, " + str(linkStartWidth) + " -> " + str(linkEndWidth)])
+
+    correlate_kernel_log(record, myDrive, cycleStart, pullTime, removedAt, plugTime, enumeratedAt)
+    if ioWorkload:
+        measure_io_recovery(record, onTime)
+    if powerCapture:
+        capture_power(record)
+    return finishCycle(myDevice, record, testName)
+
+
+def abandonCycle(myDevice, myDrive, record, testName, iterationStr, summary, onTime, err):
+    """
+    Give up on a cycle whose module commands failed every retry, and carry on with the next one.  The drive is
+    powered back up if possible so the next cycle starts from a known state.  Fatal errors end the run.
+
+    :param myDevice: SupervisedDevice obj - Wrapper for Quarch Module
+    :param myDrive: DriveWrapper obj - Wrapper for DUT
+    :param record: CycleRecord obj - Result of the cycle so far
+    :param testName: String - Name of the test in the log
+    :param iterationStr: String - Iteration of the cycle, e.g. "2/3"
+    :param summary: List - List to add failures to
+    :param onTime: int - Max time (Seconds) to wait for the drive to return
+    :param err: ModuleCommandError obj - The command that failed
+    :return: CycleRecord obj - Result of the cycle
+    """
+    if err.kind == FATAL:
+        logWrite("***FAIL: " + testName + " - Module error: " + str(err) + "***")
+        exitScript(myDevice, str(err))
+    logWrite("***FAIL: " + testName + " - Module error, cycle abandoned: " + str(err) + "***")
+    record.fail(MODULE_ERROR)
+    summary.append([str(record.speed), iterationStr, "Module error, cycle abandoned: " + str(err)])
+    try:
+        myDevice.command("RUN:POWer UP", verify=POWERED_ON)
+        get_presence_watcher().wait_for_presence(myDrive, onTime, time.time())
+    except ModuleCommandError as upErr:
+        logWrite("***Could not power the drive back up: " + str(upErr))
+    return finishCycle(myDevice, record, testName)
+
+
+def finishCycle(myDevice, record, testName):
+    """
+    Log and store the result of a cycle, with any module recoveries it needed.
+
+    :param myDevice: SupervisedDevice obj - Wrapper for Quarch Module
+    :param record: CycleRecord obj - Result of the cycle
+    :param testName: String - Name of the test in the log
+    :return: CycleRecord obj - Result of the cycle
+    """
+    record.recoveries = myDevice.take_recoveries()
+    for recovery in record.recoveries or []:
+        logWrite("Module command " + recovery["command"] + (" recovered" if recovery["recovered"] else " failed") +
+                 " after " + str(recovery["attempts"]) + " attempts" +
+                 (" and a reconnect" if recovery["reconnected"] else "") + " (" + recovery["error"] + ")")
+
+    if record.passed:
+        logWrite("Test - " + testName + " - Passed")
+    else:
+        logWrite("Test - " + testName + " - Failed")
 
-            # Pull the drive
-            logWrite("Beginning the test sequence:\n")
-            logWrite("  - Pulling the device...")
-
-            cmdResult = myDevice.sendCommand("RUN:POWer DOWN")
-            logWrite("    <" + cmdResult + ">")
-            if "OK" not in cmdResult:
-                logWrite("***FAIL: Power down command failed to execute correctly***")
-                logWrite("***" + cmdResult)
-                exitScript(myDevice)
-
-            # Wait for device to remove
-            logWrite("  - Waiting for device removal (" + str(offTime) + " Seconds Max)...")
-            startTime = time.time()
-
-            while True:
-                pullResult = myHostInfo.is_wrapped_device_present(myDrive)
-                currentTime = time.time()
-                if not pullResult: # Looking for device to be missing after pull requested
-                    logWrite("Device removed correctly in " + str(currentTime - startTime) + " sec")
-                    break
-                if currentTime - startTime > offTime:
-                    logWrite("***FAIL: " + testName + " - Drive was not removed after " + str(offTime) + " sec ***")
-                    all_testpoints_passed = False
-                    summary_list.append([str(testDelay), str(currentIteration + 1) + "/" + str(cycleIterations),
-                                         "Drive was not removed after " + str(offTime) + " sec"])
-                    break
-
-            # Power up the drive
-            logWrite("\n  - Plugging the device")
-
-            cmdResult = myDevice.sendCommand("RUN:POWer UP")
-            logWrite("    <" + cmdResult + ">")
-            if "OK" not in cmdResult:
-                logWrite("***FAIL: Power down command failed to execute correctly***")
-                logWrite("***" + cmdResult)
-                exitScript(myDevice)
-
-            # Wait for device to enumerate
-            logWrite("  - Waiting for device enumeration (" + str(onTime) + " Seconds Max)...")
-            startTime = time.time()
-
-            while True:
-                plugResult = myHostInfo.is_wrapped_device_present(myDrive)
-                currentTime = time.time()
-                if plugResult is True:
-                    logWrite("<Device enumerated correctly in " + str(currentTime - startTime) + " sec>")
-                    break
-                if currentTime - startTime > onTime:
-                    logWrite("***FAIL: " + testName + " - Drive did not return after " + str(onTime) + " sec ***")
-                    all_testpoints_passed = False
-                    summary_list.append([str(testDelay), str(currentIteration + 1) + "/" + str(cycleIterations),
-                                         "Drive did not return after " + str(onTime) + " sec"])
-                    break
-
-            # Verify link width and speed
-            linkEndSpeed = myHostInfo.return_wrapped_drive_link(myDrive)
-            linkEndWidth = myHostInfo.return_wrapped_drive_width(myDrive)
-            if linkStartSpeed != linkEndSpeed:
-                logWrite("***FAIL: " + testName + " - Speed Mismatch, " + linkStartSpeed + " -> " + linkEndSpeed + "***")
-                exitScript(myDevice)
-            if linkStartWidth != linkEndWidth:
-                logWrite("***FAIL: " + testName + " - Width Mismatch, " + linkStartWidth + " -> " + linkEndWidth + "***")
-                exitScript(myDevice)
-
-            if all_testpoints_passed:
-                logWrite("Test - " + testName + " - Passed")
-            else:
-                logWrite("Test - " + testName + " - Failed")
-
-def _return_drives_as_list(drive_list):
-    """
-    Function to sort drives into correctly formatted list for display
-
-    :param drive_list: List of driveWrapper objects
-    :return new_return: List of strings correctly formatted
-    """
-    new_return = []
-
-    for drive in drive_list:
-        new_return.append("{0} :- {1}".format(drive.identifier_str, drive.description))
-
-    return new_return
+    get_results_store().add(record)
+    if metricsExporter:
+        metricsExporter.observe(record)
+    return record
 
 
 if __name__ == "__main__":
-    main()
+    exit(main())
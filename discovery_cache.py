@@ -0,0 +1,87 @@
+'''
+Discovery cache for the AN-003 hotplug test.
+
+Scanning USB, serial and LAN for modules takes several seconds on every launch, although the rig is almost always
+the same as last time.  The connection string and name of the last module used and a stable key (serial number / WWN,
+else PCI address) of the last drive tested are kept in a small JSON file, so the script can reconnect to them
+directly and only fall back to a full scan (and the selection menus) when that fails.
+'''
+
+import json
+import os
+import time
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".an003_discovery.json")
+
+
+class DiscoveryCache:
+    """
+    Last used module connection string and drive key.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        :param path: String - Cache file
+        """
+        self.path = path
+        self.module = None
+        self.module_name = None
+        self.drive_key = None
+        self.drive_label = None
+        self.updated = None
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        """
+        :return: DiscoveryCache obj - Empty if the file is missing or unreadable
+        """
+        cache = cls(path)
+        try:
+            with open(path) as cache_file:
+                values = json.load(cache_file)
+        except (OSError, ValueError):
+            return cache
+        cache.module = values.get("module")
+        cache.module_name = values.get("module_name")
+        cache.drive_key = values.get("drive_key")
+        cache.drive_label = values.get("drive_label")
+        cache.updated = values.get("updated")
+        return cache
+
+    def remember(self, module=None, module_name=None, drive_key=None, drive_label=None):
+        """
+        Update and save the cache.  Arguments left as None keep their cached value.
+
+        :param drive_key: String - Serial number / WWN or PCI address the drive is found by again
+        :param drive_label: String - Identifier shown to the user, e.g. /dev/sdb, which may change between boots
+        """
+        if module is not None:
+            self.module = module
+            self.module_name = module_name
+        if drive_key is not None:
+            self.drive_key = drive_key
+            self.drive_label = drive_label
+        self.save()
+
+    def forget(self):
+        """
+        Drop the cached entries, e.g. after the cached module could not be reached
+        """
+        self.module = self.module_name = self.drive_key = self.drive_label = None
+        self.save()
+
+    def save(self):
+        self.updated = time.time()
+        values = {"module": self.module,
+                  "module_name": self.module_name,
+                  "drive_key": self.drive_key,
+                  "drive_label": self.drive_label,
+                  "updated": self.updated}
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as cache_file:
+                json.dump(values, cache_file)
+            os.replace(temp_path, self.path)
+        except OSError:
+            # Only costs a scan next time
+            pass
@@ -0,0 +1,184 @@
+'''
+Incremental drive inventory for the AN-003 hotplug test.
+
+HostInformation.return_wrapped_drives() re-probes every drive on the host, which takes seconds on hosts with
+dozens of NVMe / SAS devices, and the selection menu used to call it after every choice.  The inventory does one
+full scan, indexes the drives by their stable identifiers (serial number, WWN, PCI address and the identifier
+shown in the menu) and then follows PresenceWatcher events: drives it already knows are marked present or absent
+directly, and the host is only scanned again when a device it has never seen turns up.
+
+Menu entries ("<identifier> :- <description>") map straight back to their drive, replacing the string splitting
+of get_wrapped_drive_from_choice().
+'''
+
+import threading
+
+from sysfs_probe import BDF_PATTERN, BLOCK_PATTERN, normalise_bdf
+
+# DriveWrapper attributes which, when present, identify a drive independently of where it is plugged in
+STABLE_ID_ATTRIBUTES = ("serial_number", "serial", "wwn", "wwid")
+
+
+def drive_keys(drive):
+    """
+    :param drive: DriveWrapper obj
+    :return: List<String> - Every identifier the drive can be looked up by, most stable first
+    """
+    keys = []
+    for name in STABLE_ID_ATTRIBUTES:
+        value = getattr(drive, name, None)
+        if value:
+            keys.append(str(value).strip().lower())
+    identifier = str(getattr(drive, "identifier_str", "") or "")
+    bdf = normalise_bdf(identifier)
+    if bdf:
+        keys.append(bdf)
+    match = BLOCK_PATTERN.search(identifier)
+    if match:
+        keys.append(match.group(1))
+    if identifier:
+        keys.append(identifier.strip().lower())
+    return keys
+
+
+def stable_drive_key(drive):
+    """
+    :param drive: DriveWrapper obj
+    :return: String - Serial number / WWN, else PCI address, of the drive.  None if it is only known by a block
+             device name, which the OS may hand to a different drive after a reboot or replug.
+    """
+    for name in STABLE_ID_ATTRIBUTES:
+        value = getattr(drive, name, None)
+        if value:
+            return str(value).strip().lower()
+    return normalise_bdf(str(getattr(drive, "identifier_str", "") or ""))
+
+
+def event_keys(event):
+    """
+    :param event: PresenceEvent obj
+    :return: List<String> - Identifiers in a hotplug event which may match a drive key
+    """
+    keys = []
+    addresses = list(BDF_PATTERN.finditer(event.devpath or ""))
+    if addresses:
+        # The device itself is the last address on its path, the ones before are the bridges above it
+        keys.append(normalise_bdf(addresses[-1].group(0)))
+    if event.devname:
+        keys.append(event.devname.strip().lower())
+    return keys
+
+
+class DriveInventory:
+    """
+    Drives on the host, indexed by stable identifiers and kept current from hotplug events.
+    """
+
+    def __init__(self, return_drives):
+        """
+        :param return_drives: callable() -> List<DriveWrapper> - Full host scan (HostInformation.return_wrapped_drives)
+        """
+        self._return_drives = return_drives
+        self._lock = threading.Lock()
+        # primary key -> [DriveWrapper, menu label, present]
+        self._drives = {}
+        # any identifier or menu label -> primary key
+        self._aliases = {}
+        self._choices = None
+        self._scanned = False
+        # Set when an event named a device the index doesn't know, so the next refresh() has to scan
+        self._unknown_change = False
+        # False until events are known to reach the inventory; until then every refresh() scans
+        self.tracking = False
+        self.scans = 0
+
+    @staticmethod
+    def label(drive):
+        return "{0} :- {1}".format(drive.identifier_str, drive.description)
+
+    def refresh(self, full=False):
+        """
+        Bring the index up to date, scanning the host only if something the index can't account for changed
+
+        :param full: Boolean - Force a full host scan
+        :return: Boolean - True if the host was scanned
+        """
+        with self._lock:
+            needed = full or not self._scanned or not self.tracking or self._unknown_change
+            self._unknown_change = False
+        if not needed:
+            return False
+        drives = self._return_drives() or []
+        self.scans += 1
+        with self._lock:
+            seen = set()
+            for drive in drives:
+                keys = drive_keys(drive)
+                if not keys:
+                    continue
+                primary = next((self._aliases[key] for key in keys if key in self._aliases), keys[0])
+                entry = self._drives.get(primary)
+                label = self.label(drive)
+                if entry is None or entry[1] != label:
+                    self._choices = None
+                    if entry is not None:
+                        self._aliases.pop(entry[1], None)
+                self._drives[primary] = [drive, label, True]
+                for key in keys:
+                    self._aliases[key] = primary
+                self._aliases[label] = primary
+                seen.add(primary)
+            for primary, entry in self._drives.items():
+                if primary not in seen and entry[2]:
+                    entry[2] = False
+                    self._choices = None
+            self._scanned = True
+        return True
+
+    def on_event(self, event):
+        """
+        PresenceWatcher listener: mark known drives present / absent, note unknown devices for the next refresh().
+
+        :param event: PresenceEvent obj
+        """
+        present = event.action == "add"
+        if not present and event.action != "remove":
+            return
+        with self._lock:
+            for key in event_keys(event):
+                primary = self._aliases.get(key)
+                if primary is not None:
+                    entry = self._drives[primary]
+                    if entry[2] != present:
+                        entry[2] = present
+                        self._choices = None
+                    return
+            if present:
+                self._unknown_change = True
+
+    def choices(self):
+        """
+        :return: List<String> - Menu labels of the drives currently present, in the order they were found
+        """
+        with self._lock:
+            if self._choices is None:
+                self._choices = [entry[1] for entry in self._drives.values() if entry[2]]
+            return list(self._choices)
+
+    def lookup(self, choice):
+        """
+        Find a drive by menu label, serial number, WWN, PCI address or identifier
+
+        :param choice: String - Any of the drive's identifiers
+        :return: DriveWrapper obj or None if unknown
+        """
+        if choice is None:
+            return None
+        with self._lock:
+            primary = self._aliases.get(choice)
+            if primary is None:
+                primary = self._aliases.get(choice.strip().lower())
+            if primary is None:
+                bdf = normalise_bdf(choice)
+                primary = self._aliases.get(bdf) if bdf else None
+            return self._drives[primary][0] if primary is not None else None
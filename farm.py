@@ -0,0 +1,447 @@
+'''
+Distributed test farm for the AN-003 hotplug test.
+
+A coordinator hands one test plan to any number of worker agents and gathers every cycle result back, so the same
+test run on 30 hosts gives one aggregated view instead of 30 sets of logs to merge by hand.
+
+    coordinator - Listens for workers, sends each the plan (plug speeds, iterations, timeouts), stores the results
+                  of all hosts in one JSON Lines file and prints pass/fail and latency per host and plug speed
+    worker      - Runs on each test host.  Loads "Hotplug cycle test.py" and runs the plan through its runTestPlan(),
+                  with the host's own module and drive, streaming every CycleRecord back as it completes
+
+Protocol: newline-delimited JSON over TCP.  Results carry a sequence number and the coordinator acknowledges each
+one once stored; a worker has at most <window> unacknowledged results in flight and a small send queue, so a slow
+coordinator holds a worker up between cycles rather than letting results pile up in memory.  Worker clocks are
+aligned to the coordinator's at connection, so the merged timeline is consistent across hosts.  If the coordinator
+goes away a worker finishes its plan on its own; its local log and results files still hold every cycle.
+
+Run a farm of simulated workers on one machine:
+
+    python farm.py coordinator --plan plan.json --workers 4 --spawn-simulated 4
+'''
+
+import argparse
+import json
+import os
+import platform
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from results_store import CycleRecord, ResultsStore, SpeedSummary
+from simulation import load_test_script
+
+DEFAULT_PORT = 7643
+DEFAULT_WINDOW = 8
+MAX_MESSAGE = 1024 * 1024
+# Plan keys that belong to each host, never sent to the workers
+HOST_KEYS = ("module", "drive", "checkpoint")
+
+
+class Connection:
+    """
+    Newline-delimited JSON messages over a socket.  Sends are serialised, receives come from one reader thread.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._reader = sock.makefile("rb")
+        self._send_lock = threading.Lock()
+
+    def send(self, message):
+        data = json.dumps(message, separators=(",", ":")).encode() + b"\n"
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        """
+        :return: Dict - Next message, None once the connection has closed
+        """
+        line = self._reader.readline(MAX_MESSAGE)
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.close()
+        self.sock.close()
+
+
+class WorkerState:
+    """
+    Coordinator side view of one connected worker.
+    """
+
+    def __init__(self, name, host, clock_offset):
+        self.name = name
+        self.host = host
+        self.clock_offset = clock_offset
+        self.summaries = {}
+        self.status = "running"
+        self.message = None
+
+
+class Coordinator:
+    """
+    Accepts worker connections, sends them the plan and aggregates their results.
+    """
+
+    def __init__(self, plan, results_path, address="127.0.0.1", port=DEFAULT_PORT, expected=1, window=DEFAULT_WINDOW):
+        """
+        :param plan: Dict - Test parameters sent to every worker (plug_speeds, cycle_iterations, timeouts ...)
+        :param results_path: String - JSON Lines file for the results of all workers
+        :param address: String - Address to listen on
+        :param port: int - Port to listen on, 0 picks a free one
+        :param expected: int - Number of workers the run is complete with
+        :param window: int - Max unacknowledged results per worker
+        """
+        # Each worker tests its own module and drive, whatever the plan file names
+        self.plan = {key: value for key, value in plan.items() if key not in HOST_KEYS}
+        self.store = ResultsStore(results_path)
+        self.expected = expected
+        self.window = window
+        self.workers = {}
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+        self._server = socket.create_server((address, port))
+        self.port = self._server.getsockname()[1]
+
+    def serve(self, timeout=None):
+        """
+        Accept workers until the expected number have finished
+
+        :param timeout: float (optional) - Max seconds to wait for the whole run
+        :return: Boolean - True if every expected worker finished
+        """
+        threading.Thread(target=self._accept, name="farm-accept", daemon=True).start()
+        deadline = None if timeout is None else time.time() + timeout
+        with self._finished:
+            while not self._all_finished():
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._finished.wait(remaining)
+            complete = self._all_finished()
+        self._server.close()
+        self.store.close()
+        return complete
+
+    def _all_finished(self):
+        done = [w for w in self.workers.values() if w.status != "running"]
+        return len(done) >= self.expected and len(done) == len(self.workers)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(Connection(sock),), name="farm-worker", daemon=True).start()
+
+    def _handle(self, connection):
+        worker = None
+        try:
+            hello = connection.receive()
+            if not hello or hello.get("type") != "hello":
+                return
+            with self._lock:
+                name = hello["worker"]
+                while name in self.workers:
+                    name += "'"
+                worker = self.workers[name] = WorkerState(name, hello.get("host"), time.time() - hello["time"])
+            connection.send({"type": "plan", "plan": self.plan, "window": self.window, "name": name})
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                if message["type"] == "result":
+                    self._add_result(worker, message)
+                    connection.send({"type": "ack", "seq": message["seq"]})
+                elif message["type"] in ("done", "error"):
+                    with self._finished:
+                        worker.status = message["type"]
+                        worker.message = message.get("message")
+                        self._finished.notify_all()
+                    connection.send({"type": "bye"})
+                    break
+        except (OSError, ValueError, KeyError) as err:
+            if worker:
+                worker.message = str(err)
+        finally:
+            connection.close()
+            if worker:
+                with self._finished:
+                    if worker.status == "running":
+                        worker.status = "lost"
+                    self._finished.notify_all()
+
+    def _add_result(self, worker, message):
+        record = CycleRecord.from_dict(message["record"])
+        record.slot = worker.name + ("/" + record.slot if record.slot else "")
+        record.timestamp += worker.clock_offset
+        self.store.add(record)
+        with self._lock:
+            summary = worker.summaries.get(record.speed)
+            if summary is None:
+                summary = worker.summaries[record.speed] = SpeedSummary(record.speed)
+            summary.add(record)
+
+    def summary_table(self):
+        """
+        :return: List<List<String>> - One row per worker and plug speed, then one per plug speed across all workers
+        """
+        rows = []
+        with self._lock:
+            workers = sorted(self.workers.values(), key=lambda w: w.name)
+            for worker in workers:
+                for speed in sorted(worker.summaries):
+                    rows.append([worker.name, worker.host or ""] + worker.summaries[speed].row())
+        for row in self.store.summary_table():
+            rows.append(["ALL", str(len(workers)) + " hosts"] + row)
+        return rows
+
+
+def print_table(rows, headers, stream=sys.stdout):
+    table = [headers] + rows
+    widths = [max(len(str(line[column])) for line in table) for column in range(len(headers))]
+    for line in table:
+        stream.write("  ".join(str(cell).ljust(width) for cell, width in zip(line, widths)).rstrip() + "\n")
+
+
+class Worker:
+    """
+    Runs plans from a coordinator through the test script's cycle loop and streams the results back.
+    """
+
+    def __init__(self, name, coordinator, module=None, drive=None, simulate=False, directory=None):
+        """
+        :param name: String - Worker name shown in the aggregated results, defaults to the host name
+        :param coordinator: (String, int) - Coordinator address and port
+        :param module: String - This host's module connection string
+        :param drive: String - This host's drive identifier
+        :param simulate: Boolean - Use a simulated module and drive
+        :param directory: String (optional) - Where the worker's log, results and checkpoint files go
+        """
+        self.name = name or socket.gethostname()
+        self.coordinator = coordinator
+        self.simulate = simulate
+        self.module = module or ("SIM:QTL1743-SIM-001" if simulate else None)
+        self.drive = drive or ("SIM-DRIVE-1" if simulate else None)
+        if not (self.module and self.drive):
+            raise ValueError("A worker needs its own module and drive, or simulate")
+        self.directory = directory or os.getcwd()
+        self.connection = None
+        self._outbox = None
+        self._in_flight = 0
+        self._window = DEFAULT_WINDOW
+        self._credit = threading.Condition()
+        self._seq = 0
+        self._closed = threading.Event()
+
+    def run(self):
+        """
+        Connect, run the coordinator's plan and report the outcome
+
+        :return: int - 0 if every cycle passed, 1 otherwise
+        """
+        self.connection = Connection(socket.create_connection(self.coordinator))
+        self.connection.send({"type": "hello", "worker": self.name, "host": socket.gethostname(),
+                              "platform": platform.platform(), "time": time.time()})
+        message = self.connection.receive()
+        if not message or message.get("type") != "plan":
+            raise RuntimeError("Coordinator did not send a plan")
+        self.name = message.get("name", self.name)
+        self._window = max(1, int(message.get("window", DEFAULT_WINDOW)))
+        # Bounded, so the cycle loop waits here when the coordinator falls behind
+        self._outbox = queue.Queue(maxsize=self._window)
+        threading.Thread(target=self._receive, name="farm-receive", daemon=True).start()
+        sender = threading.Thread(target=self._send, name="farm-send", daemon=True)
+        sender.start()
+
+        status, detail, result = "done", None, 1
+        try:
+            result = self._run_plan(message["plan"])
+        except SystemExit as err:
+            # exitScript() quits on fatal module errors
+            status, detail = "error", "Script exited (" + str(err.code) + ")"
+        except Exception as err:
+            status, detail = "error", repr(err)
+        self._queue(None)
+        sender.join()
+        with self._credit:
+            while self._in_flight and not self._closed.is_set():
+                self._credit.wait(1)
+        if not self._closed.is_set():
+            try:
+                self.connection.send({"type": status, "message": detail})
+            except OSError:
+                pass
+            self._closed.wait(5)
+        self.connection.close()
+        return result if status == "done" else 1
+
+    def _run_plan(self, plan_values):
+        from test_plan import TestPlan
+
+        values = dict(plan_values)
+        values["module"] = self.module
+        values["drive"] = self.drive
+        safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in self.name)
+        values["checkpoint"] = os.path.join(self.directory, "farm_" + safe_name + ".checkpoint.json")
+
+        script = load_test_script()
+        stamp = time.strftime("%Y-%m-%d %H_%M_%S")
+        script.logPipeline.path = script.logFilePath = os.path.join(self.directory, "LogFile" + stamp + "_" +
+                                                                     safe_name + ".txt")
+        script.resultsFilePath = os.path.join(self.directory, "Results" + stamp + "_" + safe_name + ".jsonl")
+        plan = TestPlan(values)
+        checkpoint = script.setup_plan_files(plan)
+        if self.simulate:
+            from simulation import SimulatedRig
+            script.useSimulation(SimulatedRig())
+
+        hotplug_cycle = script.hotplugCycle
+
+        def reporting_cycle(*args, **kwargs):
+            record = hotplug_cycle(*args, **kwargs)
+            self._queue(record.to_dict())
+            return record
+
+        script.hotplugCycle = reporting_cycle
+        return script.runTestPlan(plan, checkpoint)
+
+    def _queue(self, record):
+        """
+        Hand a record to the sender, waiting while the send queue is full.  Dropped once the coordinator has gone,
+        as nothing will drain the queue.
+
+        :param record: Dict - CycleRecord.to_dict(), or None to stop the sender
+        """
+        while not self._closed.is_set():
+            try:
+                self._outbox.put(record, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _send(self):
+        while not self._closed.is_set():
+            try:
+                record = self._outbox.get(timeout=1)
+            except queue.Empty:
+                continue
+            if record is None:
+                return
+            with self._credit:
+                while self._in_flight >= self._window and not self._closed.is_set():
+                    self._credit.wait(1)
+                if self._closed.is_set():
+                    return
+                self._in_flight += 1
+                seq = self._seq
+                self._seq += 1
+            try:
+                self.connection.send({"type": "result", "seq": seq, "record": record})
+            except OSError:
+                self._close()
+                return
+
+    def _receive(self):
+        try:
+            while True:
+                message = self.connection.receive()
+                if message is None or message.get("type") == "bye":
+                    break
+                if message.get("type") == "ack":
+                    with self._credit:
+                        self._in_flight -= 1
+                        self._credit.notify_all()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._close()
+
+    def _close(self):
+        self._closed.set()
+        with self._credit:
+            self._credit.notify_all()
+
+
+def spawn_simulated_workers(count, port, directory):
+    """
+    Start simulated worker processes on this machine
+
+    :return: List<Popen> - Worker processes, output discarded
+    """
+    processes = []
+    for index in range(1, count + 1):
+        command = [sys.executable, os.path.abspath(__file__), "worker", "--connect", "127.0.0.1:" + str(port),
+                   "--simulate", "--name", "sim-" + str(index), "--directory", directory]
+        processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    return processes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AN-003 hotplug test farm")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = commands.add_parser("coordinator", help="Send a plan to workers and aggregate their results")
+    coordinator.add_argument("--plan", required=True, help="JSON test plan (module and drive come from each worker)")
+    coordinator.add_argument("--listen", default="127.0.0.1", help="Address to listen on")
+    coordinator.add_argument("--port", type=int, default=DEFAULT_PORT)
+    coordinator.add_argument("--workers", type=int, default=1, help="Number of workers the run waits for")
+    coordinator.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="Max unacknowledged results per worker")
+    coordinator.add_argument("--results", default="FarmResults" + time.strftime("%Y-%m-%d %H_%M_%S") + ".jsonl")
+    coordinator.add_argument("--timeout", type=float, help="Give up after this many seconds")
+    coordinator.add_argument("--spawn-simulated", type=int, default=0, metavar="N",
+                             help="Also start N simulated workers on this machine")
+
+    worker = commands.add_parser("worker", help="Run plans from a coordinator on this host")
+    worker.add_argument("--connect", required=True, metavar="HOST:PORT")
+    worker.add_argument("--name", help="Worker name in the aggregated results (default: host name)")
+    worker.add_argument("--module", help="Module connection string on this host")
+    worker.add_argument("--drive", help="Drive identifier on this host")
+    worker.add_argument("--simulate", action="store_true", help="Use a simulated module and drive")
+    worker.add_argument("--directory", help="Where this worker's log and results files go")
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        host, _, port = args.connect.rpartition(":")
+        if not (args.module and args.drive) and not args.simulate:
+            parser.error("worker needs --module and --drive, or --simulate")
+        return Worker(args.name, (host or "127.0.0.1", int(port)), args.module, args.drive, args.simulate,
+                      args.directory).run()
+
+    with open(args.plan) as plan_file:
+        plan = json.load(plan_file)
+    expected = max(args.workers, args.spawn_simulated)
+    farm = Coordinator(plan, args.results, args.listen, args.port, expected, args.window)
+    print("Coordinator listening on " + args.listen + ":" + str(farm.port) + ", waiting for " + str(expected) +
+          " workers")
+    processes = spawn_simulated_workers(args.spawn_simulated, farm.port, os.path.dirname(
+        os.path.abspath(args.results))) if args.spawn_simulated else []
+    complete = farm.serve(args.timeout)
+    for process in processes:
+        process.wait()
+
+    print_table(farm.summary_table(), ["Worker", "Host", "Delay (mS)", "Cycles", "Failures",
+                                       "Removal p50/p95/p99/max (mS)", "Enumeration p50/p95/p99/max (mS)"])
+    for worker_state in sorted(farm.workers.values(), key=lambda w: w.name):
+        if worker_state.status != "done":
+            print(worker_state.name + ": " + worker_state.status + (" - " + worker_state.message
+                                                                     if worker_state.message else ""))
+    print("Results from all workers written to " + args.results)
+    failed = any(w.status != "done" for w in farm.workers.values())
+    failed = failed or any(s.failures for w in farm.workers.values() for s in w.summaries.values())
+    return 0 if complete and not failed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
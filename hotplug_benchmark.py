@@ -0,0 +1,283 @@
+'''
+Benchmark suite for the AN-003 hotplug test harness.
+
+Runs the real basicHotplug / pcieHotplug cycle loops from "Hotplug cycle test.py" against the simulated module and
+host (simulation.py), where every latency is injected and therefore known, and reports:
+
+    throughput  - Cycles per second with zero injected latency, i.e. the harness's own per-cycle overhead
+    accuracy    - Against the simulated drive's own clock (the moment its state actually changed): the error of the
+                  recorded removal / enumeration time, and how late the script actually saw the change
+    link_settle - Time the link training sampler holds a PCIe cycle after the link reaches its final state.  Only
+                  paid with the sysfs probe, so reported on its own rather than as part of the throughput
+    wait_cpu    - CPU used by the whole process while waiting on the drive, as a fraction of one core
+    logging     - Time spent in logWrite per cycle, and the cost of a single log line
+
+Results are printed (or written with --output) as JSON so they can be compared between releases.
+
+    python hotplug_benchmark.py --output bench.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from link_sampler import LinkTrainingSampler
+from results_store import LatencyHistogram
+from simulation import SimulatedDrive, SimulatedRig, load_test_script
+
+BENCHMARK_VERSION = 2
+
+
+class BenchRun:
+    """
+    A freshly loaded copy of the test script wired to a simulated rig, with its output kept out of the way.
+    """
+
+    def __init__(self, rig):
+        self.rig = rig
+        self.directory = tempfile.mkdtemp(prefix="an003_bench_")
+        self._devnull = open(os.devnull, "w")
+        self.script = load_test_script()
+        self.script.logPipeline.path = os.path.join(self.directory, "bench.log")
+        self.script.logPipeline.console = self._devnull
+        self.script.resultsFilePath = os.path.join(self.directory, "results.jsonl")
+        self.script.useSimulation(rig)
+        self.device = self.script.connectToModule(rig.module_strings()[0])
+        self.drive = rig.host.drives[0]
+        self.cycles = []
+        # (present, recorded time of the change, time the script saw it, time it really happened) for every wait
+        # on the drive that succeeded
+        self.waits = []
+        self.log_calls = 0
+        self.log_time = 0.0
+        self._wrap_script()
+
+    def _wrap_script(self):
+        script = self.script
+        hotplug_cycle = script.hotplugCycle
+        log_write = script.logWrite
+
+        get_presence_watcher = script.get_presence_watcher
+
+        def timed_cycle(*args, **kwargs):
+            record = hotplug_cycle(*args, **kwargs)
+            self.cycles.append(record)
+            return record
+
+        def watched_presence():
+            watcher = get_presence_watcher()
+            if not hasattr(watcher, "bench_wrapped"):
+                wait_for_state = watcher.wait_for_state
+
+                def timed_wait(drive, present, timeout, start_time=None):
+                    start_time = time.time() if start_time is None else start_time
+                    reached, elapsed = wait_for_state(drive, present, timeout, start_time)
+                    if reached:
+                        self.waits.append((present, start_time + elapsed, time.time(), drive.changed_at))
+                    return reached, elapsed
+
+                watcher.wait_for_state = timed_wait
+                watcher.bench_wrapped = True
+            return watcher
+
+        def timed_log(log_string):
+            start = time.perf_counter()
+            log_write(log_string)
+            self.log_time += time.perf_counter() - start
+            self.log_calls += 1
+
+        script.hotplugCycle = timed_cycle
+        script.get_presence_watcher = watched_presence
+        script.logWrite = timed_log
+
+    def run(self, plug_speeds, iterations, timeout=10):
+        """
+        Run the script's hotplug loop for the drive type of the rig
+
+        :return: (float, float) - Wall clock and process CPU seconds taken
+        """
+        hotplug = self.script.pcieHotplug if self.drive.drive_type == "pcie" else self.script.basicHotplug
+        wall, cpu = time.perf_counter(), time.process_time()
+        hotplug(iterations, False, self.device, timeout, timeout, self.drive, plug_speeds, False)
+        return time.perf_counter() - wall, time.process_time() - cpu
+
+    def close(self):
+        if self.script.presenceWatcher:
+            self.script.presenceWatcher.stop()
+        if self.script.resultsStore:
+            self.script.resultsStore.close()
+        self.script.logPipeline.close()
+        self._devnull.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _distribution(values):
+    histogram = LatencyHistogram(minimum=1e-7)
+    for value in values:
+        histogram.add(abs(value))
+    if not histogram.count:
+        return None
+    return {"count": histogram.count,
+            "mean_signed_ms": sum(values) / len(values) * 1000,
+            "p50_abs_ms": histogram.percentile(50) * 1000,
+            "p95_abs_ms": histogram.percentile(95) * 1000,
+            "p99_abs_ms": histogram.percentile(99) * 1000,
+            "max_abs_ms": histogram.max * 1000}
+
+
+def bench_throughput(cycles):
+    """
+    Cycles per second with zero injected latency anywhere.
+    """
+    bench = BenchRun(SimulatedRig(response_latency=0, removal_delay=0, enumeration_delay=0))
+    try:
+        wall, cpu = bench.run([25], cycles)
+    finally:
+        bench.close()
+    return {"cycles": cycles,
+            "cycles_per_sec": cycles / wall,
+            "overhead_ms_per_cycle": wall / cycles * 1000,
+            "cpu_ms_per_cycle": cpu / cycles * 1000}
+
+
+def bench_accuracy(cycles, removal_delay, enumeration_delay, jitter, probe_latency):
+    """
+    Recorded and observed drive state changes, against the time the simulated drive's state really changed.
+    The error is how far the recorded removal / enumeration instant is from the real one; the lag is how long
+    after the real change the script actually knew about it (event dispatch plus the confirming presence check).
+    """
+    bench = BenchRun(SimulatedRig(probe_latency=probe_latency, removal_delay=removal_delay,
+                                  enumeration_delay=enumeration_delay, jitter=jitter, seed=1))
+    try:
+        bench.run([25], cycles)
+    finally:
+        bench.close()
+    results = {"cycles": cycles,
+               "injected_removal_ms": removal_delay * 1000,
+               "injected_enumeration_ms": enumeration_delay * 1000,
+               "jitter_ms": jitter * 1000,
+               "probe_latency_ms": probe_latency * 1000}
+    for name, present in (("removal", False), ("enumeration", True)):
+        waits = [(recorded, seen, changed) for waited, recorded, seen, changed in bench.waits
+                 if waited is present and changed is not None]
+        results[name + "_error"] = _distribution([recorded - changed for recorded, _, changed in waits])
+        results[name + "_lag"] = _distribution([seen - changed for _, seen, changed in waits])
+    return results
+
+
+def bench_link_settle(cycles, train_time):
+    """
+    How long the link training sampler keeps sampling once the link has reached its final state, i.e. what it adds
+    to every PCIe cycle it runs in, and how closely it times the training itself.
+    """
+    drive = SimulatedDrive("SIM-DRIVE-LINK", link_train_time=train_time, initial_link=("8GT/s", "x2"))
+    settle_times = []
+    train_errors = []
+    for _ in range(cycles):
+        drive.enumerated_at = start = time.time()
+        sampler = LinkTrainingSampler(lambda sampled: sampled.current_link(), timeout=5.0).start(drive, start)
+        timeline = sampler.wait()
+        finished = time.time()
+        if timeline.time_to_final is None:
+            continue
+        settle_times.append(finished - start - timeline.time_to_final)
+        train_errors.append(timeline.time_to_final - train_time)
+    return {"cycles": cycles,
+            "train_time_ms": train_time * 1000,
+            "stable_time_ms": LinkTrainingSampler(None).stable_time * 1000,
+            "settle_window": _distribution(settle_times),
+            "train_time_error": _distribution(train_errors)}
+
+
+def bench_wait_cpu(cycles, delay):
+    """
+    CPU used while the script waits for long removal / enumeration delays.
+    """
+    bench = BenchRun(SimulatedRig(removal_delay=delay, enumeration_delay=delay))
+    try:
+        wall, cpu = bench.run([25], cycles)
+    finally:
+        bench.close()
+    return {"cycles": cycles,
+            "injected_delay_ms": delay * 1000,
+            "wall_sec": wall,
+            "cpu_sec": cpu,
+            "cpu_fraction_of_core": cpu / wall}
+
+
+def bench_logging(cycles, lines):
+    """
+    Cost of logging inside the cycle loop, and of individual log lines.
+    """
+    bench = BenchRun(SimulatedRig(response_latency=0, removal_delay=0, enumeration_delay=0))
+    try:
+        bench.run([25], cycles)
+        per_cycle_calls = bench.log_calls / cycles
+        per_cycle_ms = bench.log_time / cycles * 1000
+
+        pipeline = bench.script.logPipeline
+        start = time.perf_counter()
+        for line in range(lines):
+            pipeline.write("Benchmark line " + str(line))
+        queued = (time.perf_counter() - start) / lines
+        pipeline.flush()
+
+        # The previous implementation, for comparison: open, append and close for every line
+        legacy_path = os.path.join(bench.directory, "legacy.log")
+        start = time.perf_counter()
+        for line in range(lines):
+            with open(legacy_path, 'a') as log_file:
+                log_file.write("Benchmark line " + str(line) + "\n")
+        legacy = (time.perf_counter() - start) / lines
+    finally:
+        bench.close()
+    return {"cycles": cycles,
+            "log_calls_per_cycle": per_cycle_calls,
+            "log_ms_per_cycle": per_cycle_ms,
+            "line_us": queued * 1e6,
+            "legacy_open_append_line_us": legacy * 1e6}
+
+
+def run_benchmarks(quick=False):
+    """
+    :param quick: Boolean - Fewer cycles, for a fast smoke test
+    :return: Dict - All benchmark results
+    """
+    scale = 1 if quick else 5
+    results = {"throughput": bench_throughput(50 * scale),
+               "accuracy": bench_accuracy(10 * scale, 0.05, 0.2, 0.02, 0.0),
+               "accuracy_slow_probe": bench_accuracy(10 * scale, 0.05, 0.2, 0.02, 0.02),
+               "link_settle": bench_link_settle(4 * scale, 0.1),
+               "wait_cpu": bench_wait_cpu(2 * scale, 0.5),
+               "logging": bench_logging(20 * scale, 2000 * scale)}
+    return {"benchmark": "an003-hotplug-harness",
+            "version": BENCHMARK_VERSION,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": quick,
+            "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AN-003 hotplug harness against simulated hardware")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="Run fewer cycles")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run_benchmarks(args.quick), indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+'''
+Programmable hotplug timing sequences for the AN-003 hotplug test.
+
+A Quarch hotplug module switches each of its timed sources (pin groups) after its own delay, and can bounce a source
+(make and break it repeatedly) to imitate a connector that is not pushed in cleanly.  A HotplugSequence describes
+the delay and optional bounce pattern of every source:
+
+    HotplugSequence.ramp(25, 3)                      - Simple ramp: sources at 0, 25, 50, 50, 50, 50 mS
+    HotplugSequence([0, 0, 10, 10, 100, 100], bounce={5: Bounce(20, 2, 50)}, name="PRSNT bounce")
+    random_sequences(1000, limit, seed=1)            - Fuzzed sweep
+
+Every sequence of a run is checked against the module's delay limit before the run starts (validate_sequences
+reports all problems at once), and each compiles once into the list of module settings it needs.
+ModuleState.apply() sends only the settings that differ from what the module already has, so moving from one
+sequence to the next (HotplugSequence.transition) costs only the commands that change.
+
+Sequence files (and the "sequences" key of a test plan) are JSON lists of:
+
+    {"name": "PRSNT bounce", "delays": [0, 0, 10, 10, 100, 100], "bounce": {"5": {"length": 20, "period": 2}}}
+    {"ramp": 25, "steps": 3}
+'''
+
+import json
+import random
+
+from module_state import SOURCE_COUNT
+
+
+class Bounce:
+    """
+    Bounce pattern of one source: after its delay the source makes and breaks for <length> mS before settling.
+    """
+
+    __slots__ = ("length", "period", "duty")
+
+    def __init__(self, length, period, duty=50):
+        """
+        :param length: int - Time (mS) the source bounces for
+        :param period: int - Time (mS) of one make / break
+        :param duty: int - Percentage of each period the source is made
+        """
+        self.length = int(length)
+        self.period = int(period)
+        self.duty = int(duty)
+
+    def to_dict(self):
+        return {"length": self.length, "period": self.period, "duty": self.duty}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values["length"], values["period"], values.get("duty", 50))
+
+
+class HotplugSequence:
+    """
+    Delay and bounce pattern for every timed source of a module, for one hotplug cycle.
+    """
+
+    def __init__(self, delays, bounce=None, name=None, speed=None, source_count=SOURCE_COUNT):
+        """
+        :param delays: List<int> or Dict<int, int> - Delay (mS) of each source, sources numbered from 1.  Sources
+                       left out take the delay of the last one given
+        :param bounce: Dict<int, Bounce> (optional) - Bounce pattern per source, other sources switch cleanly
+        :param name: String (optional) - Shown in the log
+        :param speed: int (optional) - Plug speed (mS) the cycles are recorded under, defaults to the gap between
+                      the first two source changes (the step of a ramp)
+        :param source_count: int - Number of timed sources on the module
+        """
+        if not isinstance(delays, dict):
+            delays = {source: delay for source, delay in enumerate(delays, 1)}
+        if not delays:
+            raise ValueError("A sequence needs at least one source delay")
+        unknown = [source for source in list(delays) + list(bounce or {}) if not 1 <= int(source) <= source_count]
+        if unknown:
+            raise ValueError("No source " + ", ".join(str(source) for source in unknown) + " on a " +
+                             str(source_count) + " source module")
+        self.delays = []
+        last = 0
+        for source in range(1, source_count + 1):
+            last = int(delays.get(source, delays.get(str(source), last)))
+            self.delays.append(last)
+        self.bounce = {int(source): pattern for source, pattern in (bounce or {}).items()}
+        steps = sorted(set(self.delays))
+        self.speed = int(speed) if speed is not None else (steps[1] - steps[0] if len(steps) > 1 else 0)
+        self.name = name
+        self._compiled = None
+
+    @classmethod
+    def ramp(cls, delay_time, step_count, source_count=SOURCE_COUNT):
+        """
+        The classic linear ramp: source n switches (n - 1) * delay_time after the first, up to step_count sources,
+        and the remaining sources switch with the last one.
+
+        :param delay_time: int - Delay (mS) between steps
+        :param step_count: int - Number of steps, 2 to source_count
+        """
+        return cls([(step - 1) * delay_time for step in range(1, step_count + 1)], speed=delay_time,
+                   name=str(delay_time) + "mS x " + str(step_count) + " ramp", source_count=source_count)
+
+    @classmethod
+    def from_dict(cls, values, source_count=SOURCE_COUNT):
+        """
+        :param values: Dict - {"delays": [...], "bounce": {...}, "name": ..., "speed": ...} or {"ramp": 25, "steps": 3}
+        """
+        if "ramp" in values:
+            sequence = cls.ramp(int(values["ramp"]), int(values.get("steps", 3)), source_count)
+            sequence.name = values.get("name", sequence.name)
+            return sequence
+        bounce = {int(source): Bounce.from_dict(pattern) for source, pattern in values.get("bounce", {}).items()}
+        return cls(values["delays"], bounce, values.get("name"), values.get("speed"), source_count)
+
+    def to_dict(self):
+        values = {"delays": list(self.delays), "speed": self.speed}
+        if self.name:
+            values["name"] = self.name
+        if self.bounce:
+            values["bounce"] = {str(source): pattern.to_dict() for source, pattern in sorted(self.bounce.items())}
+        return values
+
+    def describe(self):
+        text = (self.name + ": " if self.name else "") + "delays " + "/".join(str(d) for d in self.delays) + " mS"
+        for source, pattern in sorted(self.bounce.items()):
+            text += ", source " + str(source) + " bounces " + str(pattern.length) + " mS (" + \
+                    str(pattern.period) + " mS period, " + str(pattern.duty) + "% duty)"
+        return text
+
+    def problems(self, limit):
+        """
+        Check the sequence against a module's delay limit
+
+        :param limit: int - Longest delay (mS) the module accepts on a source, see module_state.delay_limit()
+        :return: List<String> - Everything wrong with the sequence, empty if it can be run
+        """
+        problems = []
+        for source, delay in enumerate(self.delays, 1):
+            if not 0 <= delay <= limit:
+                problems.append("source " + str(source) + " delay " + str(delay) + " mS outside 0 to " +
+                                str(limit) + " mS")
+        for source, pattern in sorted(self.bounce.items()):
+            if pattern.period < 1 or pattern.length < pattern.period:
+                problems.append("source " + str(source) + " bounce needs a period of at least 1 mS and a length of "
+                                "at least one period")
+            elif self.delays[source - 1] + pattern.length > limit:
+                problems.append("source " + str(source) + " bounce ends after " +
+                                str(self.delays[source - 1] + pattern.length) + " mS, past the " + str(limit) +
+                                " mS limit")
+            if not 1 <= pattern.duty <= 99:
+                problems.append("source " + str(source) + " bounce duty " + str(pattern.duty) + "% outside 1 to 99%")
+        return problems
+
+    def compile(self):
+        """
+        :return: Tuple<(String, value)> - Module settings for the sequence in the order they must be sent.
+                 Bounce settings are only included for sources that bounce, so modules without bounce support can
+                 still run plain sequences.
+        """
+        if self._compiled is None:
+            settings = []
+            for source, delay in enumerate(self.delays, 1):
+                settings.append(("source:" + str(source) + ":delay", delay))
+            for source, pattern in sorted(self.bounce.items()):
+                prefix = "source:" + str(source) + ":bounce:"
+                settings += [(prefix + "length", pattern.length), (prefix + "period", pattern.period),
+                             (prefix + "duty", pattern.duty), (prefix + "mode", "ON")]
+            self._compiled = tuple(settings)
+        return self._compiled
+
+    def transition(self, current):
+        """
+        Settings to move a module from its current configuration to this sequence, for ModuleState.apply()
+
+        :param current: Dict<String, value> - Settings the module is known to have (ModuleState.settings)
+        :return: List<(String, value)> - The compiled settings, plus switching bounce off on any source the module
+                 was last told to bounce that this sequence doesn't
+        """
+        settings = list(self.compile())
+        for source in range(1, len(self.delays) + 1):
+            mode = "source:" + str(source) + ":bounce:mode"
+            if current.get(mode) == "ON" and source not in self.bounce:
+                settings.append((mode, "OFF"))
+        return settings
+
+
+def validate_sequences(sequences, limit):
+    """
+    Check a whole set of sequences before running any of them
+
+    :param sequences: List<HotplugSequence> - Sequences of the run
+    :param limit: int - Longest delay (mS) the module accepts on a source
+    :return: List<String> - One line per problem, naming the sequence, empty if all can be run
+    """
+    problems = []
+    for index, sequence in enumerate(sequences, 1):
+        label = sequence.name or "sequence " + str(index)
+        problems += [label + ": " + problem for problem in sequence.problems(limit)]
+    return problems
+
+
+def load_sequences(path, source_count=SOURCE_COUNT):
+    """
+    :param path: String - JSON file holding a list of sequences, see module docstring
+    :return: List<HotplugSequence>
+    """
+    with open(path) as sequence_file:
+        values = json.load(sequence_file)
+    return [HotplugSequence.from_dict(entry, source_count) for entry in values]
+
+
+def random_sequences(count, limit, seed=None, bounce_rate=0.1, max_delay=None, source_count=SOURCE_COUNT):
+    """
+    Random sequences for fuzzing, all within the module's limits
+
+    :param count: int - Number of sequences
+    :param limit: int - Longest delay (mS) the module accepts on a source
+    :param seed: int (optional) - Seed, to repeat a sweep exactly
+    :param bounce_rate: float - Chance of each source bouncing
+    :param max_delay: int (optional) - Longest delay (mS) to generate, defaults to the limit
+    :param source_count: int - Number of timed sources on the module
+    :return: List<HotplugSequence>
+    """
+    generator = random.Random(seed)
+    max_delay = min(limit, max_delay or limit)
+    sequences = []
+    for index in range(1, count + 1):
+        delays = [generator.randint(0, max_delay) for _ in range(source_count)]
+        bounce = {}
+        for source, delay in enumerate(delays, 1):
+            room = min(limit - delay, 100)
+            if room >= 2 and generator.random() < bounce_rate:
+                period = generator.randint(1, max(1, room // 4))
+                bounce[source] = Bounce(generator.randint(period, room), period, generator.randint(10, 90))
+        sequences.append(HotplugSequence(delays, bounce, "random " + str(index), source_count=source_count))
+    return sequences
@@ -0,0 +1,228 @@
+'''
+Concurrent I/O workload for the AN-003 hotplug test.
+
+Keeps I/O running against the drive (or any file / loop device) while it is pulled and plugged, to show what
+happens to in-flight I/O and how fast throughput recovers after re-enumeration.  Each of <queue_depth> worker
+threads issues one block-aligned I/O at a time with O_DIRECT where the target supports it, reopening the target
+after errors so it picks the drive back up as soon as it returns.
+
+Per cycle it reports the I/Os in flight at the pull that failed (at most one per worker), the failed retries while
+the drive was gone, the time from enumeration to the first successful I/O, and the time until throughput is back to
+its pre-pull level.
+'''
+
+import mmap
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# Default fraction of baseline throughput that counts as recovered
+STEADY_FRACTION = 0.9
+
+
+class IoWorkload:
+    """
+    Multi-threaded direct I/O load generator with per-cycle recovery metrics.
+    """
+
+    def __init__(self, path, block_size=4096, queue_depth=4, read_ratio=1.0, span=None, direct=True,
+                 bucket_time=0.01, history=60.0, seed=None):
+        """
+        :param path: String - Device node or file to run I/O against
+        :param block_size: int - Bytes per I/O, a multiple of the device's logical block size for O_DIRECT
+        :param queue_depth: int - Number of I/Os kept in flight (one per worker thread)
+        :param read_ratio: float - Fraction of I/Os that are reads.  Anything below 1.0 WRITES to the target.
+        :param span: int (optional) - Bytes at the start of the target to use, defaults to the whole target
+        :param direct: Boolean - Use O_DIRECT where the target supports it
+        :param bucket_time: float - Resolution (Seconds) of the throughput history
+        :param history: float - Seconds of throughput history kept
+        :param seed: int (optional) - Seed for the I/O offsets
+        """
+        self.path = path
+        self.block_size = block_size
+        self.queue_depth = max(1, queue_depth)
+        self.read_ratio = read_ratio
+        self.span = span
+        self.direct = direct and hasattr(os, "O_DIRECT")
+        self.bucket_time = bucket_time
+        self._buckets = deque(maxlen=int(history / bucket_time))
+        # Errors since mark_pull(): I/Os on a descriptor opened before the pull, and every retry after that
+        self._in_flight_errors = 0
+        self._absent_errors = 0
+        self._successes = deque(maxlen=1024)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = False
+        self._seed = seed
+        self.baseline = None
+        self.pull_time = None
+        self.enumerated_time = None
+
+    def start(self, baseline_time=1.0):
+        """
+        Start the workers and measure the baseline throughput
+
+        :param baseline_time: float - Seconds of I/O used to establish the steady-state throughput
+        :return: IoWorkload obj
+        """
+        if self.span is None:
+            self.span = self._target_size()
+        if self.span < self.block_size:
+            raise ValueError("I/O target " + self.path + " is smaller than one block")
+        self._running = True
+        for index in range(self.queue_depth):
+            seed = None if self._seed is None else self._seed + index
+            thread = threading.Thread(target=self._worker, args=(random.Random(seed),), name="io-" + str(index),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        start = time.time()
+        time.sleep(baseline_time)
+        self.baseline = self.throughput(start, time.time())
+        return self
+
+    def stop(self):
+        self._running = False
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+    def _target_size(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            return os.lseek(fd, 0, os.SEEK_END)
+        finally:
+            os.close(fd)
+
+    def _open(self):
+        flags = os.O_RDWR if self.read_ratio < 1.0 else os.O_RDONLY
+        if self.direct:
+            try:
+                return os.open(self.path, flags | os.O_DIRECT)
+            except OSError:
+                # e.g. tmpfs files don't support O_DIRECT
+                self.direct = False
+        return os.open(self.path, flags)
+
+    def _worker(self, rng):
+        # mmap memory is page aligned, as O_DIRECT needs
+        buffer = mmap.mmap(-1, self.block_size)
+        buffer.write(os.urandom(self.block_size))
+        blocks = self.span // self.block_size
+        fd = None
+        opened = None
+        while self._running:
+            try:
+                if fd is None:
+                    opened = time.time()
+                    fd = self._open()
+                offset = rng.randrange(blocks) * self.block_size
+                if rng.random() < self.read_ratio:
+                    done = os.preadv(fd, [buffer], offset)
+                else:
+                    done = os.pwritev(fd, [buffer], offset)
+                if done != self.block_size:
+                    raise OSError(0, "Short I/O")
+                self._complete(time.time())
+            except OSError:
+                self._error(time.time(), opened if fd is not None else None)
+                if fd is not None:
+                    try:
+                        os.close(fd)
+                    except OSError:
+                        pass
+                    fd = None
+                # Back off briefly rather than spinning while the drive is gone
+                time.sleep(0.001)
+        if fd is not None:
+            os.close(fd)
+        buffer.close()
+
+    def _complete(self, now):
+        bucket = int(now / self.bucket_time)
+        with self._lock:
+            if self._buckets and self._buckets[-1][0] == bucket:
+                self._buckets[-1][1] += 1
+            else:
+                self._buckets.append([bucket, 1])
+            if self.enumerated_time is not None and (not self._successes or self._successes[-1] < self.enumerated_time):
+                self._successes.append(now)
+
+    def _error(self, now, opened):
+        """
+        :param now: float - Time of the error
+        :param opened: float - Time the descriptor the I/O used was opened, None if opening the target failed
+        """
+        with self._lock:
+            if self.pull_time is None or now < self.pull_time:
+                return
+            if opened is not None and opened < self.pull_time:
+                self._in_flight_errors += 1
+            else:
+                self._absent_errors += 1
+
+    def throughput(self, start_time, end_time):
+        """
+        :return: float - Completed I/Os per second between two times
+        """
+        if end_time <= start_time:
+            return 0.0
+        first, last = int(start_time / self.bucket_time), int(end_time / self.bucket_time)
+        with self._lock:
+            count = sum(n for bucket, n in self._buckets if first <= bucket < last)
+        return count / ((last - first) * self.bucket_time or 1)
+
+    def mark_pull(self, pull_time):
+        """
+        Note the start of a cycle, just before the pull command
+        """
+        with self._lock:
+            self.pull_time = pull_time
+            self.enumerated_time = None
+            self._in_flight_errors = 0
+            self._absent_errors = 0
+            self._successes.clear()
+
+    def mark_enumerated(self, enumerated_time):
+        """
+        Note when the script saw the drive come back
+        """
+        with self._lock:
+            self.enumerated_time = enumerated_time
+
+    def cycle_metrics(self, recovery_timeout=5.0, steady_window=0.1, steady_fraction=STEADY_FRACTION):
+        """
+        Metrics for the cycle since mark_pull(), waiting up to recovery_timeout for throughput to recover
+
+        :param recovery_timeout: float - Max seconds after enumeration to wait for steady state
+        :param steady_window: float - Length (Seconds) of the window throughput is averaged over
+        :param steady_fraction: float - Fraction of baseline throughput counted as recovered
+        :return: Dict - "errors" (I/Os in flight at the pull that failed), "absent_errors" (failed retries while the
+                 drive was gone), "first_io_time" and "recovery_time" (Seconds after enumeration, None if not seen)
+        """
+        with self._lock:
+            metrics = {"errors": self._in_flight_errors, "absent_errors": self._absent_errors,
+                       "first_io_time": None, "recovery_time": None}
+        if self.enumerated_time is None:
+            return metrics
+
+        target = (self.baseline or 0) * steady_fraction
+        deadline = self.enumerated_time + recovery_timeout
+        window_start = self.enumerated_time
+        while True:
+            now = time.time()
+            with self._lock:
+                first = self._successes[0] if self._successes else None
+            if first is not None and metrics["first_io_time"] is None:
+                metrics["first_io_time"] = first - self.enumerated_time
+            # Slide a window forward from enumeration looking for throughput back at the baseline
+            while window_start + steady_window <= now:
+                if self.throughput(window_start, window_start + steady_window) >= target:
+                    metrics["recovery_time"] = window_start + steady_window - self.enumerated_time
+                    return metrics
+                window_start += self.bucket_time
+            if now > deadline:
+                return metrics
+            time.sleep(steady_window / 2)
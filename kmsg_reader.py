@@ -0,0 +1,175 @@
+'''
+Kernel log correlation for the AN-003 hotplug test.
+
+Streams /dev/kmsg on a background thread, keeps the hotplug related messages (pciehp, pcieport, AER, nvme, PCI
+enumeration) and converts their timestamps to the time.time() clock the script uses.  Each cycle can then pick up
+the kernel messages logged while it ran, and the removal / enumeration times can be split into the time the
+kernel took to see the change and the time until the script saw it.  Messages are kept on the kernel's monotonic
+clock and converted with an offset measured at each lookup, so NTP slewing the wall clock during a long soak
+doesn't skew the split.
+'''
+
+import errno
+import os
+import re
+import select
+import threading
+import time
+from collections import deque, namedtuple
+
+KMSG_PATH = "/dev/kmsg"
+# How long the reader waits for a message before checking whether it has been stopped
+POLL_INTERVAL = 0.2
+
+# A kernel message.  timestamp is on the time.time() clock once returned by KernelLogReader.events_between().
+KernelEvent = namedtuple("KernelEvent", ["timestamp", "priority", "message"])
+
+# Messages worth keeping
+RELEVANT_PATTERN = re.compile(r"pciehp|pcieport|\bAER\b|nvme|\bpci \d{4}:|Slot\(|Link (?:Up|Down)|"
+                              r"Card (?:not )?present|Presence Detect|Surprise|hotplug", re.IGNORECASE)
+# Messages showing the kernel has noticed the drive going away
+REMOVAL_PATTERN = re.compile(r"Link Down|Card not present|Presence Detect|Surprise Down|removing|"
+                             r"controller is down|Removing from iommu group", re.IGNORECASE)
+# Messages showing the kernel bringing the drive back
+ENUMERATION_PATTERN = re.compile(r"Link Up|Card present|\[[0-9a-f]{4}:[0-9a-f]{4}\] type 00|pci function|"
+                                 r"enabling device|\d+/\d+/\d+ default/read/poll queues", re.IGNORECASE)
+PCI_ADDRESS_PATTERN = re.compile(r"\b[0-9a-fA-F]{4}:[0-9a-fA-F]{2}:[0-9a-fA-F]{2}\.[0-7]\b")
+
+
+def monotonic_offset():
+    """
+    :return: float - Value to add to a CLOCK_MONOTONIC time (as used by /dev/kmsg) to get time.time()
+    """
+    # Bracket the monotonic read between two wall clock reads to keep the error to a few microseconds
+    before = time.time()
+    monotonic = time.clock_gettime(time.CLOCK_MONOTONIC)
+    after = time.time()
+    return (before + after) / 2 - monotonic
+
+
+def parse_kmsg(record, offset):
+    """
+    Parse one /dev/kmsg record ("priority,sequence,usec,flags;message\\n KEY=VALUE...")
+
+    :param record: bytes - Raw record
+    :param offset: float - Monotonic to wall clock offset (see monotonic_offset)
+    :return: KernelEvent or None if the record can't be parsed
+    """
+    header, sep, body = record.partition(b";")
+    if not sep:
+        return None
+    fields = header.split(b",")
+    if len(fields) < 3:
+        return None
+    try:
+        priority = int(fields[0]) & 7
+        usec = int(fields[2])
+    except ValueError:
+        return None
+    message = body.split(b"\n", 1)[0].decode(errors="replace")
+    return KernelEvent(usec / 1e6 + offset, priority, message)
+
+
+class KernelLogReader:
+    """
+    Background /dev/kmsg reader keeping a bounded history of hotplug related kernel messages.
+    """
+
+    def __init__(self, path=KMSG_PATH, history=4096):
+        """
+        :param path: String - Kernel log device
+        :param history: int - Number of recent relevant messages kept
+        """
+        self.path = path
+        # Monotonic to wall clock offset used by the last lookup
+        self.offset = monotonic_offset()
+        # Relevant messages, timestamps on the monotonic clock
+        self._events = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._fd = None
+        self._thread = None
+        self._running = False
+
+    @staticmethod
+    def available(path=KMSG_PATH):
+        return os.access(path, os.R_OK)
+
+    def start(self):
+        if self._running:
+            return self
+        self._fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        # Only messages from now on are of interest
+        os.lseek(self._fd, 0, os.SEEK_END)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="kmsg-reader", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        # The thread must be done with the fd before it is closed, or its number may already belong to another file
+        if self._thread is not None:
+            self._thread.join(timeout=POLL_INTERVAL * 5)
+            self._thread = None
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def _run(self):
+        while self._running:
+            try:
+                readable, _, _ = select.select([self._fd], [], [], POLL_INTERVAL)
+                if not readable:
+                    continue
+                record = os.read(self._fd, 8192)
+            except (OSError, ValueError) as err:
+                if getattr(err, "errno", None) in (errno.EPIPE, errno.EAGAIN, errno.EINTR):
+                    # EPIPE: messages were overwritten before we read them, carry on from the next one
+                    continue
+                return
+            if not record:
+                continue
+            event = parse_kmsg(record, 0.0)
+            if event and RELEVANT_PATTERN.search(event.message):
+                with self._lock:
+                    self._events.append(event)
+
+    def events_between(self, start_time, end_time=None, addresses=None):
+        """
+        Relevant kernel messages logged in a time window
+
+        :param start_time: float - Window start (time.time() clock)
+        :param end_time: float (optional) - Window end, defaults to now
+        :param addresses: List<String> (optional) - PCI addresses belonging to the drive under test.  Messages
+                          naming some other PCI address are dropped, messages naming none are kept.
+        :return: List<KernelEvent>
+        """
+        end_time = time.time() if end_time is None else end_time
+        self.offset = offset = monotonic_offset()
+        with self._lock:
+            events = [e._replace(timestamp=e.timestamp + offset) for e in self._events
+                      if start_time <= e.timestamp + offset <= end_time]
+        if addresses:
+            wanted = set(a.lower() for a in addresses if a)
+            events = [e for e in events
+                      if not PCI_ADDRESS_PATTERN.search(e.message) or
+                      any(a.lower() in wanted for a in PCI_ADDRESS_PATTERN.findall(e.message))]
+        return events
+
+
+def kernel_detection_time(events, start_time, end_time, pattern):
+    """
+    Time of the last kernel message of a kind between a command and the script seeing its effect, i.e. the point
+    up to which the kernel was still working on the change
+
+    :param events: List<KernelEvent> - Messages for the cycle
+    :param start_time: float - When the command was sent
+    :param end_time: float - When the script detected the change
+    :param pattern: Compiled regex - REMOVAL_PATTERN or ENUMERATION_PATTERN
+    :return: float - Timestamp of the message, None if there was none
+    """
+    matches = [e.timestamp for e in events if start_time <= e.timestamp <= end_time and pattern.search(e.message)]
+    return max(matches) if matches else None
@@ -0,0 +1,155 @@
+'''
+PCIe link training timeline capture for the AN-003 hotplug test.
+
+A single link speed / width reading after enumeration passes or fails a drive depending on when it happened to be
+taken; a drive that trains at Gen3 x2 and reaches Gen4 x4 200mS later looks like a failure if read too early.
+LinkTrainingSampler instead samples the link from "RUN:POWer UP" at a high rate on a background thread until it
+has held the same state for a settling period, and keeps the timeline of every state it passed through.  It is only
+used with the sysfs probe, where a sample is a config space read; sampling through lspci / smartctl would compete
+with the enumeration wait for the host, so without the probe the link is read once after enumeration.
+'''
+
+import threading
+import time
+from collections import namedtuple
+
+# One link state change.  elapsed is seconds since power up, status is the port's link status where known.
+LinkSample = namedtuple("LinkSample", ["elapsed", "speed", "width", "status"])
+
+
+class LinkTimeline:
+    """
+    Link states seen during one power up.  Only changes are kept, so the size depends on how often the link
+    changed, not on the sample rate.
+    """
+
+    def __init__(self):
+        self.transitions = []
+        self.samples = 0
+        self.stable = False
+
+    def add(self, sample):
+        self.samples += 1
+        last = self.transitions[-1] if self.transitions else None
+        if last is None or (last.speed, last.width, last.status) != (sample.speed, sample.width, sample.status):
+            self.transitions.append(sample)
+
+    @property
+    def final(self):
+        """
+        :return: (String, String) - Last link speed and width seen, (None, None) if the link never came up
+        """
+        for sample in reversed(self.transitions):
+            if sample.speed is not None:
+                return sample.speed, sample.width
+        return None, None
+
+    @property
+    def time_to_final(self):
+        """
+        :return: float - Seconds from power up until the link first reached its final speed and width
+        """
+        final = self.final
+        if final[0] is None:
+            return None
+        reached = None
+        for sample in self.transitions:
+            if (sample.speed, sample.width) == final:
+                if reached is None:
+                    reached = sample.elapsed
+            else:
+                reached = None
+        return reached
+
+    def intermediate_states(self):
+        """
+        :return: List<String> - Link states ("8GT/s x2") seen on the way to the final state, in order
+        """
+        final = self.final
+        states = []
+        for sample in self.transitions:
+            if sample.speed is None or (sample.speed, sample.width) == final:
+                continue
+            state = str(sample.speed) + " " + str(sample.width)
+            if not states or states[-1] != state:
+                states.append(state)
+        return states
+
+
+class LinkTrainingSampler:
+    """
+    Samples a drive's link state on a background thread until it settles.
+    """
+
+    def __init__(self, read_link, read_status=None, interval=0.001, stable_time=0.25, timeout=10.0):
+        """
+        :param read_link: callable(drive) -> (String, String) - Current link speed and width, (None, None) if down
+        :param read_status: callable(drive) -> String (optional) - Port link status ("training", "active" etc.)
+        :param interval: float - Seconds between samples
+        :param stable_time: float - Seconds the link must hold one state, once up, to count as settled
+        :param timeout: float - Max seconds to sample for
+        """
+        self.read_link = read_link
+        self.read_status = read_status
+        self.interval = interval
+        self.stable_time = stable_time
+        self.timeout = timeout
+        self._thread = None
+        self._stop = threading.Event()
+        self.timeline = None
+
+    def start(self, drive, start_time=None):
+        """
+        Start sampling, normally straight after the power up command
+
+        :param drive: DriveWrapper obj - Drive to sample
+        :param start_time: float (optional) - time.time() of the power up, defaults to now
+        """
+        self.timeline = LinkTimeline()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(drive, start_time or time.time()),
+                                        name="link-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self, drive, start_time):
+        timeline = self.timeline
+        stable_since = None
+        last_state = None
+        while not self._stop.is_set():
+            now = time.time()
+            try:
+                speed, width = self.read_link(drive)
+            except Exception:
+                speed, width = None, None
+            status = self.read_status(drive) if self.read_status else None
+            timeline.add(LinkSample(now - start_time, speed, width, status))
+
+            state = (speed, width, status)
+            if state != last_state:
+                last_state = state
+                stable_since = now
+            elif speed is not None and now - stable_since >= self.stable_time:
+                timeline.stable = True
+                return
+            if now - start_time > self.timeout:
+                return
+            self._stop.wait(self.interval)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the link to settle (or the sampler to time out)
+
+        :param timeout: float (optional) - Max seconds to wait, defaults to the sampler timeout
+        :return: LinkTimeline obj - The captured timeline
+        """
+        if self._thread is not None:
+            self._thread.join(self.timeout if timeout is None else timeout)
+        return self.timeline
+
+    def stop(self):
+        """
+        Stop sampling early, e.g. when the drive has not returned at all
+        """
+        self._stop.set()
+        return self.wait()
@@ -0,0 +1,428 @@
+'''
+Bulk analysis of historical AN-003 log files.
+
+Parses any number of LogFile<timestamp>.txt files written by the hotplug test, in parallel, into one columnar
+dataset (a NumPy array per column, one row per cycle) and reports removal / enumeration latency distributions and
+failure rates per plug speed, optionally split by module, drive or run:
+
+    python log_analytics.py /path/to/logs --by drive
+    python log_analytics.py "logs/**/LogFile*.txt" --json summary.json
+
+The parsed columns of each file are cached (in .an003_log_cache next to the logs by default) and reused for as long
+as the file's size and modification time are unchanged, so re-running over a growing archive only parses the new
+and still-growing files.
+
+Needs NumPy.
+'''
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CACHE_VERSION = 2
+CACHE_DIR_NAME = ".an003_log_cache"
+
+# Failure codes stored in the "failure" column
+FAILURE_NAMES = ("pass", "not removed", "not returned", "link mismatch", "other", "incomplete")
+PASSED, NOT_REMOVED, NOT_RETURNED, LINK_MISMATCH, OTHER_FAILURE, INCOMPLETE = range(len(FAILURE_NAMES))
+
+# Multi-slot runs prefix every line with "[<slot name>] "
+SLOT_PREFIX = re.compile(r"^\[([^\]]+)\] ")
+BANNER = re.compile(r"^Test -(\d+)mS HotPlug Test - (\d+)/\d+")
+RESULT = re.compile(r"^Test - \d+mS HotPlug Test - (Passed|Failed)")
+REMOVED = re.compile(r"^Device removed correctly in ([\d.eE+-]+) sec")
+ENUMERATED = re.compile(r"^<Device enumerated correctly in ([\d.eE+-]+) sec>")
+FAILURE = re.compile(r"^\*\*\*FAIL: (.*)")
+MODULE = re.compile(r"^Connected to module: (.*)")
+DRIVE = re.compile(r"^Drive under test: (.*)")
+
+COLUMNS = ("slot", "speed", "iteration", "removal", "enumeration", "failure")
+
+
+def _failure_code(message):
+    if "was not removed" in message:
+        return NOT_REMOVED
+    if "did not return" in message:
+        return NOT_RETURNED
+    if "Mismatch" in message:
+        return LINK_MISMATCH
+    return OTHER_FAILURE
+
+
+def parse_log(path):
+    """
+    Stream-parse one log file
+
+    :param path: String - LogFile*.txt written by the hotplug test
+    :return: Dict - Column lists (see COLUMNS), plus "slots" (slot names indexed by the slot column), "module"
+             and "drive" (last seen in the file, None if not logged)
+    """
+    columns = {name: [] for name in COLUMNS}
+    slots = {}
+    current = {}
+    # Per slot, the plug speed whose result line is stuck at "Failed".  Older versions of the script only reset the
+    # result at each new speed, so every later cycle at that speed reported "Failed" too.
+    carried = {}
+    meta = {"module": None, "drive": None}
+
+    def close_cycle(slot):
+        cycle = current.pop(slot, None)
+        if cycle is None:
+            return
+        columns["slot"].append(slots.setdefault(slot, len(slots)))
+        for name in ("speed", "iteration", "removal", "enumeration", "failure"):
+            columns[name].append(cycle[name])
+
+    with open(path, errors="replace") as log_file:
+        for line in log_file:
+            line = line.rstrip("\r\n")
+            slot = ""
+            match = SLOT_PREFIX.match(line)
+            if match:
+                slot = match.group(1)
+                line = line[match.end():]
+            line = line.lstrip()
+
+            match = BANNER.match(line)
+            if match:
+                close_cycle(slot)
+                if int(match.group(2)) == 1:
+                    carried.pop(slot, None)
+                current[slot] = {"speed": int(match.group(1)), "iteration": int(match.group(2)),
+                                 "removal": float("nan"), "enumeration": float("nan"), "failure": INCOMPLETE,
+                                 "failed": None}
+                continue
+            cycle = current.get(slot)
+            if cycle is None:
+                match = MODULE.match(line) or DRIVE.match(line)
+                if match:
+                    meta["module" if line.startswith("Connected") else "drive"] = match.group(1).strip()
+                continue
+            match = REMOVED.match(line)
+            if match:
+                cycle["removal"] = float(match.group(1))
+                continue
+            match = ENUMERATED.match(line)
+            if match:
+                cycle["enumeration"] = float(match.group(1))
+                continue
+            match = FAILURE.match(line)
+            if match:
+                # The first failure in a cycle is the one reported
+                if cycle["failed"] is None:
+                    cycle["failed"] = _failure_code(match.group(1))
+                continue
+            match = RESULT.match(line)
+            if match:
+                # The verdict comes from the cycle's own failure lines, the result line may be carried over
+                if cycle["failed"] is not None:
+                    cycle["failure"] = cycle["failed"]
+                    carried[slot] = cycle["speed"]
+                elif match.group(1) == "Passed" or carried.get(slot) == cycle["speed"]:
+                    cycle["failure"] = PASSED
+                else:
+                    cycle["failure"] = OTHER_FAILURE
+                close_cycle(slot)
+    for slot in list(current):
+        cycle = current[slot]
+        if cycle["failed"] is not None:
+            # Run stopped after a failure, e.g. a module command failing
+            cycle["failure"] = cycle["failed"]
+        close_cycle(slot)
+
+    result = dict(columns)
+    result["slots"] = [name for name, _ in sorted(slots.items(), key=lambda item: item[1])]
+    result.update(meta)
+    return result
+
+
+def _to_arrays(parsed):
+    return {"slot": np.array(parsed["slot"], dtype=np.int16),
+            "speed": np.array(parsed["speed"], dtype=np.int32),
+            "iteration": np.array(parsed["iteration"], dtype=np.int32),
+            "removal": np.array(parsed["removal"], dtype=np.float64),
+            "enumeration": np.array(parsed["enumeration"], dtype=np.float64),
+            "failure": np.array(parsed["failure"], dtype=np.int8)}
+
+
+def _cache_path(cache_dir, path):
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + ".npz")
+
+
+def _load_cached(cache_file, stat):
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            key = cached["key"]
+            if int(key[0]) != CACHE_VERSION or int(key[1]) != stat.st_mtime_ns or int(key[2]) != stat.st_size:
+                return None
+            meta = json.loads(str(cached["meta"]))
+            return {name: cached[name] for name in COLUMNS}, meta
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _parse_and_cache(path, cache_file, mtime_ns, size):
+    """
+    Worker: parse a file and write its cache entry
+    """
+    parsed = parse_log(path)
+    arrays = _to_arrays(parsed)
+    meta = {"slots": parsed["slots"], "module": parsed["module"], "drive": parsed["drive"]}
+    if cache_file:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        temp_path = cache_file + ".tmp.npz"
+        np.savez(temp_path, key=np.array([CACHE_VERSION, mtime_ns, size], dtype=np.int64),
+                 meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(temp_path, cache_file)
+    return arrays, meta
+
+
+class LogDataset:
+    """
+    Cycles from many log files as parallel column arrays, plus per-run lookup tables.
+    """
+
+    def __init__(self):
+        self.columns = {name: [] for name in COLUMNS}
+        self.columns["run"] = []
+        self.runs = []
+        self.parsed = 0
+        self.cached = 0
+
+    def _add(self, path, arrays, meta):
+        run = len(self.runs)
+        self.runs.append({"file": path, "module": meta["module"], "drive": meta["drive"], "slots": meta["slots"]})
+        rows = len(arrays["speed"])
+        for name in COLUMNS:
+            self.columns[name].append(arrays[name])
+        self.columns["run"].append(np.full(rows, run, dtype=np.int32))
+
+    def finish(self):
+        for name, parts in self.columns.items():
+            self.columns[name] = np.concatenate(parts) if parts else np.array([])
+        return self
+
+    def __len__(self):
+        return len(self.columns["speed"])
+
+    def group_ids(self, by):
+        """
+        Group every cycle by a property of its run.  Only the (small) run table is looked at per run, the cycles are
+        mapped with array indexing.
+
+        :param by: String - "module", "drive", "run" or "slot"
+        :return: (ndarray<int>, List<String>) - Group index of every cycle, and the group names
+        """
+        runs = self.columns["run"]
+        if by == "slot":
+            names = sorted({slot or "-" for run in self.runs for slot in run["slots"]})
+            index = {name: i for i, name in enumerate(names)}
+            lookup = np.zeros((len(self.runs), max([len(run["slots"]) for run in self.runs] + [1])), dtype=np.int32)
+            for row, run in enumerate(self.runs):
+                lookup[row, :len(run["slots"])] = [index[slot or "-"] for slot in run["slots"]]
+            return lookup[runs, self.columns["slot"]], names
+        if by == "run":
+            run_names = [os.path.basename(run["file"]) for run in self.runs]
+        elif by in ("module", "drive"):
+            run_names = [run[by] or "unknown" for run in self.runs]
+        else:
+            raise ValueError("Unknown grouping " + str(by))
+        names, run_groups = np.unique(np.array(run_names, dtype=str), return_inverse=True)
+        return run_groups[runs], list(names)
+
+
+def load_logs(paths, cache_dir=None, workers=None, use_cache=True):
+    """
+    Parse log files into a LogDataset, reusing cached results for unchanged files
+
+    :param paths: List<String> - Log files
+    :param cache_dir: String (optional) - Cache directory, defaults to .an003_log_cache next to each log
+    :param workers: int (optional) - Parser processes, defaults to the CPU count
+    :param use_cache: Boolean - False to ignore and not write the cache
+    :return: LogDataset obj
+    """
+    dataset = LogDataset()
+    results = [None] * len(paths)
+    pending = []
+    for index, path in enumerate(paths):
+        stat = os.stat(path)
+        cache_file = None
+        if use_cache:
+            cache_file = _cache_path(cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)),
+                                                               CACHE_DIR_NAME), path)
+            cached = _load_cached(cache_file, stat) if os.path.exists(cache_file) else None
+            if cached is not None:
+                results[index] = cached
+                dataset.cached += 1
+                continue
+        pending.append((index, path, cache_file, stat.st_mtime_ns, stat.st_size))
+
+    if len(pending) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(index, executor.submit(_parse_and_cache, path, cache_file, mtime, size))
+                       for index, path, cache_file, mtime, size in pending]
+            for index, future in futures:
+                results[index] = future.result()
+    else:
+        for index, path, cache_file, mtime, size in pending:
+            results[index] = _parse_and_cache(path, cache_file, mtime, size)
+    dataset.parsed = len(pending)
+
+    for path, (arrays, meta) in zip(paths, results):
+        dataset._add(path, arrays, meta)
+    return dataset.finish()
+
+
+def group_percentiles(groups, values, percentiles):
+    """
+    Percentiles of values within each group, without looping over groups
+
+    :param groups: ndarray<int> - Group index of each value (0..n-1)
+    :param values: ndarray<float> - Values, NaN for missing
+    :param percentiles: Tuple<float> - Percentiles wanted (0-100)
+    :return: (ndarray<int>, ndarray<float>) - Count of values per group, and a (groups, percentiles) array with NaN
+             for groups without values
+    """
+    group_count = int(groups.max()) + 1 if len(groups) else 0
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid]
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if group_count else counts
+    result = np.full((group_count, len(percentiles)), np.nan)
+    has_values = counts > 0
+    for column, percentile in enumerate(percentiles):
+        # Nearest-rank on the sorted slice of each group
+        ranks = np.floor(percentile / 100.0 * (counts - 1) + 0.5).astype(np.int64)
+        result[has_values, column] = ordered[(starts + ranks)[has_values]]
+    return counts, result
+
+
+def summarise(dataset, by=None, percentiles=(50, 95, 99)):
+    """
+    Latency distributions and failure rates per plug speed (and group)
+
+    :param dataset: LogDataset obj
+    :param by: String (optional) - Also split by "module", "drive", "run" or "slot"
+    :param percentiles: Tuple<float> - Latency percentiles reported
+    :return: List<Dict> - One entry per (group, speed), sorted
+    """
+    if not len(dataset):
+        return []
+    speeds = dataset.columns["speed"].astype(np.int64)
+    if by:
+        label_ids, names = dataset.group_ids(by)
+    else:
+        label_ids, names = np.zeros(len(speeds), dtype=np.int64), [""]
+    # One integer key per (group, speed) pair
+    base = int(speeds.max()) + 1
+    unique, groups = np.unique(label_ids * base + speeds, return_inverse=True)
+
+    cycles = np.bincount(groups, minlength=len(unique))
+    failure = dataset.columns["failure"]
+    failures = np.bincount(groups, weights=(failure != PASSED), minlength=len(unique))
+    by_type = {name: np.bincount(groups, weights=(failure == code), minlength=len(unique))
+               for code, name in enumerate(FAILURE_NAMES) if code != PASSED}
+    removal_counts, removal = group_percentiles(groups, dataset.columns["removal"], percentiles)
+    enumeration_counts, enumeration = group_percentiles(groups, dataset.columns["enumeration"], percentiles)
+    removal_max = np.full(len(unique), np.nan)
+    enumeration_max = np.full(len(unique), np.nan)
+    for target, column in ((removal_max, "removal"), (enumeration_max, "enumeration")):
+        values = dataset.columns[column]
+        valid = ~np.isnan(values)
+        np.fmax.at(target, groups[valid], values[valid])
+
+    rows = []
+    for index, key in enumerate(unique):
+        label, speed = names[key // base], key % base
+        row = {"speed": int(speed), "cycles": int(cycles[index]), "failures": int(failures[index]),
+               "failure_rate": float(failures[index] / cycles[index]),
+               "failure_types": {name: int(counts[index]) for name, counts in by_type.items() if counts[index]}}
+        if by:
+            row[by] = label
+        for name, counts, values, maximum in (("removal", removal_counts, removal, removal_max),
+                                              ("enumeration", enumeration_counts, enumeration, enumeration_max)):
+            row[name] = {"count": int(counts[index])}
+            for column, percentile in enumerate(percentiles):
+                value = values[index, column]
+                row[name]["p" + str(percentile)] = None if np.isnan(value) else float(value)
+            row[name]["max"] = None if np.isnan(maximum[index]) else float(maximum[index])
+        rows.append(row)
+    rows.sort(key=lambda row: (row.get(by, ""), row["speed"]))
+    return rows
+
+
+def find_logs(patterns):
+    """
+    :param patterns: List<String> - Log files, directories (searched recursively) or glob patterns
+    :return: List<String> - Log files, sorted
+    """
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found.update(glob.glob(os.path.join(pattern, "**", "LogFile*.txt"), recursive=True))
+        else:
+            found.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(found)
+
+
+def _format_ms(value):
+    return "-" if value is None else "{0:.1f}".format(value * 1000)
+
+
+def print_summary(rows, by=None, stream=sys.stdout):
+    header = ([by.capitalize()] if by else []) + ["Delay (mS)", "Cycles", "Fail %", "Removal p50/p95/p99/max (mS)",
+                                                   "Enumeration p50/p95/p99/max (mS)", "Failure types"]
+    table = [header]
+    for row in rows:
+        latencies = ["/".join(_format_ms(row[name][key]) for key in ("p50", "p95", "p99", "max"))
+                     for name in ("removal", "enumeration")]
+        types = ", ".join(name + " " + str(count) for name, count in sorted(row["failure_types"].items()))
+        table.append(([row[by]] if by else []) + [str(row["speed"]), str(row["cycles"]),
+                                                 "{0:.1f}".format(row["failure_rate"] * 100)] + latencies + [types])
+    widths = [max(len(line[column]) for line in table) for column in range(len(header))]
+    for line in table:
+        stream.write("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency and failure statistics over AN-003 hotplug log files")
+    parser.add_argument("logs", nargs="+", help="Log files, directories or glob patterns")
+    parser.add_argument("--by", choices=("module", "drive", "run", "slot"), help="Also split results by this")
+    parser.add_argument("--json", metavar="FILE", help="Write the summary as JSON to this file")
+    parser.add_argument("--cache-dir", help="Where parsed files are cached (default: next to each log)")
+    parser.add_argument("--no-cache", action="store_true", help="Parse every file again and don't write the cache")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    if np is None:
+        sys.stderr.write("log_analytics needs NumPy (pip install numpy)\n")
+        return 1
+    paths = find_logs(args.logs)
+    if not paths:
+        sys.stderr.write("No log files found\n")
+        return 1
+    dataset = load_logs(paths, args.cache_dir, args.workers, not args.no_cache)
+    sys.stderr.write("{0} files ({1} parsed, {2} cached), {3} cycles\n".format(len(paths), dataset.parsed,
+                                                                               dataset.cached, len(dataset)))
+    rows = summarise(dataset, args.by)
+    print_summary(rows, args.by)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(rows, json_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
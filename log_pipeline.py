@@ -0,0 +1,192 @@
+'''
+Buffered, non-blocking logging pipeline for the AN-003 hotplug test.
+
+logWrite() used to open, append and close the log file (and print) for every line, all inside the timing critical
+part of each cycle.  Lines are now put on a bounded queue and a background writer thread owns the single open file
+handle and the console, writing in batches and flushing at a fixed interval.  Python logging records are routed
+into the same file through LogPipeline.handler(), and the pipeline is flushed at exit and on unhandled exceptions.
+'''
+
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+# Marker put on the queue to request a flush; carries the Event to set once the data is on disk.
+_FLUSH = object()
+# Returned by the batch reader when the queue has nothing more to give.
+_EMPTY = object()
+
+
+class LogPipeline:
+    """
+    Background writer for the log file and console.
+    """
+
+    def __init__(self, path, queue_size=10000, flush_interval=0.5, batch_size=512, console=None):
+        """
+        :param path: String - Log file to append to
+        :param queue_size: int - Max lines buffered before writers have to wait
+        :param flush_interval: float - Max seconds written data may sit in the file buffer
+        :param batch_size: int - Max lines written per batch
+        :param console: Stream (optional) - Where echoed lines go, defaults to sys.stdout at write time
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.console = console
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        """
+        Start the writer thread and hook interpreter exit and crashes so buffered lines are never lost.
+        """
+        with self._lock:
+            if self._thread is not None or self._closed:
+                return self
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+        _install_crash_flush(self)
+        return self
+
+    def write(self, line, echo=True):
+        """
+        Queue a line for the log file (and optionally the console).  Only waits if the queue is full.
+
+        :param line: String - Line to write, without trailing newline
+        :param echo: Boolean - Also print the line to the console
+        """
+        if self._thread is None:
+            self.start()
+        if self._closed:
+            # Late writes after shutdown go straight out rather than being lost
+            self._write_batch([(line, echo)])
+            self._flush_file()
+            return
+        self._queue.put((line, echo))
+
+    def flush(self, timeout=5.0):
+        """
+        Block until everything queued so far is written and flushed to disk.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        done.wait(timeout)
+
+    def close(self):
+        """
+        Flush and stop the writer thread.  Safe to call more than once.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+        self._flush_file(sync=True)
+
+    def handler(self, fmt=None, datefmt=None):
+        """
+        :return: logging.Handler obj - Routes Python logging records into this pipeline (file only)
+        """
+        handler = PipelineHandler(self)
+        handler.setFormatter(logging.Formatter(fmt, datefmt))
+        return handler
+
+    def _run(self):
+        last_flush = time.time()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = _EMPTY
+            batch = []
+            stop = False
+            flush_events = []
+            while item is not _EMPTY:
+                if item is None:
+                    stop = True
+                elif item[0] is _FLUSH:
+                    flush_events.append(item[1])
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = _EMPTY
+            if batch:
+                self._write_batch(batch)
+            if flush_events or stop or time.time() - last_flush >= self.flush_interval:
+                self._flush_file()
+                last_flush = time.time()
+            for event in flush_events:
+                event.set()
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write("".join(line + "\n" for line, _ in batch))
+        echoed = [line for line, echo in batch if echo]
+        if echoed:
+            console = self.console or sys.stdout
+            console.write("".join(line + "\n" for line in echoed))
+            console.flush()
+
+    def _flush_file(self, sync=False):
+        if self._file is not None:
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+
+class PipelineHandler(logging.Handler):
+    """
+    logging.Handler which writes formatted records through a LogPipeline.
+    """
+
+    def __init__(self, pipeline):
+        logging.Handler.__init__(self)
+        self.pipeline = pipeline
+
+    def emit(self, record):
+        try:
+            self.pipeline.write(self.format(record), echo=False)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.pipeline.flush()
+
+
+def _install_crash_flush(pipeline):
+    """
+    Chain sys.excepthook and threading.excepthook so an unhandled exception flushes the pipeline first.
+    """
+    previous_hook = sys.excepthook
+    previous_thread_hook = threading.excepthook
+
+    def excepthook(exc_type, exc_value, exc_traceback):
+        pipeline.close()
+        previous_hook(exc_type, exc_value, exc_traceback)
+
+    def thread_excepthook(args):
+        pipeline.flush()
+        previous_thread_hook(args)
+
+    sys.excepthook = excepthook
+    threading.excepthook = thread_excepthook
@@ -0,0 +1,167 @@
+'''
+Live Prometheus metrics for the AN-003 hotplug test.
+
+Serves the progress of a running test in the Prometheus text format from a background HTTP thread:
+
+    an003_cycles_total               - Cycles completed, per slot and plug speed
+    an003_failures_total             - Failed cycles, per slot, plug speed and failure type
+    an003_removal_seconds            - Histogram of removal latency, per slot and plug speed
+    an003_enumeration_seconds        - Histogram of enumeration latency, per slot and plug speed
+    an003_last_cycle_timestamp_seconds
+
+The cycle loop only takes a short lock to update counters; a scrape copies them under the same lock and formats
+and sends the response on the server thread, so a slow or stuck client never holds up a cycle.
+
+    curl http://localhost:9464/metrics
+'''
+
+import threading
+import time
+
+from results_store import PASS
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency histogram bucket upper bounds (Seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(LATENCY_BUCKETS)
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def copy(self):
+        other = _Histogram()
+        other.counts, other.total, other.count = list(self.counts), self.total, self.count
+        return other
+
+
+def _labels(**labels):
+    return "{" + ",".join(name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                          for name, value in labels.items()) + "}"
+
+
+class MetricsExporter:
+    """
+    Cycle counters and latency histograms, served over HTTP for Prometheus to scrape.
+    """
+
+    def __init__(self, port=9464, address="127.0.0.1"):
+        """
+        :param port: int - Port to listen on, 0 picks a free one
+        :param address: String - Address to listen on, local only by default
+        """
+        self.address = address
+        self.port = port
+        self._lock = threading.Lock()
+        self._cycles = {}
+        self._failures = {}
+        self._removal = {}
+        self._enumeration = {}
+        self._last_cycle = None
+        self._started = time.time()
+        self._server = None
+
+    def start(self):
+        # Imported here so runs without metrics don't pay for loading the HTTP server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="metrics-exporter", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def observe(self, record):
+        """
+        Count a completed cycle
+
+        :param record: CycleRecord obj - Result of the cycle
+        """
+        key = (record.slot, record.speed)
+        with self._lock:
+            self._cycles[key] = self._cycles.get(key, 0) + 1
+            if record.verdict != PASS:
+                failure = key + (record.verdict.replace(" ", "_"),)
+                self._failures[failure] = self._failures.get(failure, 0) + 1
+            if record.removal_time is not None:
+                self._removal.setdefault(key, _Histogram()).add(record.removal_time)
+            if record.enumeration_time is not None:
+                self._enumeration.setdefault(key, _Histogram()).add(record.enumeration_time)
+            self._last_cycle = record.timestamp
+
+    def render(self):
+        """
+        :return: String - All metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            cycles = dict(self._cycles)
+            failures = dict(self._failures)
+            removal = {key: value.copy() for key, value in self._removal.items()}
+            enumeration = {key: value.copy() for key, value in self._enumeration.items()}
+            last_cycle = self._last_cycle
+
+        lines = ["# HELP an003_cycles_total Hotplug cycles completed.",
+                 "# TYPE an003_cycles_total counter"]
+        for (slot, speed), count in sorted(cycles.items()):
+            lines.append("an003_cycles_total" + _labels(slot=slot, speed=speed) + " " + str(count))
+        lines += ["# HELP an003_failures_total Hotplug cycles failed, by failure type.",
+                  "# TYPE an003_failures_total counter"]
+        for (slot, speed, kind), count in sorted(failures.items()):
+            lines.append("an003_failures_total" + _labels(slot=slot, speed=speed, type=kind) + " " + str(count))
+        for name, title, histograms in (("an003_removal_seconds", "Time for the drive to disappear after power down.",
+                                         removal),
+                                        ("an003_enumeration_seconds", "Time for the drive to enumerate after power up.",
+                                         enumeration)):
+            lines += ["# HELP " + name + " " + title, "# TYPE " + name + " histogram"]
+            for (slot, speed), histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(name + "_bucket" + _labels(slot=slot, speed=speed, le=bound) + " " + str(cumulative))
+                lines.append(name + "_sum" + _labels(slot=slot, speed=speed) + " " + repr(histogram.total))
+                lines.append(name + "_count" + _labels(slot=slot, speed=speed) + " " + str(histogram.count))
+        lines += ["# HELP an003_run_start_timestamp_seconds When the run started.",
+                  "# TYPE an003_run_start_timestamp_seconds gauge",
+                  "an003_run_start_timestamp_seconds " + repr(self._started)]
+        if last_cycle is not None:
+            lines += ["# HELP an003_last_cycle_timestamp_seconds When the last cycle started.",
+                      "# TYPE an003_last_cycle_timestamp_seconds gauge",
+                      "an003_last_cycle_timestamp_seconds " + repr(last_cycle)]
+        return "\n".join(lines) + "\n"
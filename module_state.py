@@ -0,0 +1,149 @@
+'''
+Module state cache for the AN-003 hotplug test.
+
+Keeps track of the timing configuration last applied to a Quarch module, so that re-applying the same hotplug
+timing costs nothing and a change only sends the settings that differ.  Also replaces the fixed sleeps after
+configuration and reset with polling the module until it answers again.
+'''
+
+import time
+
+# Source count on most Quarch hotplug modules (QTL1743 etc.)
+SOURCE_COUNT = 6
+
+# Longest source delay (mS) accepted by legacy modules and by current ones (see check_legacy_timings)
+LEGACY_DELAY_LIMIT = 1270
+DELAY_LIMIT = 16777
+
+
+def delay_limit(is_legacy):
+    """
+    :param is_legacy: Boolean - True if the module has legacy timings
+    :return: int - Longest delay (mS) the module accepts on a source
+    """
+    return LEGACY_DELAY_LIMIT if is_legacy else DELAY_LIMIT
+
+
+class ModuleState:
+    """
+    Cached view of a module's timed source configuration.
+    """
+
+    def __init__(self, device, source_count=SOURCE_COUNT, batch_separator=None):
+        """
+        :param device: QuarchDevice obj - Module wrapper
+        :param source_count: int - Number of timed sources on the module
+        :param batch_separator: String (optional) - Set only if the module firmware accepts several commands in one
+                                message separated by this string; otherwise one command is sent per round trip
+        """
+        self.device = device
+        self.source_count = source_count
+        self.batch_separator = batch_separator
+        # setting (e.g. "source:2:delay") -> value last confirmed by the module; missing means unknown
+        self.settings = {}
+
+    def forget(self, source=None):
+        """
+        Mark cached state as unknown, e.g. after a reset or a command sent outside this cache
+
+        :param source: int (optional) - Single source whose delay to forget, everything if not given
+        """
+        if source is None:
+            self.settings.clear()
+        else:
+            self.settings.pop("source:" + str(source) + ":delay", None)
+
+    def send_commands(self, commands):
+        """
+        Send a list of commands, batched into a single message where the module supports it
+
+        :param commands: List<String> - Commands to send
+        :return: List<String> - Response for each command
+        """
+        if self.batch_separator and len(commands) > 1:
+            responses = self.device.sendCommand(self.batch_separator.join(commands)).splitlines()
+            if len(responses) == len(commands):
+                return responses
+            # Unexpected reply shape, fall back to one at a time (source delay commands are idempotent)
+        return [self.device.sendCommand(command) for command in commands]
+
+    def pending(self, settings):
+        """
+        :param settings: Iterable<(String, value)> - Settings in the order they must be sent
+        :return: List<(String, value)> - Those that differ from the cached state
+        """
+        return [(setting, value) for setting, value in settings if self.settings.get(setting) != value]
+
+    def apply(self, settings):
+        """
+        Apply module settings, sending only those that differ from the cached state
+
+        :param settings: Iterable<(String, value)> - (setting, value) pairs in the order they must be sent, e.g.
+                         HotplugSequence.transition()
+        :return: List<(String, String)> - (command, response) for every command that failed, empty on success
+        """
+        changes = self.pending(settings)
+        if not changes:
+            return []
+        commands = [setting + " " + str(value) for setting, value in changes]
+        failures = []
+        for (setting, value), command, response in zip(changes, commands, self.send_commands(commands)):
+            if "OK" in response:
+                self.settings[setting] = value
+            else:
+                self.settings.pop(setting, None)
+                failures.append((command, response))
+        return failures
+
+    def set_source_delays(self, delays):
+        """
+        Apply source delays, sending only those that differ from the cached state
+
+        :param delays: Dict<int, int> - Source number -> delay in mS
+        :return: List<(String, String)> - (command, response) for every command that failed, empty on success
+        """
+        return self.apply(("source:" + str(source) + ":delay", delay) for source, delay in sorted(delays.items()))
+
+    def reapply(self):
+        """
+        Send every cached setting again, e.g. after reconnecting to the module.  Only settings this run has sent
+        since the last reset are cached, so nothing the module may not support is sent.
+
+        :return: List<(String, String)> - (command, response) for every command that failed, empty on success
+        """
+        settings = list(self.settings.items())
+        self.settings.clear()
+        return self.apply(settings)
+
+    def wait_ready(self, timeout=5.0, interval=0.05):
+        """
+        Poll the module until it responds to "hello?" again
+
+        :param timeout: float - Max time (Seconds) to wait
+        :param interval: float - Time (Seconds) between polls
+        :return: Boolean - True if the module answered within the timeout
+        """
+        # Polled without the supervisor's retries (see run_supervisor.py), so the timeout holds
+        send = getattr(self.device, "send_once", self.device.sendCommand)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                response = send("hello?")
+            except Exception:
+                response = ""
+            if response and "FAIL" not in response:
+                return True
+            if time.time() > deadline:
+                return False
+            time.sleep(interval)
+
+    def reset_default(self, timeout=5.0):
+        """
+        Return the module to its default state and wait until it is ready again.
+
+        :param timeout: float - Max time (Seconds) to wait for the module after the reset
+        :return: Boolean - True if the module answered within the timeout
+        """
+        self.device.sendCommand("conf:def:state")
+        self.forget()
+        return self.wait_ready(timeout)
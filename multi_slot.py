@@ -0,0 +1,156 @@
+'''
+Concurrent multi-slot hotplug engine.
+
+Runs the hotplug cycle loop for many (module, drive) pairs at once, one worker thread per slot.  Each slot keeps
+its own cycle state and failure list, while presence detection is shared through the script's PresenceWatcher.
+A PullCoordinator controls how the pulls of different slots relate to each other in time:
+
+    independent - Slots run freely, pulls land wherever they happen to
+    staggered   - Pulls are spaced at least <stagger> seconds apart across all slots
+    overlap     - Every active slot pulls at the same moment (simultaneous surprise removal)
+'''
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PULL_MODES = ("independent", "staggered", "overlap")
+
+
+class SlotAborted(Exception):
+    """
+    Ends the test on one slot.  The shared watcher, log and results carry on for the other slots.
+    """
+
+
+class HotplugSlot:
+    """
+    Cycle state for one (module, drive) pair
+    """
+
+    def __init__(self, name, module_str, drive_id):
+        """
+        :param name: String - Label used in logs and the results table
+        :param module_str: String - Quarch module connection string
+        :param drive_id: String - Drive identifier as shown in the drive selection list
+        """
+        self.name = name
+        self.module_str = module_str
+        self.drive_id = drive_id
+        self.device = None
+        self.drive = None
+        self.is_legacy = False
+        self.summary = []
+        self.state = "idle"
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+    def __repr__(self):
+        return "HotplugSlot({0}, {1}, {2})".format(self.name, self.module_str, self.state)
+
+
+class PullCoordinator:
+    """
+    Synchronises the "RUN:POWer DOWN" of concurrently running slots according to the pull mode.
+    """
+
+    def __init__(self, mode="independent", stagger=0.0, overlap_timeout=60.0):
+        """
+        :param mode: String - One of PULL_MODES
+        :param stagger: float - Minimum seconds between pulls in staggered mode
+        :param overlap_timeout: float - Max seconds a slot waits for the others in overlap mode
+        """
+        if mode not in PULL_MODES:
+            raise ValueError("Pull mode must be one of " + ", ".join(PULL_MODES))
+        self.mode = mode
+        self.stagger = stagger
+        self.overlap_timeout = overlap_timeout
+        self._cond = threading.Condition()
+        self._next_pull = 0.0
+        self._active = 0
+        self._waiting = 0
+        self._generation = 0
+
+    def join(self):
+        with self._cond:
+            self._active += 1
+
+    def leave(self):
+        """
+        Called when a slot finishes, so the remaining slots no longer wait for it.
+        """
+        with self._cond:
+            self._active -= 1
+            if self._waiting and self._waiting >= self._active:
+                self._release()
+
+    def _release(self):
+        self._waiting = 0
+        self._generation += 1
+        self._cond.notify_all()
+
+    def before_pull(self):
+        """
+        Block the calling slot until it is allowed to pull its drive.
+        """
+        if self.mode == "staggered":
+            with self._cond:
+                now = time.time()
+                wait = self._next_pull - now
+                self._next_pull = max(now, self._next_pull) + self.stagger
+            if wait > 0:
+                time.sleep(wait)
+        elif self.mode == "overlap":
+            with self._cond:
+                generation = self._generation
+                self._waiting += 1
+                if self._waiting >= self._active:
+                    self._release()
+                elif not self._cond.wait_for(lambda: self._generation != generation, self.overlap_timeout):
+                    # Give up waiting on a stuck slot rather than hanging the whole rig
+                    self._release()
+
+
+class SlotScheduler:
+    """
+    Runs a hotplug routine for every slot on a thread pool.
+    """
+
+    def __init__(self, slots, run_slot, coordinator=None, max_workers=None):
+        """
+        :param slots: List<HotplugSlot> - Slots to run
+        :param run_slot: callable(HotplugSlot, PullCoordinator) - Runs the full test for a single slot
+        :param coordinator: PullCoordinator obj (optional) - Defaults to independent pulls
+        :param max_workers: int (optional) - Thread pool size, defaults to one thread per slot
+        """
+        self.slots = slots
+        self.run_slot = run_slot
+        self.coordinator = coordinator or PullCoordinator()
+        self.max_workers = max_workers or max(1, len(slots))
+
+    def _run(self, slot):
+        slot.state = "running"
+        slot.start_time = time.time()
+        try:
+            self.run_slot(slot, self.coordinator)
+            slot.state = "failed" if slot.summary else "passed"
+        except Exception as err:
+            # SlotAborted from exitScript(), or any other error, ends this slot only, the others keep going
+            slot.state = "error"
+            slot.error = err
+        finally:
+            slot.end_time = time.time()
+            self.coordinator.leave()
+        return slot
+
+    def run(self):
+        """
+        Run all slots to completion
+
+        :return: List<HotplugSlot> - The slots, with their results filled in
+        """
+        for _ in self.slots:
+            self.coordinator.join()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="slot") as pool:
+            return list(pool.map(self._run, self.slots))
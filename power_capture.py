@@ -0,0 +1,422 @@
+'''
+Streaming power / inrush capture for the AN-003 hotplug test.
+
+Samples from a power source (a Quarch power module streaming to file, or a synthetic source for testing) are
+written continuously into a fixed-size ring buffer memory-mapped onto a temporary file, so a multi-hour run uses
+the same RAM and disk as a one minute run.  The "RUN:POWer DOWN" and "RUN:POWer UP" times of each cycle cut the
+stream into windows, and each window is reduced with NumPy to a few numbers:
+
+    peak_current  - Highest total current (A) in the window, and when it happened relative to the command
+    energy        - Energy (J) drawn over the window after the command
+    settling_time - Seconds after the command until the current stayed within a band around its final value
+
+Only these summaries are kept with the cycle results.  Raw windows can optionally be saved as compressed .npz
+files, for every cycle or failed cycles only, up to a disk budget.
+
+NumPy is an optional dependency, only needed when power capture is switched on.
+'''
+
+import importlib.util
+import os
+import re
+import tempfile
+import threading
+import time
+
+# NumPy, imported on first use by _load_numpy() as it takes longer to import than the rest of the script
+np = None
+
+# Settling band: fraction of the final current, with a floor (A) so a drive settling to ~0A can settle too
+SETTLE_FRACTION = 0.02
+SETTLE_FLOOR = 0.005
+# Current is averaged over this many seconds before the settling check, so noise alone doesn't leave the band
+SETTLE_AVERAGE = 0.001
+
+
+def numpy_available():
+    return np is not None or importlib.util.find_spec("numpy") is not None
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        if not numpy_available():
+            raise RuntimeError("Power capture needs NumPy (pip install numpy)")
+        import numpy
+        np = numpy
+    return np
+
+
+class SampleRing:
+    """
+    Fixed capacity ring of float32 sample rows, memory-mapped onto a temporary file.
+    Rows are addressed by their absolute sample index, which keeps counting up as the ring wraps.
+    """
+
+    def __init__(self, capacity, columns, directory=None):
+        """
+        :param capacity: int - Rows held before the oldest are overwritten
+        :param columns: int - Values per row
+        :param directory: String (optional) - Where the backing file goes, defaults to the system temp directory
+        """
+        _load_numpy()
+        self.capacity = int(capacity)
+        self.columns = columns
+        self._file = tempfile.TemporaryFile(prefix="an003_power_", dir=directory)
+        self._data = np.memmap(self._file, dtype=np.float32, mode="w+", shape=(self.capacity, columns))
+        self._lock = threading.Lock()
+        self.written = 0
+
+    def write(self, block):
+        """
+        :param block: ndarray (rows, columns) - Samples to append
+        """
+        block = np.asarray(block, dtype=np.float32)
+        if len(block) > self.capacity:
+            block = block[-self.capacity:]
+        with self._lock:
+            start = self.written % self.capacity
+            first = min(len(block), self.capacity - start)
+            self._data[start:start + first] = block[:first]
+            self._data[:len(block) - first] = block[first:]
+            self.written += len(block)
+
+    def read(self, start, end):
+        """
+        Copy out rows [start, end) by absolute index
+
+        :return: ndarray or None if any of the rows have been overwritten or not written yet
+        """
+        with self._lock:
+            if start < max(0, self.written - self.capacity) or end > self.written or end <= start:
+                return None
+            indexes = np.arange(start, end) % self.capacity
+            return np.array(self._data[indexes])
+
+    def close(self):
+        del self._data
+        self._file.close()
+
+
+class SyntheticPowerSource:
+    """
+    Generates a drive-like 12V rail: a steady load when powered, an inrush spike decaying into it at power up and
+    an exponential discharge at power down.  Samples are produced in real time.
+    """
+    channels = ("12V",)
+
+    def __init__(self, is_powered, sample_rate=50000, voltage=12.0, load_current=0.8, inrush_peak=3.0,
+                 inrush_tau=0.002, discharge_tau=0.01, noise=0.005, block_time=0.002, seed=None):
+        """
+        :param is_powered: callable() -> Boolean - Whether the drive is powered right now, e.g. a simulated module
+        :param sample_rate: int - Samples per second
+        :param voltage: float - Rail voltage (V)
+        :param load_current: float - Steady state current (A) when powered
+        :param inrush_peak: float - Extra current (A) at the start of power up
+        :param inrush_tau: float - Time constant (Seconds) of the inrush decay
+        :param discharge_tau: float - Time constant (Seconds) of the power down discharge
+        :param noise: float - Standard deviation (A) of the current noise
+        :param block_time: float - Seconds of samples produced per read
+        :param seed: int (optional) - Noise seed
+        """
+        _load_numpy()
+        self.is_powered = is_powered
+        self.sample_rate = sample_rate
+        self.voltage = voltage
+        self.load_current = load_current
+        self.inrush_peak = inrush_peak
+        self.inrush_tau = inrush_tau
+        self.discharge_tau = discharge_tau
+        self.noise = noise
+        self.block = max(1, int(sample_rate * block_time))
+        self._random = np.random.default_rng(seed)
+        self._powered = None
+        self._since = 0
+        self._level = 0.0
+        self._index = 0
+        self._start = None
+
+    def read(self):
+        """
+        :return: ndarray (rows, 2) - [voltage, current] rows, blocking until they are "measured"
+        """
+        if self._start is None:
+            self._start = time.time()
+        due = self._start + (self._index + self.block) / self.sample_rate
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        if self._powered is None:
+            # Start in a steady state, no inrush or discharge
+            powered = bool(self.is_powered())
+            self._powered, self._since = powered, -10 * self.sample_rate
+            self._level = self.load_current if powered else 0.0
+        powered = self._powered
+        t = (np.arange(self._index, self._index + self.block) - self._since) / self.sample_rate
+        if powered:
+            current = self.load_current + self.inrush_peak * np.exp(-t / self.inrush_tau)
+            voltage = self.voltage * (1 - np.exp(-t / (self.inrush_tau / 4)))
+        else:
+            current = self._level * np.exp(-t / self.discharge_tau)
+            voltage = self.voltage * np.exp(-t / self.discharge_tau) if self._level else np.zeros_like(t)
+        current = current + self._random.normal(0, self.noise, self.block)
+        self._index += self.block
+
+        # A change seen now happened during the block just generated, so it shows from the next block on
+        if bool(self.is_powered()) != self._powered:
+            self._level = self._current_at(self._index)
+            self._powered, self._since = not self._powered, self._index
+        return np.column_stack((voltage, current))
+
+    def _current_at(self, index):
+        t = (index - self._since) / self.sample_rate
+        if self._powered:
+            return self.load_current + self.inrush_peak * np.exp(-t / self.inrush_tau)
+        return self._level * np.exp(-t / self.discharge_tau)
+
+    def close(self):
+        pass
+
+
+class StreamFileSource:
+    """
+    Follows the CSV file a Quarch power module streams to (quarchPPM.startStream), returning the voltage and
+    current columns of each rail.  Values are converted from the stream's mV / uA to V / A.
+    """
+
+    def __init__(self, path, sample_rate, channels=("12V",), poll_interval=0.005):
+        """
+        :param path: String - Stream file being written
+        :param sample_rate: int - Samples per second the stream was started with
+        :param channels: Tuple<String> - Rails to capture, matching the "<rail> Voltage" / "<rail> Current" headers
+        :param poll_interval: float - Seconds to wait when there is no new data
+        """
+        _load_numpy()
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = tuple(channels)
+        self.poll_interval = poll_interval
+        self._file = None
+        self._columns = None
+        self._partial = ""
+
+    def _open(self):
+        while not os.path.exists(self.path):
+            time.sleep(self.poll_interval)
+        self._file = open(self.path, "r")
+
+    def _find_columns(self, header):
+        names = [name.strip().lower() for name in header.split(",")]
+        columns = []
+        for rail in self.channels:
+            for kind in ("voltage", "current"):
+                matches = [i for i, name in enumerate(names) if re.match(re.escape(rail.lower()) + r"\s+" + kind, name)]
+                if not matches:
+                    raise ValueError("Stream file " + self.path + " has no " + rail + " " + kind + " column")
+                columns.append(matches[0])
+        self._columns = columns
+
+    def read(self):
+        """
+        :return: ndarray (rows, 2 * rails) - [voltage, current] per rail for the rows written since the last read
+        """
+        if self._file is None:
+            self._open()
+        while True:
+            text = self._partial + self._file.read()
+            lines = text.split("\n")
+            self._partial = lines.pop()
+            rows = []
+            for line in lines:
+                if self._columns is None:
+                    if "voltage" in line.lower() and "current" in line.lower():
+                        self._find_columns(line)
+                    continue
+                fields = line.split(",")
+                try:
+                    rows.append([float(fields[i]) for i in self._columns])
+                except (ValueError, IndexError):
+                    continue
+            if rows:
+                data = np.array(rows, dtype=np.float64)
+                data[:, 0::2] /= 1e3
+                data[:, 1::2] /= 1e6
+                return data
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def summarise_window(data, sample_rate, command_index, settle_fraction=SETTLE_FRACTION, settle_floor=SETTLE_FLOOR,
+                     settle_average=SETTLE_AVERAGE):
+    """
+    Reduce a window of samples around a power command to its peak current, energy and settling time
+
+    :param data: ndarray (rows, 2 * rails) - [voltage, current] per rail
+    :param sample_rate: int - Samples per second
+    :param command_index: int - Row at which the command was sent
+    :param settle_average: float - Seconds of current averaged for the settling check
+    :return: Dict - peak_current (A), peak_time, energy (J), settling_time and final_current (A); times are seconds
+             after the command.  settling_time is None if the current had not settled by the end of the window.
+    """
+    _load_numpy()
+    voltage = data[:, 0::2]
+    current = data[:, 1::2]
+    total_current = current.sum(axis=1)
+    after = total_current[command_index:]
+    if not len(after):
+        return None
+    power = (voltage[command_index:] * current[command_index:]).sum(axis=1)
+
+    peak = int(np.argmax(after))
+    # Final level from the last 10% of the window, then the last averaged sample outside the band around it
+    tail = max(1, len(after) // 10)
+    final = float(np.median(after[-tail:]))
+    band = max(abs(final) * settle_fraction, settle_floor)
+    width = min(len(after), max(1, int(settle_average * sample_rate)))
+    smoothed = np.convolve(after, np.full(width, 1.0 / width), mode="valid")
+    outside = np.flatnonzero(np.abs(smoothed - final) > band)
+    if not len(outside):
+        settling = 0.0
+    elif outside[-1] >= len(smoothed) - tail:
+        settling = None
+    else:
+        settling = (outside[-1] + width) / sample_rate
+    return {"peak_current": round(float(after[peak]), 6),
+            "peak_time": round(peak / sample_rate, 6),
+            "energy": round(float(power.sum()) / sample_rate, 6),
+            "settling_time": None if settling is None else round(float(settling), 6),
+            "final_current": round(final, 6)}
+
+
+class PowerCapture:
+    """
+    Streams a power source into a SampleRing on a background thread and summarises the window after each power
+    command.
+    """
+
+    def __init__(self, source, ring_seconds=60.0, pre_time=0.01, window_time=0.5, raw_directory=None,
+                 raw_mode=None, raw_limit_mb=500):
+        """
+        :param source: Power source with read(), sample_rate and channels (SyntheticPowerSource, StreamFileSource)
+        :param ring_seconds: float - Seconds of samples kept in the ring, must cover the longest cycle
+        :param pre_time: float - Seconds kept before each command in a window
+        :param window_time: float - Max seconds after each command in a window
+        :param raw_directory: String (optional) - Where raw windows are saved
+        :param raw_mode: String (optional) - None, "failures" or "all": which cycles have their raw windows saved
+        :param raw_limit_mb: float - Raw windows stop being saved once this many MB have been written
+        """
+        _load_numpy()
+        self.source = source
+        self.sample_rate = source.sample_rate
+        self.pre_time = pre_time
+        self.window_time = window_time
+        self.raw_directory = raw_directory
+        self.raw_mode = raw_mode
+        self.raw_limit = raw_limit_mb * 1024 * 1024
+        self.raw_written = 0
+        self.ring = SampleRing(ring_seconds * self.sample_rate, 2 * len(source.channels))
+        self._start_time = None
+        self._thread = None
+        self._running = False
+        self._marks = []
+        # Power state as of the last command, for sources that model the drive (SyntheticPowerSource)
+        self.powered = True
+        self.error = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="power-capture", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while self._running:
+                block = self.source.read()
+                if self._start_time is None:
+                    # Time of the first sample, so that sample index and time.time() can be converted either way
+                    self._start_time = time.time() - len(block) / self.sample_rate
+                self.ring.write(block)
+        except Exception as err:
+            self.error = err
+            self._running = False
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+        self.source.close()
+        self.ring.close()
+
+    def index_at(self, when):
+        """
+        :return: int - Sample index at a time.time() time
+        """
+        return int(round((when - self._start_time) * self.sample_rate)) if self._start_time is not None else 0
+
+    def mark(self, command, when):
+        """
+        Note a power command, starting a new window.  Call with the time the command was sent.
+
+        :param command: String - "down" or "up"
+        :param when: float - time.time() of the command
+        """
+        self._marks.append((command, when))
+        self.powered = command == "up"
+
+    def window(self, start_time, command_time, end_time, timeout=2.0):
+        """
+        Samples between two times, waiting for them to arrive if necessary
+
+        :return: (ndarray, int) - Samples and the row of the command, (None, None) if no longer (or not) in the ring
+        """
+        start, command, end = self.index_at(start_time), self.index_at(command_time), self.index_at(end_time)
+        deadline = time.time() + timeout
+        while self.ring.written < end and self._running and time.time() < deadline:
+            time.sleep(0.005)
+        data = self.ring.read(max(0, start), end)
+        return (None, None) if data is None else (data, command - max(0, start))
+
+    def cycle_summaries(self, record=None):
+        """
+        Summarise the windows of all commands marked since the last call
+
+        :param record: CycleRecord obj (optional) - Used to name raw window files, and to decide whether to keep them
+        :return: Dict - Summary per command ("down" / "up"), None for windows not captured
+        """
+        marks, self._marks = self._marks, []
+        summaries = {}
+        for position, (command, when) in enumerate(marks):
+            end = when + self.window_time
+            if position + 1 < len(marks):
+                end = min(end, marks[position + 1][1])
+            data, command_row = self.window(when - self.pre_time, when, end)
+            if data is None:
+                summaries[command] = None
+                continue
+            summaries[command] = summarise_window(data, self.sample_rate, command_row)
+            if record is not None:
+                self._save_raw(record, command, data, command_row)
+        return summaries
+
+    def _save_raw(self, record, command, data, command_row):
+        if not self.raw_directory or self.raw_mode not in ("all", "failures"):
+            return
+        if self.raw_mode == "failures" and record.passed:
+            return
+        if self.raw_written >= self.raw_limit:
+            return
+        os.makedirs(self.raw_directory, exist_ok=True)
+        # The cycle start time keeps names unique where the speed and iteration repeat, e.g. random sequences
+        started = time.strftime("%Y-%m-%d_%H_%M_%S", time.localtime(record.timestamp)) + \
+            ".{0:03d}".format(int(record.timestamp * 1000) % 1000)
+        name = "_".join(str(part) for part in (record.slot, record.speed, record.iteration, started, command)
+                        if part != "")
+        path = os.path.join(self.raw_directory, name.replace(" ", "_") + ".npz")
+        np.savez_compressed(path, samples=data, sample_rate=self.sample_rate, command_row=command_row,
+                            channels=np.array(self.source.channels))
+        self.raw_written += os.path.getsize(path)
@@ -0,0 +1,297 @@
+'''
+Presence watcher for the AN-003 hotplug test.
+
+Rather than spinning on HostInformation.is_wrapped_device_present(), the hotplug loops block on this watcher.
+Kernel hotplug events (netlink uevents on Linux) wake the waiting thread, which then confirms the drive state
+with a single presence check. Where netlink is unavailable a lightweight sysfs directory watch is used instead,
+and on hosts with neither (e.g. Windows) the presence check is re-run back to back, as the polling loops did.
+Only events naming the drive being waited on (its PCI address, block device or identifier) are credited with the
+detection, so other drives and devices on the host don't skew its removal / enumeration time.
+'''
+
+import os
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+
+from drive_inventory import drive_keys, event_keys
+
+# Netlink protocol number for kernel uevents (not exported by the socket module)
+NETLINK_KOBJECT_UEVENT = 15
+
+# Subsystems whose events can indicate a drive arriving or leaving
+WATCHED_SUBSYSTEMS = ("pci", "nvme", "nvme-subsystem", "block", "scsi", "scsi_disk", "scsi_device")
+
+# Directories diffed by the sysfs fallback watcher
+SYSFS_WATCH_DIRS = {"pci": "/sys/bus/pci/devices",
+                    "block": "/sys/class/block",
+                    "nvme": "/sys/class/nvme",
+                    "scsi_disk": "/sys/class/scsi_disk"}
+
+REMOVE_ACTIONS = ("remove", "unbind")
+ADD_ACTIONS = ("add", "bind", "online")
+
+# A single kernel event as seen by the watcher.  timestamp is time.time() at receipt.
+PresenceEvent = namedtuple("PresenceEvent", ["action", "subsystem", "devpath", "devname", "timestamp"])
+
+
+class NetlinkUeventSource:
+    """
+    Reads kernel uevents from a NETLINK_KOBJECT_UEVENT socket.
+    """
+    name = "netlink"
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        # Group 1 is the kernel broadcast group (udev re-broadcasts on group 2)
+        self._sock.bind((0, 1))
+        self._sock.settimeout(0.5)
+
+    def read_events(self):
+        """
+        Block (up to the socket timeout) for the next uevent.
+
+        :return: List<PresenceEvent> - Events received, empty on timeout.
+        """
+        try:
+            data = self._sock.recv(16384)
+        except socket.timeout:
+            return []
+        timestamp = time.time()
+        event = parse_uevent(data, timestamp)
+        return [event] if event else []
+
+    def close(self):
+        self._sock.close()
+
+
+class SysfsWatchSource:
+    """
+    Fallback source which diffs the contents of a few sysfs directories at a short interval.
+    A directory listing is far cheaper than a full drive probe, so the interval can be kept small.
+    """
+    name = "sysfs"
+
+    def __init__(self, interval=0.01, watch_dirs=None):
+        self._interval = interval
+        self._watch_dirs = watch_dirs or {k: v for k, v in SYSFS_WATCH_DIRS.items() if os.path.isdir(v)}
+        if not self._watch_dirs:
+            raise OSError("No sysfs directories available to watch")
+        self._snapshot = {subsystem: self._list(path) for subsystem, path in self._watch_dirs.items()}
+
+    @staticmethod
+    def _list(path):
+        try:
+            return set(os.listdir(path))
+        except OSError:
+            return set()
+
+    def read_events(self):
+        time.sleep(self._interval)
+        events = []
+        for subsystem, path in self._watch_dirs.items():
+            current = self._list(path)
+            previous = self._snapshot[subsystem]
+            if current == previous:
+                continue
+            timestamp = time.time()
+            for name in previous - current:
+                events.append(PresenceEvent("remove", subsystem, os.path.join(path, name), name, timestamp))
+            for name in current - previous:
+                events.append(PresenceEvent("add", subsystem, os.path.join(path, name), name, timestamp))
+            self._snapshot[subsystem] = current
+        return events
+
+    def close(self):
+        pass
+
+
+def parse_uevent(data, timestamp):
+    """
+    Parse a raw kernel uevent message ("action@devpath\\0KEY=VALUE\\0...")
+
+    :param data: bytes - Raw netlink payload
+    :param timestamp: float - Time the message was received
+    :return: PresenceEvent or None if the message is not a kernel uevent
+    """
+    fields = data.split(b"\0")
+    if not fields or b"@" not in fields[0]:
+        # libudev messages start with "libudev" and are not of interest here
+        return None
+    env = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            env[key.decode(errors="replace")] = value.decode(errors="replace")
+    action = env.get("ACTION") or fields[0].split(b"@")[0].decode(errors="replace")
+    devpath = env.get("DEVPATH", "")
+    devname = env.get("DEVNAME") or os.path.basename(devpath)
+    return PresenceEvent(action, env.get("SUBSYSTEM", ""), devpath, devname, timestamp)
+
+
+def event_matches(event, keys):
+    """
+    :param event: PresenceEvent obj
+    :param keys: Iterable<String> - The drive's identifiers, see drive_inventory.drive_keys()
+    :return: Boolean - True if the event is for the drive, or a device below it (e.g. the namespace of an NVMe
+             drive, whose devpath runs through the drive's PCI address)
+    """
+    return any(key in keys for key in event_keys(event))
+
+
+def create_event_source():
+    """
+    Return the best event source available on this host, or None if only interval polling is possible.
+    """
+    if hasattr(socket, "AF_NETLINK"):
+        try:
+            return NetlinkUeventSource()
+        except OSError:
+            pass
+    if os.path.isdir("/sys"):
+        try:
+            return SysfsWatchSource()
+        except OSError:
+            pass
+    return None
+
+
+class PresenceWatcher:
+    """
+    Delivers timestamped add/remove events and lets any number of threads block until a drive appears or
+    disappears.  Each wake-up costs one call to presence_check, so detection latency is governed by the
+    kernel event rather than by the duration of a polling probe.
+    """
+
+    def __init__(self, presence_check, source=None, recheck_interval=0.5, poll_interval=0.001, history=1024):
+        """
+        :param presence_check: callable(drive) -> Boolean - Confirms whether a drive is currently present
+        :param source: Event source (see create_event_source) - None to select automatically
+        :param recheck_interval: float - Seconds between safety-net re-checks when no events arrive
+        :param poll_interval: float - Seconds between presence checks when there is no event source
+        :param history: int - Number of recent events kept for inspection
+        """
+        self.presence_check = presence_check
+        self.recheck_interval = recheck_interval
+        self.poll_interval = poll_interval
+        self._source = source
+        self._events = deque(maxlen=history)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._listeners = []
+
+    @property
+    def source_name(self):
+        return self._source.name if self._source else "interval"
+
+    def start(self):
+        """
+        Start the background event reader.  Safe to call more than once.
+        """
+        if self._running:
+            return self
+        if self._source is None:
+            self._source = create_event_source()
+        self._running = True
+        if self._source is not None:
+            self._thread = threading.Thread(target=self._run, name="presence-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._source:
+            self._source.close()
+            self._source = None
+
+    def add_listener(self, callback):
+        """
+        Register a callable(PresenceEvent) invoked from the watcher thread for every relevant event.
+        """
+        self._listeners.append(callback)
+
+    def _run(self):
+        while self._running:
+            try:
+                events = self._source.read_events()
+            except OSError:
+                time.sleep(self.recheck_interval)
+                continue
+            events = [e for e in events if e.subsystem in WATCHED_SUBSYSTEMS]
+            if not events:
+                continue
+            with self._cond:
+                for event in events:
+                    self._events.append(event)
+                    self._seq += 1
+                self._cond.notify_all()
+            for listener in self._listeners:
+                for event in events:
+                    listener(event)
+
+    def events_since(self, start_time):
+        """
+        :param start_time: float - time.time() value
+        :return: List<PresenceEvent> - Recorded events at or after start_time
+        """
+        with self._cond:
+            return [e for e in self._events if e.timestamp >= start_time]
+
+    def _latest_event(self, start_time, actions, keys):
+        with self._cond:
+            for event in reversed(self._events):
+                if event.timestamp < start_time:
+                    break
+                if event.action in actions and event_matches(event, keys):
+                    return event
+        return None
+
+    def wait_for_state(self, drive, present, timeout, start_time=None):
+        """
+        Block until the drive reaches the requested presence state or the timeout expires.
+
+        :param drive: DriveWrapper obj - Drive to watch
+        :param present: Boolean - True to wait for enumeration, False to wait for removal
+        :param timeout: float - Max time (Seconds) to wait, measured from start_time
+        :param start_time: float (optional) - Reference time for the measurement, defaults to now
+        :return: (Boolean, float) - Whether the state was reached and the elapsed time in seconds
+        """
+        if start_time is None:
+            start_time = time.time()
+        actions = ADD_ACTIONS if present else REMOVE_ACTIONS
+        keys = set(drive_keys(drive))
+        deadline = start_time + timeout
+        with self._cond:
+            seen_seq = self._seq
+
+        while True:
+            if self.presence_check(drive) is present:
+                # Credit the detection to this drive's kernel event where there is one
+                event = self._latest_event(start_time, actions, keys)
+                detected = event.timestamp if event else time.time()
+                return True, max(detected, start_time) - start_time
+
+            now = time.time()
+            if now > deadline:
+                return False, now - start_time
+
+            with self._cond:
+                if self._source is None or not self._running:
+                    # No event source, fall back to polling the presence check
+                    self._cond.wait(min(self.poll_interval, deadline - now))
+                else:
+                    wait_time = min(self.recheck_interval, deadline - now)
+                    self._cond.wait_for(lambda: self._seq != seen_seq, wait_time)
+                seen_seq = self._seq
+
+    def wait_for_removal(self, drive, timeout, start_time=None):
+        return self.wait_for_state(drive, False, timeout, start_time)
+
+    def wait_for_presence(self, drive, timeout, start_time=None):
+        return self.wait_for_state(drive, True, timeout, start_time)
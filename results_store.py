@@ -0,0 +1,305 @@
+'''
+Structured per-cycle results for the AN-003 hotplug test.
+
+Every hotplug cycle is kept as a CycleRecord and streamed straight to an append-only JSON Lines file, one record
+per line, so nothing accumulates in memory as the run goes on.  Latency statistics are kept per plug speed in
+fixed-size log-scale histograms, which give p50/p95/p99 to within 1% regardless of how many cycles have run.
+'''
+
+import json
+import math
+import os
+import threading
+import time
+
+# Cycle verdicts
+PASS = "pass"
+NOT_REMOVED = "not removed"
+NOT_RETURNED = "not returned"
+LINK_MISMATCH = "link mismatch"
+# The module could not be driven through the cycle, even after retrying and reconnecting.  Not a drive failure.
+MODULE_ERROR = "module error"
+
+
+class CycleRecord:
+    """
+    Result of a single pull/plug cycle.  Times are in seconds, None if the stage did not complete.
+    """
+    __slots__ = ("slot", "speed", "iteration", "timestamp", "pull_cmd_time", "plug_cmd_time", "removal_time",
+                 "enumeration_time", "link_speed", "link_width", "link_time", "link_states", "kernel_removal_time",
+                 "kernel_enumeration_time", "user_removal_time", "user_enumeration_time", "kernel_events", "io_errors", "io_absent_errors", "io_first_time",
+                 "io_recovery_time", "pull_power", "plug_power", "recoveries", "verdict")
+
+    def __init__(self, speed, iteration, slot=""):
+        """
+        :param speed: int - Plug speed (mS) for the cycle
+        :param iteration: int - Iteration number at this speed, starting at 1
+        :param slot: String (optional) - Slot name when running several slots
+        """
+        self.slot = slot
+        self.speed = speed
+        self.iteration = iteration
+        self.timestamp = time.time()
+        self.pull_cmd_time = None
+        self.plug_cmd_time = None
+        self.removal_time = None
+        self.enumeration_time = None
+        self.link_speed = None
+        self.link_width = None
+        # Time from power up until the link reached its final state, and any states it passed through first
+        self.link_time = None
+        self.link_states = None
+        # Latency split: command to the kernel seeing the change, then kernel to the script seeing it
+        self.kernel_removal_time = None
+        self.kernel_enumeration_time = None
+        self.user_removal_time = None
+        self.user_enumeration_time = None
+        # [seconds into the cycle, message] for hotplug related kernel messages logged during the cycle
+        self.kernel_events = None
+        # I/Os in flight at the pull that failed, failed retries while the drive was gone, and times after
+        # enumeration to the first good I/O and full throughput
+        self.io_errors = None
+        self.io_absent_errors = None
+        self.io_first_time = None
+        self.io_recovery_time = None
+        # Power summaries (peak current, energy, settling time) of the windows after power down and power up
+        self.pull_power = None
+        self.plug_power = None
+        # Module commands retried or reconnected during the cycle (see run_supervisor.py)
+        self.recoveries = None
+        self.verdict = PASS
+
+    def fail(self, verdict):
+        """
+        Mark the cycle as failed.  The first failure in a cycle is the one reported.
+        """
+        if self.verdict == PASS:
+            self.verdict = verdict
+
+    @property
+    def passed(self):
+        return self.verdict == PASS
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        record = cls(values["speed"], values["iteration"], values.get("slot", ""))
+        for name in cls.__slots__:
+            if name in values:
+                setattr(record, name, values[name])
+        return record
+
+
+class LatencyHistogram:
+    """
+    Constant memory latency histogram with logarithmic buckets (default 1% relative precision).
+    """
+
+    def __init__(self, minimum=1e-6, maximum=1e4, precision=0.01):
+        """
+        :param minimum: float - Smallest distinguishable value (seconds); anything lower lands in the first bucket
+        :param maximum: float - Largest expected value (seconds); anything higher lands in the last bucket
+        :param precision: float - Relative width of each bucket
+        """
+        self.minimum = minimum
+        self._log_base = math.log1p(precision)
+        self._bucket_count = int(math.log(maximum / minimum) / self._log_base) + 1
+        self._counts = [0] * (self._bucket_count + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self.min = None
+
+    def add(self, value):
+        if value is None:
+            return
+        if value <= self.minimum:
+            index = 0
+        else:
+            index = min(self._bucket_count, int(math.log(value / self.minimum) / self._log_base) + 1)
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """
+        :param percent: float - Percentile to return, 0-100
+        :return: float - Approximate value at the percentile, None if the histogram is empty
+        """
+        if not self.count:
+            return None
+        target = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for index, bucket in enumerate(self._counts):
+            seen += bucket
+            if seen >= target:
+                if index == 0:
+                    return self.min
+                # Report the bucket midpoint, clamped to what was actually observed
+                value = self.minimum * math.exp((index - 0.5) * self._log_base)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+class SpeedSummary:
+    """
+    Running statistics for one plug speed.
+    """
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.cycles = 0
+        self.verdicts = {}
+        self.removal = LatencyHistogram()
+        self.enumeration = LatencyHistogram()
+
+    def add(self, record):
+        self.cycles += 1
+        self.verdicts[record.verdict] = self.verdicts.get(record.verdict, 0) + 1
+        self.removal.add(record.removal_time)
+        self.enumeration.add(record.enumeration_time)
+
+    @property
+    def failures(self):
+        return self.cycles - self.verdicts.get(PASS, 0)
+
+    def row(self):
+        """
+        :return: List<String> - speed, cycles, failures, then p50/p95/p99/max in mS for removal and for enumeration
+        """
+        row = [str(self.speed), str(self.cycles), str(self.failures)]
+        for histogram in (self.removal, self.enumeration):
+            values = [histogram.percentile(50), histogram.percentile(95), histogram.percentile(99), histogram.max]
+            row.append("/".join("-" if v is None else "{0:.1f}".format(v * 1000) for v in values))
+        return row
+
+
+class ResultsStore:
+    """
+    Append-only JSON Lines results file with per-speed running summaries.  Safe to share between slot threads.
+    """
+
+    def __init__(self, path, flush_every=1):
+        """
+        :param path: String - JSON Lines file to append records to
+        :param flush_every: int - Flush the file after this many records
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.summaries = {}
+        self._file = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        """
+        Stream a completed cycle to disk and fold it into the summaries
+
+        :param record: CycleRecord obj - Completed cycle
+        """
+        line = json.dumps(record.to_dict(), separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line + "\n")
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._file.flush()
+                self._pending = 0
+            summary = self.summaries.get(record.speed)
+            if summary is None:
+                summary = self.summaries[record.speed] = SpeedSummary(record.speed)
+            summary.add(record)
+
+    def _open(self):
+        results_file = open(self.path, "a")
+        # A record cut short by a crash would otherwise run into the first new one
+        if results_file.tell() > 0:
+            with open(self.path, "rb") as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b"\n":
+                    results_file.write("\n")
+        return results_file
+
+    def reload(self, keep=None):
+        """
+        Rebuild the running summaries from records already in the results file, e.g. when resuming a run.
+        Records are streamed, so this does not depend on the size of the file.
+
+        :param keep: int (optional) - Records the run's checkpoint accounts for.  Records after them belong to
+                     cycles that are about to run again, and are cut from the file so they are not counted twice
+        :return: int - Number of records read
+        """
+        count = 0
+        end = None
+        try:
+            with open(self.path, "rb") as results_file:
+                for line in iter(results_file.readline, b""):
+                    record = _parse_record(line)
+                    if record is None:
+                        continue
+                    if keep is not None and count >= keep:
+                        end = results_file.tell() - len(line)
+                        break
+                    summary = self.summaries.get(record.speed)
+                    if summary is None:
+                        summary = self.summaries[record.speed] = SpeedSummary(record.speed)
+                    summary.add(record)
+                    count += 1
+        except OSError:
+            # No results written yet
+            pass
+        if end is not None:
+            os.truncate(self.path, end)
+        return count
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def summary_table(self):
+        """
+        :return: List<List<String>> - One row per plug speed: speed, cycles, failures, then p50/p95/p99/max in mS
+                 for removal and for enumeration
+        """
+        with self._lock:
+            summaries = [self.summaries[speed] for speed in sorted(self.summaries)]
+        return [summary.row() for summary in summaries]
+
+
+def read_records(path):
+    """
+    Stream records back from a results file, skipping any partial lines
+
+    :param path: String - JSON Lines results file
+    :return: Generator<CycleRecord>
+    """
+    with open(path, "rb") as results_file:
+        for line in results_file:
+            record = _parse_record(line)
+            if record is not None:
+                yield record
+
+
+def _parse_record(line):
+    """
+    :param line: bytes - One line of a results file
+    :return: CycleRecord obj, or None for a blank line or a partial record left by a crash
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return CycleRecord.from_dict(json.loads(line))
+    except ValueError:
+        return None
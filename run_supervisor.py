@@ -0,0 +1,214 @@
+'''
+Module connection supervisor for the AN-003 hotplug test.
+
+A single lost USB packet used to end an overnight run: any exception or unexpected reply from the module went
+straight to exitScript().  SupervisedDevice stands in for the module wrapper and sorts errors into:
+
+    transient - The command didn't get through (exception, no reply, a reply the module gives when busy).
+                Retried with bounded exponential backoff, reconnecting to the module and re-applying its cached
+                configuration in between
+    fatal     - The module rejected the command itself (unknown command, value out of range), or stayed
+                unreachable through every retry.  Retrying can't help and the run is stopped
+    drive     - The drive misbehaving (not removed, not returned, link mismatch).  These are cycle verdicts and
+                never retried or hidden; they are only named here for completeness
+
+Every recovery, and every command given up on, is kept as a dict (command, error, attempts, reconnected, recovered,
+duration) so it can be recorded with the cycle it happened in.
+'''
+
+import logging
+import time
+
+TRANSIENT = "transient"
+DRIVE = "drive"
+FATAL = "fatal"
+
+# Module error codes that reject the command itself: unknown command, invalid source, value not in valid range
+FATAL_CODES = ("0x10", "0x15", "0x16")
+
+
+def classify_reply(response):
+    """
+    :param response: String - Reply to a command which answers "OK" on success
+    :return: String - None if the reply is good, otherwise TRANSIENT or FATAL
+    """
+    if not response or not response.strip():
+        return TRANSIENT
+    if "FAIL" in response.upper():
+        return FATAL if any(code in response for code in FATAL_CODES) else TRANSIENT
+    if "OK" not in response:
+        return TRANSIENT
+    return None
+
+
+class ModuleCommandError(Exception):
+    """
+    A module command that could not be completed, after any retries.
+    """
+
+    def __init__(self, command, reason, kind):
+        """
+        :param command: String - Command sent
+        :param reason: String - Last reply or error
+        :param kind: String - TRANSIENT or FATAL
+        """
+        super().__init__(command + ": " + reason)
+        self.command = command
+        self.reason = reason
+        self.kind = kind
+
+
+class SupervisedDevice:
+    """
+    Module wrapper which retries failed commands and reconnects to the module when the connection is lost.
+    Anything other than sendCommand / closeConnection is passed through to the current connection.
+    """
+
+    def __init__(self, connect, retries=4, backoff=0.5, max_backoff=8.0, max_failed_commands=3, on_reconnect=None):
+        """
+        :param connect: callable() -> QuarchDevice - Opens a new connection to the module
+        :param retries: int - Retries per command before giving up on it
+        :param backoff: float - Wait (Seconds) before the first retry, doubled for each retry after
+        :param max_backoff: float - Longest wait (Seconds) between retries
+        :param max_failed_commands: int - Commands in a row that may fail all their retries before errors are fatal
+        :param on_reconnect: callable(SupervisedDevice) (optional) - Re-applies the module configuration after a
+                             reconnect.  Commands it sends are not retried individually
+        """
+        self._connect = connect
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_failed_commands = max_failed_commands
+        self.on_reconnect = on_reconnect
+        self.device = connect()
+        self.recoveries = []
+        self.reconnects = 0
+        # Attempts the last command took, more than 1 if it had to be retried
+        self.last_attempts = 0
+        self._failed_commands = 0
+        self._recovering = False
+
+    def __getattr__(self, name):
+        device = self.__dict__.get("device")
+        if device is None:
+            raise AttributeError(name)
+        return getattr(device, name)
+
+    def sendCommand(self, command):
+        """
+        Send a command, retrying if it fails to get through.  The reply is returned whatever it says.
+
+        :param command: String - Module command
+        :return: String - Module reply
+        """
+        return self._send(command, False)
+
+    def command(self, command, verify=None):
+        """
+        Send a command which answers "OK", retrying transient failures
+
+        :param command: String - Module command
+        :param verify: (String, String) (optional) - Query, and its reply once the command has taken effect.  For
+                       commands that must not be repeated (power up / down): after a failure the module is asked
+                       first, and the command is only sent again if it did not get through
+        :return: String - Module reply
+        :raises ModuleCommandError: if the command was rejected, or still failed after every retry
+        """
+        return self._send(command, True, verify)
+
+    def send_once(self, command):
+        """
+        Send a command on the current connection without retrying, e.g. to poll the module
+
+        :param command: String - Module command
+        :return: String - Module reply
+        """
+        return self.device.sendCommand(command)
+
+    def closeConnection(self):
+        try:
+            return self.device.closeConnection()
+        except Exception as err:
+            logging.debug("Closing module connection failed: " + str(err))
+            return None
+
+    def take_recoveries(self):
+        """
+        :return: List<Dict> - Recoveries since the last call, None if there were none
+        """
+        recoveries, self.recoveries = self.recoveries, []
+        return recoveries or None
+
+    def _send(self, command, expect_ok, verify=None):
+        if self._recovering:
+            return self.device.sendCommand(command)
+        started = time.time()
+        attempts = 0
+        reconnected = False
+        first_error = None
+        while True:
+            attempts += 1
+            self.last_attempts = attempts
+            try:
+                if attempts > 1 and verify and self._verify(*verify):
+                    # An earlier attempt got through, only its reply was lost
+                    response, kind = "OK", None
+                else:
+                    response = self.device.sendCommand(command)
+                    if expect_ok:
+                        kind = classify_reply(response)
+                    else:
+                        kind = None if response and response.strip() else TRANSIENT
+                reason = response
+            except Exception as err:
+                kind, reason, response = TRANSIENT, type(err).__name__ + ": " + str(err), None
+            if kind is None:
+                self._failed_commands = 0
+                if attempts > 1:
+                    self._record(command, first_error, attempts, reconnected, started)
+                return response
+            if first_error is None:
+                first_error = reason
+            if kind == FATAL:
+                raise ModuleCommandError(command, str(reason), FATAL)
+            if attempts > self.retries:
+                self._record(command, first_error, attempts, reconnected, started, recovered=False)
+                self._failed_commands += 1
+                if self._failed_commands >= self.max_failed_commands:
+                    kind = FATAL
+                raise ModuleCommandError(command, str(reason), kind)
+            logging.warning("Module command " + command + " failed (" + str(reason) + "), retry " + str(attempts) +
+                            "/" + str(self.retries))
+            time.sleep(min(self.max_backoff, self.backoff * 2 ** (attempts - 1)))
+            # Reconnect from the second failure on, a single lost reply rarely needs a new connection
+            if attempts > 1 and self.reconnect():
+                reconnected = True
+
+    def _verify(self, query, expected):
+        response = self.device.sendCommand(query)
+        return bool(response) and response.strip().upper() == expected.upper()
+
+    def reconnect(self):
+        """
+        Open a new connection to the module and re-apply its configuration
+
+        :return: Boolean - True if reconnected
+        """
+        self.closeConnection()
+        self._recovering = True
+        try:
+            self.device = self._connect()
+            if self.on_reconnect:
+                self.on_reconnect(self)
+        except Exception as err:
+            logging.warning("Reconnecting to the module failed: " + str(err))
+            return False
+        finally:
+            self._recovering = False
+        self.reconnects += 1
+        return True
+
+    def _record(self, command, error, attempts, reconnected, started, recovered=True):
+        self.recoveries.append({"command": command, "error": str(error), "attempts": attempts,
+                                "reconnected": reconnected, "recovered": recovered,
+                                "duration": time.time() - started})
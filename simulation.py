@@ -0,0 +1,393 @@
+'''
+Simulated Quarch module and host for the AN-003 hotplug test.
+
+Lets basicHotplug / pcieHotplug run on any Linux box without a QTL1743 or a real drive, with every latency known
+and configurable, so the overhead of the harness itself can be measured and regression tested.
+
+    SimulatedQuarchDevice - Answers the module commands the script uses ("hello?", "*tst?", "conf:def:state",
+                            "source:N:delay", "RUN:POWer DOWN/UP") after a configurable response latency
+    SimulatedHost         - Stands in for QuarchpyQCS HostInformation, modelling removal and enumeration delays
+                            and link training, and publishing kernel-style events to the PresenceWatcher
+    SimulatedRig          - Wires modules to drives, one drive per simulated module ("SIM:<name>-<slot>")
+
+load_test_script() imports "Hotplug cycle test.py" as a module, for tools which drive its cycle loops in process.
+'''
+
+import importlib.util
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from module_state import DELAY_LIMIT, LEGACY_DELAY_LIMIT
+from presence_watcher import PresenceEvent
+
+MODULE_NAME = "QTL1743 PCIe Drive Control Module (simulated)"
+TEST_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Hotplug cycle test.py")
+SOURCE_COUNT = 6
+
+
+class SimulatedDrive:
+    """
+    A drive as seen by the simulated host.  Mirrors the DriveWrapper attributes used by the script.
+    """
+
+    def __init__(self, identifier_str, drive_type="pcie", link_speed="16GT/s", lane_width="x4",
+                 removal_delay=0.05, enumeration_delay=0.2, jitter=0.0, link_train_time=0.0,
+                 initial_link=None, min_plug_delay=0, seed=None):
+        """
+        :param identifier_str: String - Identifier shown in the drive list
+        :param drive_type: String - "pcie" to exercise the link checks, anything else for basic hotplug
+        :param link_speed: String - Link speed once training completes
+        :param lane_width: String - Link width once training completes
+        :param removal_delay: float - Seconds from power down until the host loses the drive
+        :param enumeration_delay: float - Seconds from power up until the host finds the drive
+        :param jitter: float - Maximum random extra delay (Seconds) added to removal and enumeration
+        :param link_train_time: float - Seconds after enumeration that the link reaches its final state
+        :param initial_link: (String, String) (optional) - Link speed/width reported until training completes
+        :param min_plug_delay: int - Plug delays (mS) below this leave the drive missing after power up
+        :param seed: int (optional) - Seed for the jitter, for repeatable runs
+        """
+        self.identifier_str = identifier_str
+        self.description = "Simulated " + drive_type.upper() + " drive"
+        self.drive_type = drive_type
+        self.link_speed = link_speed
+        self.lane_width = lane_width
+        self.removal_delay = removal_delay
+        self.enumeration_delay = enumeration_delay
+        self.jitter = jitter
+        self.link_train_time = link_train_time
+        self.initial_link = initial_link
+        self.min_plug_delay = min_plug_delay
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._present = True
+        # (time, present) state change scheduled by the last power command
+        self._pending = None
+        # Time the last scheduled change took (or takes) effect, the true reference for measured latencies
+        self.changed_at = None
+        self.enumerated_at = time.time()
+        # Most recent injected delays, for comparing against what the script measured
+        self.last_removal_delay = None
+        self.last_enumeration_delay = None
+
+    def _delay(self, base):
+        return base + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _settle(self):
+        # Apply a scheduled state change once its time has come
+        if self._pending and time.time() >= self._pending[0]:
+            self._present = self._pending[1]
+            if self._present:
+                self.enumerated_at = self._pending[0]
+            self._pending = None
+
+    @property
+    def present(self):
+        with self._lock:
+            self._settle()
+            return self._present
+
+    def schedule(self, present, delay):
+        """
+        Schedule the drive to appear or disappear after <delay> seconds
+
+        :return: float - Time the change takes effect
+        """
+        with self._lock:
+            self._settle()
+            when = time.time() + delay
+            self._pending = (when, present)
+            self.changed_at = when
+            return when
+
+    def current_link(self):
+        """
+        :return: (String, String) - Link speed and width at this moment
+        """
+        if self.initial_link and time.time() - self.enumerated_at < self.link_train_time:
+            return self.initial_link
+        return self.link_speed, self.lane_width
+
+
+class SimulatedEventSource:
+    """
+    PresenceWatcher event source fed by the simulated host instead of the kernel.
+    """
+    name = "simulated"
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def publish(self, event):
+        self._queue.put(event)
+
+    def read_events(self):
+        try:
+            events = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        pass
+
+
+class SimulatedHost:
+    """
+    Drop-in replacement for HostInformation, backed by SimulatedDrive objects.
+    """
+
+    def __init__(self, probe_latency=0.0):
+        """
+        :param probe_latency: float - Seconds each presence / link query takes, to model lspci or smartctl cost
+        """
+        self.probe_latency = probe_latency
+        self.drives = []
+        self.probe_count = 0
+        self._sources = []
+
+    def add_drive(self, drive):
+        self.drives.append(drive)
+        return drive
+
+    def event_source(self):
+        """
+        :return: SimulatedEventSource obj - Receives an event whenever a simulated drive appears or disappears
+        """
+        source = SimulatedEventSource()
+        self._sources.append(source)
+        return source
+
+    def _publish(self, action, drive):
+        # Stamped when actually published, like a kernel event on receipt, so dispatch latency is not hidden
+        event = PresenceEvent(action, "pci", "/devices/simulated/" + drive.identifier_str, drive.identifier_str,
+                              time.time())
+        for source in self._sources:
+            source.publish(event)
+
+    def power_change(self, drive, powered, plug_delay=None):
+        """
+        Called by a simulated module when it powers its drive down or up.
+
+        :param drive: SimulatedDrive obj - Drive attached to the module
+        :param powered: Boolean - True for power up
+        :param plug_delay: int (optional) - Step delay (mS) of the hotplug timing used
+        """
+        if not powered:
+            delay = drive._delay(drive.removal_delay)
+            drive.last_removal_delay = delay
+            drive.schedule(False, delay)
+            threading.Timer(delay, self._publish, ("remove", drive)).start()
+        elif plug_delay is not None and plug_delay < drive.min_plug_delay:
+            # Plugged too fast for this drive, it does not come back
+            drive.last_enumeration_delay = None
+        else:
+            delay = drive._delay(drive.enumeration_delay)
+            drive.last_enumeration_delay = delay
+            drive.schedule(True, delay)
+            threading.Timer(delay, self._publish, ("add", drive)).start()
+
+    def _probe(self):
+        self.probe_count += 1
+        if self.probe_latency:
+            time.sleep(self.probe_latency)
+
+    def return_wrapped_drives(self):
+        self._probe()
+        return [drive for drive in self.drives if drive.present]
+
+    def get_wrapped_drive_from_choice(self, choice):
+        choice = choice.strip()
+        for drive in self.drives:
+            if drive.identifier_str == choice:
+                return drive
+        return None
+
+    def is_wrapped_device_present(self, drive):
+        self._probe()
+        return drive.present
+
+    def return_wrapped_drive_link(self, drive):
+        self._probe()
+        return drive.current_link()[0] if drive.present else None
+
+    def return_wrapped_drive_width(self, drive):
+        self._probe()
+        return drive.current_link()[1] if drive.present else None
+
+
+class SimulatedQuarchDevice:
+    """
+    Drop-in replacement for a quarchDevice connected to a hotplug module.
+    """
+
+    def __init__(self, connection_target, host=None, drive=None, response_latency=0.001, legacy=False,
+                 fault_rate=0.0, seed=None):
+        """
+        :param connection_target: String - Connection string the device was opened with
+        :param host: SimulatedHost obj (optional) - Host to notify of power changes
+        :param drive: SimulatedDrive obj (optional) - Drive the module controls
+        :param response_latency: float - Seconds each command takes to answer
+        :param legacy: Boolean - Reject delays over the legacy 1270mS limit
+        :param fault_rate: float - Chance of each command failing like a lost USB transfer, before or after the
+                           module has acted on it
+        :param seed: int (optional) - Seed for the faults
+        """
+        self.ConString = connection_target
+        self.host = host
+        self.drive = drive
+        self.response_latency = response_latency
+        self.legacy = legacy
+        self.powered = True
+        self.source_delays = [0] * SOURCE_COUNT
+        # source number -> {"mode": "on"/"off", "length": .., "period": .., "duty": ..}
+        self.source_bounce = {}
+        self.command_counts = {}
+        self.connected = True
+        self.fault_rate = fault_rate
+        self.faults = 0
+        self._random = random.Random(seed)
+
+    def sendCommand(self, command):
+        """
+        :param command: String - Module command
+        :return: String - Module response
+        """
+        if not self.connected:
+            raise OSError("Simulated module connection is closed")
+        if self.response_latency:
+            time.sleep(self.response_latency)
+        if self.fault_rate and self._random.random() < self.fault_rate:
+            self.faults += 1
+            if self._random.random() < 0.5:
+                raise OSError("Simulated USB timeout")
+            self._execute(command)
+            raise OSError("Simulated USB timeout, reply lost")
+        return self._execute(command)
+
+    def _execute(self, command):
+        normalised = command.strip().lower()
+        key = normalised.split(" ")[0]
+        self.command_counts[key] = self.command_counts.get(key, 0) + 1
+
+        if normalised == "hello?":
+            return MODULE_NAME
+        if normalised == "*tst?":
+            return "OK"
+        if normalised == "conf:def:state":
+            self.source_delays = [0] * SOURCE_COUNT
+            self.source_bounce = {}
+            self._power(True)
+            return "OK"
+        if normalised in ("run:power?", "run pow?"):
+            return "ON" if self.powered else "OFF"
+        match = re.match(r"source:(\d+):delay\s+(\d+)$", normalised)
+        if match:
+            source, delay = int(match.group(1)), int(match.group(2))
+            if not 1 <= source <= SOURCE_COUNT:
+                return "FAIL: 0x15 -Invalid source"
+            if delay > (LEGACY_DELAY_LIMIT if self.legacy else DELAY_LIMIT):
+                return "FAIL: 0x16 -Numeric value not in valid range"
+            self.source_delays[source - 1] = delay
+            return "OK"
+        match = re.match(r"source:(\d+):bounce:(mode|length|period|duty)\s+(\w+)$", normalised)
+        if match:
+            source, setting, value = int(match.group(1)), match.group(2), match.group(3)
+            if not 1 <= source <= SOURCE_COUNT:
+                return "FAIL: 0x15 -Invalid source"
+            if (setting == "mode") != (value in ("on", "off")) or (setting != "mode" and not value.isdigit()):
+                return "FAIL: 0x16 -Numeric value not in valid range"
+            self.source_bounce.setdefault(source, {})[setting] = value if setting == "mode" else int(value)
+            return "OK"
+        match = re.match(r"run(?::|\s+)pow(?:er)?\s+(up|down)$", normalised)
+        if match:
+            self._power(match.group(1) == "up")
+            return "OK"
+        return "FAIL: 0x10 -Unknown command"
+
+    def _power(self, powered):
+        if powered == self.powered:
+            return
+        self.powered = powered
+        if self.host and self.drive:
+            # Step delay of the ramp, the gap between the first and second timed sources to change
+            ramp = sorted(set(self.source_delays))
+            plug_delay = ramp[1] - ramp[0] if len(ramp) > 1 else 0
+            self.host.power_change(self.drive, powered, plug_delay)
+
+    def closeConnection(self):
+        self.connected = False
+        return "OK"
+
+
+class SimulatedRig:
+    """
+    A simulated host with one simulated module and drive per slot.
+    """
+
+    def __init__(self, slots=1, probe_latency=0.0, response_latency=0.001, legacy=False, fault_rate=0.0,
+                 **drive_options):
+        """
+        :param slots: int - Number of module / drive pairs
+        :param probe_latency: float - See SimulatedHost
+        :param response_latency: float - See SimulatedQuarchDevice
+        :param legacy: Boolean - Simulate legacy modules
+        :param fault_rate: float - See SimulatedQuarchDevice
+        :param drive_options: Keyword arguments passed to every SimulatedDrive
+        """
+        self.host = SimulatedHost(probe_latency)
+        self.response_latency = response_latency
+        self.legacy = legacy
+        self.fault_rate = fault_rate
+        # slot -> SimulatedQuarchDevice, kept so that a module keeps its state across connections like a real one
+        self.modules = {}
+        for slot in range(1, slots + 1):
+            self.host.add_drive(SimulatedDrive("SIM-DRIVE-" + str(slot), **drive_options))
+
+    @staticmethod
+    def is_simulated(connection_target):
+        return connection_target.upper().startswith("SIM:")
+
+    def module_strings(self):
+        return ["SIM:QTL1743-SIM-" + str(slot).zfill(3) for slot in range(1, len(self.host.drives) + 1)]
+
+    def connect(self, connection_target):
+        """
+        Open a simulated module, or reopen it if it was connected before.  The trailing number of the connection
+        string picks the slot (default 1).
+
+        :param connection_target: String - e.g. "SIM:QTL1743-SIM-002"
+        :return: SimulatedQuarchDevice obj
+        """
+        match = re.search(r"(\d+)$", connection_target)
+        slot = int(match.group(1)) if match else 1
+        if not 1 <= slot <= len(self.host.drives):
+            raise ValueError("No simulated module for " + connection_target)
+        module = self.modules.get(slot)
+        if module is None:
+            module = self.modules[slot] = SimulatedQuarchDevice(connection_target, self.host,
+                                                                self.host.drives[slot - 1], self.response_latency,
+                                                                self.legacy, self.fault_rate)
+        module.connected = True
+        return module
+
+
+def load_test_script(path=TEST_SCRIPT_PATH):
+    """
+    Load a fresh copy of the hotplug test script as a module (its file name is not importable directly).
+    Each call returns a new module, so its globals (watcher, results store, backends) start out clean.
+
+    :param path: String - Path of the script
+    :return: module - The loaded script, with main() not run
+    """
+    spec = importlib.util.spec_from_file_location("hotplug_cycle_test", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,322 @@
+'''
+Native Linux probe for drive presence and PCIe link state.
+
+HostInformation answers presence and link questions by shelling out to lspci / smartctl, which costs tens of
+milliseconds per call.  This probe reads the same information straight from sysfs instead.  The location of each
+drive in the PCI tree is cached, so a presence check is a single stat() of the device directory below its parent
+bridge and only that bridge is rescanned when the topology changes.  Drives known by a block device name ("sdb",
+"nvme0n1") are anchored to the SCSI or PCI address behind that name, which survives re-enumeration; the kernel may
+hand out a different name each time, so the name is looked up again from the address after every add event.
+'''
+
+import os
+import re
+import threading
+
+PCI_DEVICES_DIR = "bus/pci/devices"
+SCSI_DEVICES_DIR = "bus/scsi/devices"
+BLOCK_CLASS_DIR = "class/block"
+
+# PCI config space offsets and bits used to read the PCIe Link Status register (see linux/pci_regs.h)
+PCI_STATUS = 0x06
+PCI_STATUS_CAP_LIST = 0x10
+PCI_CAPABILITY_LIST = 0x34
+PCI_CAP_ID_EXP = 0x10
+PCI_EXP_LNKSTA = 0x12
+PCI_EXP_LNKSTA_LT = 0x0800
+PCI_EXP_LNKSTA_DLLLA = 0x2000
+
+# Matches a PCI address with or without the leading domain, e.g. "0000:5e:00.0" or "5e:00.0"
+BDF_PATTERN = re.compile(r"\b(?:([0-9a-fA-F]{4}):)?([0-9a-fA-F]{2}):([0-9a-fA-F]{2})\.([0-7])\b")
+# Block device names used by the non-PCIe drive wrappers, e.g. "/dev/sdb" or "sdb"
+BLOCK_PATTERN = re.compile(r"(?:/dev/)?\b((?:sd[a-z]+|nvme\d+n\d+|hd[a-z]+))\b")
+# SCSI address (host:channel:target:lun) of the device a block device belongs to, from its sysfs path
+SCSI_ADDRESS_PATTERN = re.compile(r"/(\d+:\d+:\d+:\d+)/block/")
+# Namespace part of an NVMe block device name, the same whichever controller number the drive is given
+NVME_NAMESPACE_PATTERN = re.compile(r"nvme\d+(n\d+)$")
+
+
+def normalise_bdf(text):
+    """
+    Extract a PCI address from a drive identifier
+
+    :param text: String - Drive identifier
+    :return: String - Full "dddd:bb:dd.f" address, or None if no address is present
+    """
+    match = BDF_PATTERN.search(text or "")
+    if not match:
+        return None
+    domain, bus, device, function = match.groups()
+    return "{0}:{1}:{2}.{3}".format(domain or "0000", bus, device, function).lower()
+
+
+def format_link_speed(raw):
+    """
+    Convert a sysfs link speed ("8.0 GT/s PCIe") to the lspci style used in the logs ("8GT/s")
+    """
+    match = re.match(r"\s*([\d.]+)\s*GT/s", raw or "")
+    if not match:
+        return None
+    return "{0:g}GT/s".format(float(match.group(1)))
+
+
+def format_link_width(raw):
+    """
+    Convert a sysfs link width ("4") to the lspci style used in the logs ("x4")
+    """
+    raw = (raw or "").strip()
+    return "x" + raw if raw.isdigit() else None
+
+
+class DriveLocation:
+    """
+    Cached location of a drive in sysfs.
+    """
+    __slots__ = ("bdf", "bridge_path", "block_name", "address_path", "stale")
+
+    def __init__(self, bdf=None, bridge_path=None, block_name=None, address_path=None):
+        self.bdf = bdf
+        self.bridge_path = bridge_path
+        self.block_name = block_name
+        # Stable sysfs path (SCSI or PCI address) of the device behind block_name, None if it couldn't be resolved
+        self.address_path = address_path
+        # Set by add events, block_name has to be looked up again from address_path
+        self.stale = False
+
+    @property
+    def device_path(self):
+        return os.path.join(self.bridge_path, self.bdf) if self.bdf and self.bridge_path else None
+
+
+class SysfsDriveProbe:
+    """
+    Sub-millisecond presence and link probe backed by a cached snapshot of the PCI tree.
+    """
+
+    def __init__(self, sysfs_root="/sys"):
+        self.sysfs_root = sysfs_root
+        self._pci_dir = os.path.join(sysfs_root, PCI_DEVICES_DIR)
+        self._block_dir = os.path.join(sysfs_root, BLOCK_CLASS_DIR)
+        self._lock = threading.Lock()
+        # bridge path -> set of child PCI addresses
+        self._bridges = {}
+        # drive identifier -> DriveLocation
+        self._locations = {}
+        self.snapshot()
+
+    @staticmethod
+    def available(sysfs_root="/sys"):
+        return os.path.isdir(os.path.join(sysfs_root, PCI_DEVICES_DIR))
+
+    def snapshot(self):
+        """
+        Take a full snapshot of the PCI tree.  Only needed once, later updates go through rescan_bridge().
+        """
+        bridges = {}
+        try:
+            entries = os.listdir(self._pci_dir)
+        except OSError:
+            entries = []
+        for bdf in entries:
+            real_path = os.path.realpath(os.path.join(self._pci_dir, bdf))
+            bridges.setdefault(os.path.dirname(real_path), set()).add(bdf)
+        with self._lock:
+            self._bridges = bridges
+
+    def rescan_bridge(self, bridge_path):
+        """
+        Re-read the children of a single bridge, leaving the rest of the snapshot untouched
+
+        :param bridge_path: String - Real sysfs path of the bridge (or root complex)
+        :return: Set<String> - PCI addresses currently below the bridge
+        """
+        try:
+            children = {name for name in os.listdir(bridge_path) if BDF_PATTERN.fullmatch(name)}
+        except OSError:
+            children = set()
+        with self._lock:
+            if children:
+                self._bridges[bridge_path] = children
+            else:
+                self._bridges.pop(bridge_path, None)
+        return children
+
+    def on_event(self, event):
+        """
+        PresenceWatcher listener: keep the snapshot current by rescanning the bridge a PCI event came from, and have
+        block device names looked up again once something has been added.
+
+        :param event: PresenceEvent obj
+        """
+        if event.action == "add":
+            for location in list(self._locations.values()):
+                if location.block_name:
+                    location.stale = True
+        if event.subsystem != "pci":
+            return
+        if event.devpath.startswith("/devices/"):
+            bridge_path = os.path.dirname(os.path.join(self.sysfs_root, event.devpath.lstrip("/")))
+        else:
+            # SysfsWatchSource reports the /sys/bus/pci/devices link, which is already gone after a removal
+            bridge_path = self._find_bridge(os.path.basename(event.devpath))
+        if bridge_path:
+            self.rescan_bridge(bridge_path)
+
+    def _find_bridge(self, bdf):
+        with self._lock:
+            for bridge_path, children in self._bridges.items():
+                if bdf in children:
+                    return bridge_path
+        # Not in the snapshot, the device may have arrived since.  The bus symlink resolves it directly.
+        link = os.path.join(self._pci_dir, bdf)
+        if os.path.exists(link):
+            bridge_path = os.path.dirname(os.path.realpath(link))
+            self.rescan_bridge(bridge_path)
+            return bridge_path
+        return None
+
+    def locate(self, drive):
+        """
+        Resolve (and cache) where a drive lives in sysfs
+
+        :param drive: DriveWrapper obj - Drive to locate
+        :return: DriveLocation obj, or None if this probe cannot handle the drive
+        """
+        identifier = getattr(drive, "identifier_str", None) or str(drive)
+        location = self._locations.get(identifier)
+        if location is not None:
+            if location.bdf and location.bridge_path is None:
+                location.bridge_path = self._find_bridge(location.bdf)
+            return location
+
+        bdf = normalise_bdf(identifier)
+        if bdf:
+            location = DriveLocation(bdf=bdf, bridge_path=self._find_bridge(bdf))
+            if location.bridge_path is None:
+                # Never seen on this host, so the identifier is probably not a PCI address after all
+                return None
+        else:
+            match = BLOCK_PATTERN.search(identifier)
+            if not match:
+                return None
+            location = DriveLocation(block_name=match.group(1),
+                                     address_path=self._block_address_path(match.group(1)))
+        self._locations[identifier] = location
+        return location
+
+    def _block_address_path(self, block_name):
+        """
+        :param block_name: String - Block device name, e.g. "sdb"
+        :return: String - /sys/bus/scsi/devices/<address> or /sys/bus/pci/devices/<address> of the device the block
+                 device belongs to, None if the device isn't there or has neither
+        """
+        real_path = os.path.realpath(os.path.join(self._block_dir, block_name))
+        match = SCSI_ADDRESS_PATTERN.search(real_path)
+        if match:
+            return os.path.join(self.sysfs_root, SCSI_DEVICES_DIR, match.group(1))
+        addresses = list(BDF_PATTERN.finditer(real_path))
+        if addresses:
+            return os.path.join(self._pci_dir, addresses[-1].group(0))
+        return None
+
+    def _resolve_block_name(self, location):
+        """
+        Look up the block device name the kernel currently gives the device at location.address_path
+        """
+        location.stale = False
+        namespace = NVME_NAMESPACE_PATTERN.search(location.block_name)
+        try:
+            if namespace:
+                controllers = [os.path.join(location.address_path, "nvme", name)
+                               for name in os.listdir(os.path.join(location.address_path, "nvme"))]
+                names = [name for controller in controllers for name in os.listdir(controller)
+                         if NVME_NAMESPACE_PATTERN.fullmatch(name) and name.endswith(namespace.group(1))]
+            else:
+                names = os.listdir(os.path.join(location.address_path, "block"))
+        except OSError:
+            # Not there at the moment, keep the last name until the drive comes back
+            return
+        if names:
+            location.block_name = sorted(names)[0]
+
+    def supports(self, drive):
+        return self.locate(drive) is not None
+
+    def is_present(self, drive):
+        """
+        :param drive: DriveWrapper obj - Drive to check
+        :return: Boolean - True if the drive is currently visible to the host
+        """
+        location = self.locate(drive)
+        if location is None:
+            return False
+        if location.block_name:
+            if location.address_path is None:
+                return os.path.exists(os.path.join(self._block_dir, location.block_name))
+            if location.stale or not os.path.exists(os.path.join(self._block_dir, location.block_name)):
+                self._resolve_block_name(location)
+            # Present while the name exists and still belongs to this drive's address
+            return self._block_address_path(location.block_name) == location.address_path
+        if location.device_path and os.path.isdir(location.device_path):
+            return True
+        # The bridge may itself have been removed and re-added (e.g. behind a switch), look it up again
+        location.bridge_path = self._find_bridge(location.bdf)
+        return location.device_path is not None and os.path.isdir(location.device_path)
+
+    def _read_attribute(self, drive, name):
+        location = self.locate(drive)
+        if location is None or location.device_path is None:
+            return None
+        try:
+            with open(os.path.join(location.device_path, name)) as attribute:
+                return attribute.read().strip()
+        except OSError:
+            return None
+
+    def link_status(self, drive):
+        """
+        Read the Link Status register of the port above the drive.  This stays readable while the drive itself is
+        gone, so it shows the link going down and training again.  Needs root, as it reads PCI config space
+        beyond the first 64 bytes.
+
+        :return: String - "down", "training" or "active", None if unavailable
+        """
+        location = self.locate(drive)
+        if location is None or not location.bridge_path:
+            return None
+        if not BDF_PATTERN.fullmatch(os.path.basename(location.bridge_path)):
+            # Drive sits directly on a root bus, there is no port to read
+            return None
+        try:
+            with open(os.path.join(location.bridge_path, "config"), "rb") as config_file:
+                config = config_file.read(256)
+        except OSError:
+            return None
+        if len(config) < 64 or not (config[PCI_STATUS] & PCI_STATUS_CAP_LIST):
+            return None
+        pointer = config[PCI_CAPABILITY_LIST] & 0xFC
+        # Bounded walk of the capability list, in case it is corrupt
+        for _ in range(48):
+            if not pointer or pointer + PCI_EXP_LNKSTA + 2 > len(config):
+                return None
+            if config[pointer] == PCI_CAP_ID_EXP:
+                link_status = config[pointer + PCI_EXP_LNKSTA] | (config[pointer + PCI_EXP_LNKSTA + 1] << 8)
+                if link_status & PCI_EXP_LNKSTA_LT:
+                    return "training"
+                if link_status & PCI_EXP_LNKSTA_DLLLA:
+                    return "active"
+                return "down"
+            pointer = config[pointer + 1] & 0xFC
+        return None
+
+    def link_speed(self, drive):
+        """
+        :return: String - Current link speed in lspci format (e.g. "8GT/s"), None if unavailable
+        """
+        return format_link_speed(self._read_attribute(drive, "current_link_speed"))
+
+    def link_width(self, drive):
+        """
+        :return: String - Current link width in lspci format (e.g. "x4"), None if unavailable
+        """
+        return format_link_width(self._read_attribute(drive, "current_link_width"))
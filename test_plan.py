@@ -0,0 +1,186 @@
+'''
+Headless test plans with checkpoint / resume for the AN-003 hotplug test.
+
+A plan file (JSON) holds everything the interactive flow would otherwise ask for:
+
+    {
+        "module": "USB:QTL1743-03-001",
+        "drive": "0000:5e:00.0",
+        "plug_speeds": [25, 100, 10, 500],
+        "cycle_iterations": 3,
+        "on_timeout": 10,
+        "off_timeout": 10,
+        "checkpoint_every": 1,
+        "workload": {"path": "/dev/nvme0n1", "block_size": 4096, "queue_depth": 8, "read_ratio": 1.0},
+        "power": {"stream": "synthetic", "sample_rate": 50000, "raw_windows": "failures"},
+        "metrics_port": 9464,
+        "sequences": [{"ramp": 25, "steps": 3},
+                      {"delays": [0, 0, 10, 10, 100, 100], "bounce": {"5": {"length": 20, "period": 2}}}]
+    }
+
+"workload" is optional; when given, I/O is kept running against the drive through every cycle.
+"power" is optional; when given, the inrush and discharge of every cycle are captured (see power_capture.py).
+"metrics_port" is optional; when given, live progress is served for Prometheus (see metrics_exporter.py).
+"sequences" is optional; when given, each timing sequence (see hotplug_sequence.py) is run in place of plug_speeds.
+
+Progress is written to a checkpoint file next to the plan after every few completed cycles.  Running the same plan
+again picks up after the last completed cycle, appending to the same log and results files.
+'''
+
+import hashlib
+import json
+import os
+import time
+
+from hotplug_sequence import HotplugSequence
+
+# Plan keys which define the test itself.  Changing any of them invalidates an existing checkpoint.
+PLAN_KEYS = ("module", "drive", "plug_speeds", "cycle_iterations", "on_timeout", "off_timeout", "sequences")
+
+PLAN_DEFAULTS = {"plug_speeds": [25, 100, 10, 500],
+                 "cycle_iterations": 3,
+                 "on_timeout": 10,
+                 "off_timeout": 10,
+                 "checkpoint_every": 1}
+
+
+class TestPlan:
+    """
+    Parameters for a non-interactive test run.
+    """
+
+    def __init__(self, values, path=None):
+        """
+        :param values: Dict - Plan contents, see module docstring
+        :param path: String (optional) - File the plan was loaded from
+        """
+        missing = [key for key in ("module", "drive") if not values.get(key)]
+        if missing:
+            raise ValueError("Test plan is missing " + ", ".join(missing))
+        settings = dict(PLAN_DEFAULTS)
+        settings.update(values)
+        self.path = path
+        self.module = settings["module"]
+        self.drive = settings["drive"]
+        self.plug_speeds = [int(speed) for speed in settings["plug_speeds"]]
+        self.cycle_iterations = int(settings["cycle_iterations"])
+        self.on_timeout = float(settings["on_timeout"])
+        self.off_timeout = float(settings["off_timeout"])
+        self.checkpoint_every = max(1, int(settings["checkpoint_every"]))
+        self.workload = settings.get("workload")
+        self.power = settings.get("power")
+        self.metrics_port = settings.get("metrics_port")
+        self.sequences = [HotplugSequence.from_dict(entry) for entry in settings.get("sequences") or []]
+        default_checkpoint = (os.path.splitext(path)[0] if path else "plan") + ".checkpoint.json"
+        self.checkpoint_path = settings.get("checkpoint", default_checkpoint)
+        self.values = settings
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as plan_file:
+            return cls(json.load(plan_file), path)
+
+    @property
+    def plan_id(self):
+        """
+        Stable hash of the test parameters, used to match a checkpoint to its plan
+        """
+        # Optional keys only count when given, so adding one to PLAN_KEYS keeps existing checkpoints valid
+        key = json.dumps({name: self.values[name] for name in PLAN_KEYS if name in self.values}, sort_keys=True)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @property
+    def total_cycles(self):
+        return len(self.sequences or self.plug_speeds) * self.cycle_iterations
+
+    def cycles(self, start=0):
+        """
+        Yield every cycle in the plan in run order, skipping those before start
+
+        :param start: int - Index of the first cycle to yield
+        :return: Generator<(int, int or HotplugSequence, int)> - Cycle index, plug speed (mS) or timing sequence,
+                 iteration at that speed (from 0)
+        """
+        index = 0
+        for speed in self.sequences or self.plug_speeds:
+            for iteration in range(self.cycle_iterations):
+                if index >= start:
+                    yield index, speed, iteration
+                index += 1
+
+
+class Checkpoint:
+    """
+    Progress of a plan, saved atomically so a crash mid-write never leaves a corrupt checkpoint.
+    """
+
+    def __init__(self, path, plan_id):
+        self.path = path
+        self.plan_id = plan_id
+        self.completed = 0
+        self.finished = False
+        self.log_file = None
+        self.results_file = None
+        self.failures = []
+        self.started = time.time()
+        self.updated = None
+        self._unsaved = 0
+
+    @classmethod
+    def load_or_create(cls, plan):
+        """
+        Load the checkpoint for a plan, or start a new one if there is none or it belongs to a different plan
+
+        :param plan: TestPlan obj
+        :return: Checkpoint obj
+        """
+        checkpoint = cls(plan.checkpoint_path, plan.plan_id)
+        try:
+            with open(plan.checkpoint_path) as checkpoint_file:
+                values = json.load(checkpoint_file)
+        except (OSError, ValueError):
+            return checkpoint
+        if values.get("plan_id") != plan.plan_id or values.get("finished"):
+            return checkpoint
+        for name in ("completed", "log_file", "results_file", "failures", "started", "updated"):
+            if name in values:
+                setattr(checkpoint, name, values[name])
+        return checkpoint
+
+    @property
+    def resumed(self):
+        return self.completed > 0
+
+    def cycle_done(self, index, every=1):
+        """
+        Record a completed cycle, saving every <every> cycles
+
+        :param index: int - Index of the cycle just completed
+        :param every: int - Save interval in cycles
+        """
+        self.completed = index + 1
+        self._unsaved += 1
+        if self._unsaved >= every:
+            self.save()
+
+    def finish(self):
+        self.finished = True
+        self.save()
+
+    def save(self):
+        self.updated = time.time()
+        values = {"plan_id": self.plan_id,
+                  "completed": self.completed,
+                  "finished": self.finished,
+                  "log_file": self.log_file,
+                  "results_file": self.results_file,
+                  "failures": self.failures,
+                  "started": self.started,
+                  "updated": self.updated}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump(values, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.path)
+        self._unsaved = 0
@@ -0,0 +1,140 @@
+'''
+Adaptive threshold search for the AN-003 hotplug test.
+
+Finds the plug speed at which a drive starts to fail by bisecting a delay range instead of sweeping a fixed grid.
+Each probed delay is run for a few cycles (stopping at the first failure), and once the bracket is narrowed to the
+requested resolution the passing side of the boundary is re-run more times to confirm it.  A failed confirmation
+moves the boundary and the search carries on, so an intermittent pass can't be reported as the threshold.
+'''
+
+
+class SearchResult:
+    """
+    Outcome of a threshold search.
+    """
+
+    def __init__(self):
+        self.found = False
+        # Closest delays (mS) either side of the boundary
+        self.pass_delay = None
+        self.fail_delay = None
+        self.cycles = 0
+        # Cycles that could not be judged (e.g. lost to a module error) and were run again
+        self.inconclusive = 0
+        self.aborted = False
+        # delay -> [passes, failures]
+        self.tallies = {}
+
+    def describe(self):
+        if self.found:
+            text = "Failure boundary between " + str(self.pass_delay) + "mS (pass) and " + \
+                   str(self.fail_delay) + "mS (fail)"
+        elif self.aborted:
+            text = "Search stopped at the cycle limit before a boundary was confirmed"
+        elif self.pass_delay is not None:
+            text = "No failures found in range"
+        else:
+            text = "Drive failed across the whole range"
+        text += ", " + str(self.cycles) + " cycles"
+        if self.inconclusive:
+            text += " (" + str(self.inconclusive) + " inconclusive)"
+        return text
+
+
+class ThresholdSearch:
+    """
+    Bisects a delay range for the boundary between passing and failing plug speeds.
+    """
+
+    def __init__(self, run_cycle, low, high, resolution=1, repeats=1, boundary_repeats=5, max_cycles=200):
+        """
+        :param run_cycle: callable(int) -> Boolean - Runs one hotplug cycle at the given delay (mS), True on pass,
+                          None if the cycle could not be judged (it is then run again, within max_cycles)
+        :param low: int - Lower end of the delay range (mS)
+        :param high: int - Upper end of the delay range (mS)
+        :param resolution: int - Stop narrowing once the boundary is bracketed to within this many mS
+        :param repeats: int - Cycles run at each probed delay (a single failure marks the delay as failing)
+        :param boundary_repeats: int - Cycles the passing side of the boundary must pass to be confirmed
+        :param max_cycles: int - Hard limit on the number of cycles for the whole search
+        """
+        if low >= high:
+            raise ValueError("Search range low must be less than high")
+        self.run_cycle = run_cycle
+        self.low = low
+        self.high = high
+        self.resolution = max(1, resolution)
+        self.repeats = max(1, repeats)
+        self.boundary_repeats = max(self.repeats, boundary_repeats)
+        self.max_cycles = max_cycles
+        self.result = SearchResult()
+
+    def _evaluate(self, delay, count):
+        """
+        Run up to <count> passing cycles at a delay, stopping at the first failure.  Earlier passes count.
+
+        :return: Boolean - True if the delay has passed at least <count> times without ever failing
+        """
+        tally = self.result.tallies.setdefault(delay, [0, 0])
+        while tally[1] == 0 and tally[0] < count:
+            if self.result.cycles >= self.max_cycles:
+                raise _CycleLimit()
+            self.result.cycles += 1
+            passed = self.run_cycle(delay)
+            if passed is None:
+                self.result.inconclusive += 1
+            elif passed:
+                tally[0] += 1
+            else:
+                tally[1] += 1
+        return tally[1] == 0
+
+    def _nearest_pass(self, fail_delay, pass_side):
+        """
+        Closest delay on the passing side of fail_delay that has not failed.
+        """
+        candidates = [d for d, (passes, fails) in self.result.tallies.items()
+                      if passes and not fails and (d - fail_delay) * pass_side > 0]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda d: abs(d - fail_delay))
+
+    def run(self):
+        """
+        :return: SearchResult obj
+        """
+        result = self.result
+        try:
+            low_ok = self._evaluate(self.low, self.repeats)
+            high_ok = self._evaluate(self.high, self.repeats)
+            if low_ok == high_ok:
+                # No boundary inside the range
+                result.pass_delay = self.low if low_ok else None
+                return result
+            pass_delay, fail_delay = (self.low, self.high) if low_ok else (self.high, self.low)
+            pass_side = 1 if pass_delay > fail_delay else -1
+
+            while True:
+                while abs(pass_delay - fail_delay) > self.resolution:
+                    mid = (pass_delay + fail_delay) // 2
+                    if self._evaluate(mid, self.repeats):
+                        pass_delay = mid
+                    else:
+                        fail_delay = mid
+                if self._evaluate(pass_delay, self.boundary_repeats):
+                    break
+                # The passing side didn't hold up, the boundary is further over
+                fail_delay = pass_delay
+                pass_delay = self._nearest_pass(fail_delay, pass_side)
+                if pass_delay is None:
+                    result.pass_delay = None
+                    return result
+            result.found = True
+            result.pass_delay = pass_delay
+            result.fail_delay = fail_delay
+        except _CycleLimit:
+            result.aborted = True
+        return result
+
+
+class _CycleLimit(Exception):
+    pass